@@ -1,4 +1,4 @@
-from typing import Generator
+from typing import Generator, Optional
 
 from loguru import logger
 
@@ -7,8 +7,20 @@ class BotAdapter:
     """Defines a common interface for all Chatbots"""
     preset_name: str = "default"
 
+    stop_requested: bool = False
+    """The user asked to stop the reply being generated"""
+
+    waiting_upstream: bool = False
+    """Waiting for the next part of the reply, the request can be cancelled safely"""
+
+    token_usage: Optional[int] = None
+    """
+    Tokens used by the last request (prompt and completion), 0 when the upstream did not accept it,
+    None when the adapter cannot tell
+    """
+
     def get_queue_info(self): ...
-    """Get internal queue"""
+    """Get internal queue (a utils.RequestQueue)"""
 
     def __init__(self, session_id: str = "unknown"):
         self.supported_models = []
@@ -18,6 +30,10 @@ class BotAdapter:
     async def ask(self, msg: str) -> Generator[str, None, None]: ...
     """Send a message to AI"""
 
+    def estimate_tokens(self, msg: str) -> int:
+        """Estimate the tokens a request will use before sending it, used to pre-check the token quota"""
+        return len(msg)
+
     async def rollback(self): ...
     """Roll back conversation"""
 
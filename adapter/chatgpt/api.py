@@ -1,3 +1,4 @@
+import asyncio
 import json
 import time
 import aiohttp
@@ -8,7 +9,8 @@ from typing import AsyncGenerator
 
 from adapter.botservice import BotAdapter
 from config import OpenAIAPIKey
-from constants import botManager, config
+from constants import botManager, config, concurrencyLimiter
+from exceptions import UpstreamHTTPException
 
 DEFAULT_ENGINE: str = "gpt-3.5-turbo"
 
@@ -58,15 +60,23 @@ class OpenAIChatbot:
             logger.warning("An error occurred! The returned message is empty and is not added to the session.")
             raise ValueError("An error occurred! The returned message is empty and is not added to the session.")
 
-    # https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
-    def count_tokens(self, session_id: str = "default", model: str = DEFAULT_ENGINE):
-        """Return the number of tokens used by a list of messages."""
+    @staticmethod
+    def get_encoding(model: str = DEFAULT_ENGINE):
         if model is None:
             model = DEFAULT_ENGINE
         try:
-            encoding = tiktoken.encoding_for_model(model)
+            return tiktoken.encoding_for_model(model)
         except KeyError:
-            encoding = tiktoken.get_encoding("cl100k_base")
+            return tiktoken.get_encoding("cl100k_base")
+
+    def count_text_tokens(self, text: str, model: str = DEFAULT_ENGINE) -> int:
+        """Return the number of tokens of a text."""
+        return len(self.get_encoding(model).encode(text))
+
+    # https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
+    def count_tokens(self, session_id: str = "default", model: str = DEFAULT_ENGINE):
+        """Return the number of tokens used by a list of messages."""
+        encoding = self.get_encoding(model)
 
         tokens_per_message = 4
         tokens_per_name = 1
@@ -187,6 +197,7 @@ class ChatGPTAPIAdapter(BotAdapter):
         logger.debug(f"[ChatGPT-API: {self.bot.engine}] use token amount : {total_tokens}")
         if total_tokens is None:
             raise Exception("Response does not contain 'total_tokens'")
+        self.token_usage = (self.token_usage or 0) + total_tokens
 
         content = result.get('choices', [{}])[0].get('message', {}).get('content', None)
         logger.debug(f"[ChatGPT-API:{self.bot.engine}] response: {content}")
@@ -210,8 +221,8 @@ class ChatGPTAPIAdapter(BotAdapter):
                                                     data=json.dumps(data), proxy=proxy) as resp:
                     if resp.status != 200:
                         response_text = await resp.text()
-                        raise Exception(
-                            f"{resp.status} {resp.reason} {response_text}",
+                        raise UpstreamHTTPException(
+                            resp.status, f"{resp.status} {resp.reason} {response_text}",
                         )
                     return await self._process_response(resp, session_id)
 
@@ -224,14 +235,27 @@ class ChatGPTAPIAdapter(BotAdapter):
                                         proxy=proxy) as resp:
                     if resp.status != 200:
                         response_text = await resp.text()
-                        raise Exception(
-                            f"{resp.status} {resp.reason} {response_text}",
+                        raise UpstreamHTTPException(
+                            resp.status, f"{resp.status} {resp.reason} {response_text}",
                         )
 
                     response_role: str = ''
                     completion_text: str = ''
 
-                    async for line in resp.content:
+                    while not self.stop_requested:
+                        try:
+                            self.waiting_upstream = True
+                            line = await resp.content.readline()
+                        except asyncio.CancelledError:
+                            if not self.stop_requested:
+                                raise
+                            # Stopped by the user, the reply ends with what has been received
+                            asyncio.current_task().uncancel()
+                            break
+                        finally:
+                            self.waiting_upstream = False
+                        if not line:
+                            break
                         try:
                             line = line.decode('utf-8').strip()
                             if not line.startswith("data: "):
@@ -261,7 +285,10 @@ class ChatGPTAPIAdapter(BotAdapter):
                                     completion_text += event_text
                                     self.latest_role = response_role
                                     yield event_text
-        self.bot.add_to_conversation(completion_text, response_role, session_id)
+        if self.stop_requested and not completion_text:
+            return
+        # When stopped, the partial reply is kept in the history
+        self.bot.add_to_conversation(completion_text, response_role or 'assistant', session_id)
 
     async def compressed_session(self, session_id: str):
         if session_id not in self.bot.conversation or not self.bot.conversation[session_id]:
@@ -286,6 +313,9 @@ class ChatGPTAPIAdapter(BotAdapter):
 
     async def ask(self, prompt: str) -> AsyncGenerator[str, None]:
         """Send a message to api and return the response with stream."""
+        self.stop_requested = False
+        # Nothing is charged unless the upstream accepted the request
+        self.token_usage = 0
 
         self.manage_conversation(self.session_id, prompt)
 
@@ -294,33 +324,65 @@ class ChatGPTAPIAdapter(BotAdapter):
 
         event_time = None
 
-        try:
-            if self.bot.engine not in self.supported_models:
-                logger.warning(f"The current model is an unofficially supported model. Please pay attention to the console output. The currently used model is {self.bot.engine}")
-            logger.debug(f"[Try using ChatGPT-API:{self.bot.engine}] ask: {prompt}")
-            self.bot.add_to_conversation(prompt, "user", session_id=self.session_id)
-            start_time = time.time()
-
-            full_response = ''
-
-            if config.openai.gpt_params.stream:
-                async for resp in self.request_with_stream(session_id=self.session_id):
-                    full_response += resp
-                    yield full_response
-
-                token_count = self.bot.count_tokens(self.session_id, self.bot.engine)
-                logger.debug(f"[ChatGPT-API:{self.bot.engine}] response:{full_response}")
-                logger.debug(f"[ChatGPT-API:{self.bot.engine}] Use token amount: {token_count}")
-            else:
-                yield await self.request(session_id=self.session_id)
-            event_time = time.time() - start_time
-            if event_time is not None:
-                logger.debug(f"[ChatGPT-API:{self.bot.engine}] It took to receive all the messages{event_time:.2f}")
-
-        except Exception as e:
-            logger.error(f"[ChatGPT-API:{self.bot.engine}] Request failed: \n{e}")
-            yield f"An error occurred: \n{e}"
-            raise
+        # Rejected right away when the upstream is saturated, before anything is added to the conversation
+        async with concurrencyLimiter.acquire() as latency:
+            try:
+                if self.bot.engine not in self.supported_models:
+                    logger.warning(f"The current model is an unofficially supported model. Please pay attention to the console output. The currently used model is {self.bot.engine}")
+                logger.debug(f"[Try using ChatGPT-API:{self.bot.engine}] ask: {prompt}")
+                self.bot.add_to_conversation(prompt, "user", session_id=self.session_id)
+                start_time = time.time()
+
+                full_response = ''
+
+                if config.openai.gpt_params.stream:
+                    prompt_tokens = self.bot.count_tokens(self.session_id, self.bot.engine)
+                    try:
+                        async for resp in self.request_with_stream(session_id=self.session_id):
+                            latency.mark_first_token()
+                            full_response += resp
+                            yield full_response
+                    finally:
+                        # The stream has no usage, the prompt and what was generated of the completion are
+                        # charged, also when the reply broke off, nothing when no token came back
+                        if full_response:
+                            self.token_usage = prompt_tokens + self.bot.count_text_tokens(full_response,
+                                                                                           self.bot.engine)
+
+                    logger.debug(f"[ChatGPT-API:{self.bot.engine}] response:{full_response}")
+                    logger.debug(f"[ChatGPT-API:{self.bot.engine}] Use token amount: {self.token_usage}")
+                else:
+                    self.waiting_upstream = True
+                    try:
+                        response = await self.request(session_id=self.session_id)
+                    finally:
+                        self.waiting_upstream = False
+                    yield response
+                event_time = time.time() - start_time
+                if event_time is not None:
+                    logger.debug(f"[ChatGPT-API:{self.bot.engine}] It took to receive all the messages{event_time:.2f}")
+
+            except Exception as e:
+                logger.error(f"[ChatGPT-API:{self.bot.engine}] Request failed: \n{e}")
+                yield f"An error occurred: \n{e}"
+                raise
+            finally:
+                # Also runs when the request is cancelled or the generator is closed between two replies,
+                # the user turn is dropped unless an answer made it to the history
+                self.drop_unfinished_turn(prompt)
+
+    def estimate_tokens(self, msg: str) -> int:
+        prompt_tokens = self.bot.count_text_tokens(msg, self.bot.engine)
+        if self.session_id not in self.bot.conversation:
+            return prompt_tokens
+        return self.bot.count_tokens(self.session_id, self.bot.engine) + prompt_tokens
+
+    def drop_unfinished_turn(self, prompt: str):
+        """Remove the user message of a request that got no answer"""
+        conversation = self.bot.conversation.get(self.session_id)
+        if conversation and conversation[-1] == {"role": "user", "content": prompt}:
+            conversation.pop()
+            logger.debug(f"[ChatGPT-API:{self.bot.engine}] The request got no answer, the unfinished turn is rolled back")
 
     async def preset_ask(self, role: str, text: str):
         self.bot.engine = self.current_model
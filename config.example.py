@@ -104,6 +104,21 @@ class OpenAIAPIKey(OpenAIAuthBase):
     """OpenAI api_key"""
 
 
+class ImageOutput(BaseModel):
+    format: Literal["png", "jpeg", "webp"] = "png"
+    """Format of the images sent"""
+    optimize: bool = False
+    """Let the encoder look for a smaller file, slower"""
+    compress_level: int = 6
+    """PNG compression level, 0 to 9"""
+    colors: int = 0
+    """Quantize PNG images to a palette of this many colors, 0 keeps all of them"""
+    quality: int = 85
+    """JPEG and WebP quality, 1 to 100"""
+    max_bytes: int = 0
+    """Largest image the platform takes, bigger ones lose quality and then size until they fit, 0 means no limit"""
+
+
 class TextToImage(BaseModel):
     always: bool = False
     """always"""
@@ -120,6 +135,51 @@ class TextToImage(BaseModel):
     offset_y: int = 50
     """offset_y"""
     wkhtmltoimage: Union[str, None] = None
+    plain_fast_path: bool = True
+    """Draw replies without Markdown, code or math directly, instead of through wkhtmltoimage"""
+    renderer_workers: int = 2
+    """Number of long-lived Markdown renderer processes, 0 renders in a thread of the bot"""
+    renderer_max_tasks: int = 200
+    """Images the renderer processes draw before they are replaced by fresh ones, 0 keeps them forever"""
+    renderer_timeout: float = 60.0
+    """Seconds after which a renderer process is considered hung and the pool is restarted"""
+    renderer_health_check_interval: float = 60.0
+    """Seconds between two health checks of the renderer processes, 0 disables them"""
+    qrcode: Literal["off", "pastebin", "local"] = "pastebin"
+    """QR code under the image, linking to the Markdown: off, uploaded to pastebin or served by the HTTP service"""
+    qrcode_url: Union[str, None] = None
+    """Public address of the HTTP service, local QR codes link to {qrcode_url}/v1/markdown/<hash>"""
+    qrcode_timeout: float = 3.0
+    """Seconds the pastebin upload may take, images rendered before it is done go without QR code"""
+    qrcode_retry: float = 300.0
+    """Seconds before the upload of a text which failed is tried again"""
+    qrcode_cache_size: int = 1024
+    """Number of QR codes, and of texts served for the local ones, kept for reuse"""
+    highlight_cache_size: int = 256
+    """Number of highlighted code blocks kept for reuse"""
+    cache_memory_mb: int = 32
+    """Memory for the cache of rendered images, in MB, 0 disables the cache"""
+    cache_path: Union[str, None] = None
+    """Folder of the on-disk tier of the image cache, None keeps the images in memory only"""
+    cache_disk_mb: int = 512
+    """Disk space for the on-disk tier of the image cache, in MB"""
+    cache_ttl: int = 86000
+    """Seconds a cached image is reused, its QR code points to a paste that expires after a day"""
+    output: Dict[str, ImageOutput] = {
+        "telegram": ImageOutput(max_bytes=10 * 1024 * 1024),
+        "discord": ImageOutput(max_bytes=8 * 1024 * 1024),
+    }
+    """Encoding of the images sent to each platform (telegram, discord, http)"""
+    default_output: ImageOutput = ImageOutput()
+    """Encoding of the images sent to the platforms not in output, the default sends the PNG as it is rendered"""
+    encode_workers: int = 2
+    """Threads encoding the images to the output format"""
+    parallel_renders: int = 4
+    """Images rendered at the same time, across all the replies"""
+    page_height: int = 4000
+    """Long replies are cut between blocks into images of about this height in pixels, 0 keeps them whole"""
+    max_pages: int = 10
+    """Most images a reply is cut into, the last one takes whatever is left"""
 
 
 class TextToSpeech(BaseModel):
@@ -138,6 +198,8 @@ class AzureConfig(BaseModel):
     """TTS KEY"""
     tts_speech_service_region: Optional[str] = None
     """TTS Region"""
+    tts_workers: int = 4
+    """Texts synthesized at the same time, also the number of synthesizers kept per voice"""
 
 
 
@@ -158,6 +220,8 @@ class Trigger(BaseModel):
     """Command to reset the session"""
     rollback_command: List[str] = ["rollback"]
     """The command to roll back the session"""
+    stop_command: List[str] = ["stop"]
+    """The command to stop the reply being generated"""
     prefix_image: List[str] = ["draw", "нарисуй"]
     """Image creation prefix"""
     switch_model: str = r"switch_model (.+)"
@@ -181,8 +245,12 @@ class Trigger(BaseModel):
     """allowed_models"""
     allow_switching_ai: bool = True
     """allow_switching_ai"""
+    allow_switching_supersede: bool = False
+    """Allow everyone in a group to turn the latest-wins mode on or off, otherwise only the administrator can"""
     ping_command: List[str] = ["ping"]
     """ping_command"""
+    supersede_command: List[str] = ["latest_wins"]
+    """Turn on or off the latest-wins mode of the current chat"""
 
 
 class Response(BaseModel):
@@ -192,6 +260,18 @@ class Response(BaseModel):
     buffer_delay: float = 15
     """buffer_delay"""
 
+    batch_window: float = 0.2
+    """Seconds the streamed text is gathered before it goes through the renderers, 0 renders every token"""
+
+    batch_size: int = 64
+    """Characters gathered after which the streamed text goes through the renderers anyway"""
+
+    max_message_length: Dict[str, int] = {"telegram": 4096, "discord": 2000}
+    """Longest text message of each platform (telegram, discord, http), replies are merged up to it"""
+
+    default_max_message_length: int = 1500
+    """Longest text message of the platforms not in max_message_length"""
+
     default_ai: Union[str, None] = None
     """default_ai"""
 
@@ -228,6 +308,9 @@ class Response(BaseModel):
     rollback_fail = "The rollback failed, and there was no earlier record! If you want to start over, please send: {reset}"
     """rollback_fail"""
 
+    stop_nothing = "There is no reply to stop."
+    """stop_nothing"""
+
     quote: bool = True
     """Do you reply to the triggered message?"""
 
@@ -255,6 +338,9 @@ class Response(BaseModel):
     queued_notice: str = "The message has been received! At present, I still have {queue_size} messages to reply to. Please wait a moment. "
     """ queued_notice : queue_size """
 
+    supersede: bool = False
+    """Latest wins: a new message of a user cancels their unfinished request, can be switched per chat"""
+
     ping_response: str = "AI {current_ai} / current_voice: {current_voice}" \
                          "\nAI \n{supported_ai}"
     """ping"""
@@ -262,6 +348,44 @@ class Response(BaseModel):
     """ping tts"""
 
 
+class ConcurrencyLimit(BaseModel):
+    enabled: bool = False
+    """Adapt the number of in-flight upstream requests to the upstream latency"""
+    initial_limit: int = 20
+    """initial_limit"""
+    min_limit: int = 2
+    """min_limit"""
+    max_limit: int = 200
+    """max_limit"""
+    tolerance: float = 1.5
+    """How much slower than the baseline the upstream may get before the limit shrinks"""
+    smoothing: float = 0.2
+    """smoothing"""
+    short_window: int = 10
+    """Number of requests averaged in the recent latency"""
+    long_window: int = 600
+    """Number of requests averaged in the baseline latency"""
+    backoff_ratio: float = 0.9
+    """The limit is multiplied by this after a failed upstream request"""
+
+
+class FairQueue(BaseModel):
+    enabled: bool = False
+    """Share the upstream between chats with weighted fair queueing"""
+    max_concurrent: int = 16
+    """Requests processed at the same time across all chats, 0 means no limit"""
+    chat_weights: Dict[str, float] = {}
+    """Weight of a chat, e.g. "group-123" = 2.0, 1.0 by default"""
+    tenants: Dict[str, str] = {}
+    """Tenant of a chat, e.g. "group-123" = "acme". Chats without a tenant are a tenant of their own"""
+    tenant_weights: Dict[str, float] = {}
+    """Weight of a tenant, 1.0 by default"""
+    tenant_max_concurrent: Dict[str, int] = {}
+    """Requests of a tenant processed at the same time"""
+    default_tenant_max_concurrent: int = 0
+    """Cap of the tenants not listed in tenant_max_concurrent, 0 means no cap"""
+
+
 class System(BaseModel):
     accept_group_invite: bool = False
     """Automatically receive invitation requests"""
@@ -289,15 +413,43 @@ class Ratelimit(BaseModel):
     warning_msg: str = "\n\nWarning: The quota is about to run out! \n Currently sent: {usage} messages, the maximum limit is {limit} messages/hour, please adjust your rhythm. \n The quota limit is reset at the hour, and the current server time: {current_time}"
     """warning_msg"""
 
-    exceed: str = "The quota limit has been reached. Please wait for the next hour to continue talking to me."
+    exceed: str = "The quota limit has been reached. Please wait {wait} to continue talking to me."
     """exceed"""
 
     draw_warning_msg: str = "\n\nWarning: The quota is about to run out! \nAt present, it has been drawn: {usage} pictures, the maximum limit is {limit} pictures/hour, please adjust your rhythm. \nThe quota limit is reset at the hour, and the current server time: {current_time}"
     """draw_warning_msg"""
 
-    draw_exceed: str = "The quota limit has been reached. Please wait for the next hour before using the drawing function."
+    draw_exceed: str = "The quota limit has been reached. Please wait {wait} before using the drawing function."
     """draw_exceed"""
 
+    token_exceed: str = "The token quota limit has been reached. Please wait {wait} to continue talking to me."
+    """Reply when the estimated tokens of a request do not fit in the token quota"""
+
+    backend: Literal["json", "sqlite"] = "json"
+    """
+    json: quotas kept in memory and written to the data/*.json files, for a single bot process;
+    sqlite: quotas shared by all the bot processes of the host in a SQLite database (WAL)
+    """
+
+    sqlite_path: str = "data/ratelimit.db"
+    """Database of the sqlite backend, the JSON quota files are imported into it when it is created"""
+
+    sqlite_busy_timeout: float = 0.25
+    """Seconds a quota check waits while other bot processes write the database, the request is refused after that"""
+
+    flush_interval: float = 5.0
+    """How often, in seconds, the changed quotas are written to disk (json backend)"""
+
+    algorithm: Literal["fixed", "sliding", "token_bucket"] = "fixed"
+    """
+    Default algorithm of the limits which do not set one.
+    fixed: counter reset at the hour, allows up to twice the rate around the hour;
+    sliding: hourly sliding window; token_bucket: refilled at the rate, bursts up to the burst size
+    """
+
+    burst: int = 0
+    """Default burst size of the token bucket, 0 means the rate"""
+
 class SDWebUI(BaseModel):
     api_url: str
     """API http://127.0.0.1:7890"""
@@ -343,6 +495,8 @@ class Config(BaseModel):
     system: System = System()
     presets: Preset = Preset()
     ratelimit: Ratelimit = Ratelimit()
+    concurrency: ConcurrencyLimit = ConcurrencyLimit()
+    fair_queue: FairQueue = FairQueue()
 
      # === External Utilities ===
     sdwebui: Optional[SDWebUI] = None
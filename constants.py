@@ -2,12 +2,15 @@ from enum import Enum
 
 from config import Config
 from manager.bot import BotManager
+from manager.concurrency import AdaptiveConcurrencyLimiter
 
 config = Config.load_config()
 config.scan_presets()
 
 botManager = BotManager(config)
 
+concurrencyLimiter = AdaptiveConcurrencyLimiter(config.concurrency)
+
 
 class LlmName(Enum):
     ChatGPT_Api = "chatgpt-api"
@@ -1,3 +1,4 @@
+import asyncio
 import contextlib
 import time
 from datetime import datetime
@@ -13,7 +14,7 @@ from loguru import logger
 from adapter.botservice import BotAdapter
 from adapter.chatgpt.api import ChatGPTAPIAdapter
 
-from constants import LlmName
+from constants import LlmName, BotPlatform
 from constants import config
 
 from drawing import DrawingAPI, SDWebUI as SDDrawing, OpenAI as OpenAIDrawing
@@ -24,11 +25,13 @@ from exceptions import PresetNotFoundException, BotTypeNotFoundException, NoAvai
 from middlewares.draw_ratelimit import MiddlewareRatelimit
 
 from renderer import Renderer
+from renderer.batcher import DeltaBatcher
 from renderer.merger import BufferedContentMerger, LengthContentMerger
 from renderer.renderer import MixedContentMessageChainRenderer, MarkdownImageRenderer, PlainTextRenderer
 from renderer.splitter import MultipleSegmentSplitter
 
 from utils import retry
+from utils.asyncutils import Relay
 from utils.text_to_speech import TtsVoice, TtsVoiceManager
 
 handlers = {}
@@ -59,6 +62,9 @@ class ConversationContext:
     conversation_voice: TtsVoice = None
     """Voice """
 
+    answering: Optional[asyncio.Task] = None
+    """Producer task reading the reply from the adapter, the one a stop interrupts"""
+
     @property
     def current_model(self):
         return self.adapter.current_model
@@ -67,9 +73,12 @@ class ConversationContext:
     def supported_models(self):
         return self.adapter.supported_models
 
-    def __init__(self, _type: str, session_id: str):
+    def __init__(self, _type: str, session_id: str, platform: Optional[BotPlatform] = None):
         self.session_id = session_id
 
+        self.platform = platform
+        """Platform the replies are sent to"""
+
         self.last_resp = ''
 
         self.last_resp_time = -1
@@ -96,6 +105,13 @@ class ConversationContext:
             with contextlib.suppress(NoAvailableBotException):
                 self.drawing_adapter = OpenAIDrawing(self.session_id)
 
+    @property
+    def max_message_length(self) -> int:
+        if self.platform is None:
+            return config.response.default_max_message_length
+        return config.response.max_message_length.get(self.platform.value,
+                                                      config.response.default_max_message_length)
+
     def switch_renderer(self, mode: Optional[str] = None):
         # Currently this is the only one
         self.splitter = MultipleSegmentSplitter()
@@ -103,19 +119,20 @@ class ConversationContext:
         if config.response.buffer_delay > 0:
             self.merger = BufferedContentMerger(self.splitter)
         else:
-            self.merger = LengthContentMerger(self.splitter)
+            self.merger = LengthContentMerger(self.splitter, self.max_message_length)
 
         if not mode:
             mode = "image" if config.text_to_image.default or config.text_to_image.always else config.response.mode
 
+        platform = self.platform.value if self.platform else None
         if mode == "image" or config.text_to_image.always:
-            self.renderer = MarkdownImageRenderer(self.merger)
+            self.renderer = MarkdownImageRenderer(self.merger, platform)
         elif mode == "mixed":
-            self.renderer = MixedContentMessageChainRenderer(self.merger)
+            self.renderer = MixedContentMessageChainRenderer(self.merger, platform)
         elif mode == "text":
             self.renderer = PlainTextRenderer(self.merger)
         else:
-            self.renderer = MixedContentMessageChainRenderer(self.merger)
+            self.renderer = MixedContentMessageChainRenderer(self.merger, platform)
         if mode != "image" and config.text_to_image.always:
             raise CommandRefusedException("Since the profile setting forces picture mode on, It won't switch to any other mode.")
 
@@ -131,15 +148,16 @@ class ConversationContext:
         # Check if it is a drawing command
         for prefix in config.trigger.prefix_image:
             if prompt.startswith(prefix):
+                # Checked before the image quota is reserved, nothing would give the reservation back
+                if not self.drawing_adapter:
+                    yield "The drawing engine is not configured and the drawing function cannot be used!"
+                    return
                 # TODO : This section can be merged into RateLimitMiddleware
                 respond_str = middlewares.handle_draw_request(self.session_id, prompt)
                 # TODO : wtf is it
                 if respond_str != "1":
                     yield respond_str
                     return
-                if not self.drawing_adapter:
-                    yield "The drawing engine is not configured and the drawing function cannot be used!"
-                    return
                 prompt = prompt.removeprefix(prefix)
                 try:
                     if chain.has(GraiaImage):
@@ -149,8 +167,9 @@ class ConversationContext:
                     for i in images:
                         yield i
                 except Exception as e:
+                    middlewares.handle_draw_failed(self.session_id)
                     raise DrawingFailedException from e
-                respond_str = middlewares.handle_draw_respond_completed(self.session_id, prompt)
+                respond_str = middlewares.handle_draw_respond_completed(self.session_id, prompt, len(images))
                 if respond_str != "1":
                     yield respond_str
                 return
@@ -163,15 +182,63 @@ class ConversationContext:
                 .replace("{date}", datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
             )
 
+        # Pre-check the token quota with an estimate, settled with the actual usage once the reply is done
+        estimate = self.adapter.estimate_tokens(prompt)
+        if respond_str := middlewares.handle_token_request(self.session_id, estimate):
+            yield respond_str
+            return
+        self.adapter.token_usage = None
+
+        batcher = DeltaBatcher(config.response.batch_window, config.response.batch_size)
         async with self.renderer:
-            async for item in self.adapter.ask(prompt):
-                if isinstance(item, Element):
-                    yield item
-                else:
-                    yield await self.renderer.render(item)
-                self.last_resp = item or ''
-                self.last_resp_time = int(time.time())
-            yield await self.renderer.result()
+            # The adapter runs in a producer task of its own, a stop only interrupts that task
+            # and what was received is still rendered and sent
+            relay = Relay(self.adapter.ask(prompt),
+                          # Wake up when the buffered content is due, even while the adapter is silent
+                          self.merger.flush_ready if isinstance(self.merger, BufferedContentMerger) else None)
+            self.answering = relay.producer
+            items = relay.items()
+            try:
+                async for item in items:
+                    if item is None:
+                        async for part in batcher.timed(self.renderer.flush_parts()):
+                            yield part
+                        continue
+                    if isinstance(item, Element):
+                        yield item
+                    elif batcher.offer(item):
+                        async for part in batcher.timed(self.renderer.render_parts(item)):
+                            yield part
+                    self.last_resp = item or ''
+                    self.last_resp_time = int(time.time())
+            finally:
+                # Waits for the adapter to roll back an unfinished turn before the next request of the chat
+                await items.aclose()
+                await relay.aclose()
+                if self.answering is relay.producer:
+                    self.answering = None
+                middlewares.handle_token_respond_completed(self.session_id, estimate, self.adapter.token_usage)
+            if self.adapter.stop_requested:
+                logger.debug(f"Conversation({self.session_id}) stopped by the user.")
+            # Flush what the renderer is still holding, stopped or not
+            if (held := batcher.take()) is not None:
+                async for part in batcher.timed(self.renderer.render_parts(held)):
+                    yield part
+            async for part in batcher.timed(self.renderer.result_parts()):
+                yield part
+            logger.debug(f"Conversation({self.session_id}) rendered {batcher.passed} of {batcher.offered} snapshots, "
+                         f"{batcher.render_cpu * 1000:.1f} ms of renderer CPU")
+
+    def stop(self) -> bool:
+        """Stop the reply being generated, returns whether there was one"""
+        task = self.answering
+        if task is None or task.done():
+            return False
+        self.adapter.stop_requested = True
+        # The task only runs the adapter, the reply received so far is still rendered and sent
+        task.cancel()
+        logger.debug(f"Conversation({self.session_id}) stop requested.")
+        return True
 
     async def rollback(self):
         resp = await self.adapter.rollback()
@@ -238,9 +305,16 @@ class ConversationHandler:
 
     session_id: str = 'unknown'
 
+    platform: Optional[BotPlatform] = None
+    """Platform of the chat window"""
+
+    supersede: bool = False
+    """Latest wins: a new message of a sender cancels their request which is still queued or running"""
+
     def __init__(self, session_id: str):
         self.conversations = {}
         self.session_id = session_id
+        self.supersede = config.response.supersede
 
     def list(self) -> List[ConversationContext]:
         ...
@@ -254,7 +328,7 @@ class ConversationHandler:
     async def first_or_create(self, _type: str):
         if _type in self.conversations:
             return self.conversations[_type]
-        conversation = ConversationContext(_type, self.session_id)
+        conversation = ConversationContext(_type, self.session_id, self.platform)
         self.conversations[_type] = conversation
         return conversation
 
@@ -263,7 +337,7 @@ class ConversationHandler:
     async def create(self, _type: str):
         if _type in self.conversations:
             return self.conversations[_type]
-        conversation = ConversationContext(_type, self.session_id)
+        conversation = ConversationContext(_type, self.session_id, self.platform)
         self.conversations[_type] = conversation
         return conversation
 
@@ -276,7 +350,9 @@ class ConversationHandler:
         return False
 
     @classmethod
-    async def get_handler(cls, session_id: str):
+    async def get_handler(cls, session_id: str, platform: Optional[BotPlatform] = None):
         if session_id not in handlers:
             handlers[session_id] = ConversationHandler(session_id)
+        if platform is not None:
+            handlers[session_id].platform = platform
         return handlers[session_id]
\ No newline at end of file
@@ -26,6 +26,21 @@ class BotRatelimitException(Exception):
 class APIKeyNoFundsError(Exception): ...
 
 
+class UpstreamOverloadedException(Exception):
+    limit: int
+
+    def __init__(self, limit):
+        self.limit = limit
+
+
+class UpstreamHTTPException(Exception):
+    status: int
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
 class DrawingFailedException(Exception):
     def __init__(self):
         self.__cause__ = None
\ No newline at end of file
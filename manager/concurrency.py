@@ -0,0 +1,143 @@
+import asyncio
+import contextlib
+import math
+import time
+from typing import Optional
+
+import aiohttp
+from loguru import logger
+
+from config import ConcurrencyLimit
+from exceptions import UpstreamHTTPException, UpstreamOverloadedException
+from utils import metrics
+
+
+class LatencyMeasurement:
+    """Latency of a single upstream request"""
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.first_token: Optional[float] = None
+        """Time to first token, in seconds"""
+
+    def mark_first_token(self):
+        if self.first_token is None:
+            self.first_token = time.monotonic() - self.start
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start
+
+
+def is_overload(e: BaseException) -> bool:
+    """Whether a failed request tells the upstream is saturated, errors caused by the request itself do not"""
+    if isinstance(e, UpstreamHTTPException):
+        return e.status == 429 or e.status >= 500
+    return isinstance(e, (asyncio.TimeoutError, aiohttp.ClientConnectionError, ConnectionError))
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Limits the number of in-flight upstream requests.
+    The limit follows the latency gradient (like gradient2 of Netflix concurrency-limits):
+    it grows while the short-term latency stays close to the long-term baseline,
+    shrinks when the upstream gets slower, and backs off multiplicatively on failures.
+    """
+
+    def __init__(self, settings: ConcurrencyLimit):
+        self.settings = settings
+        self.limit = float(settings.initial_limit)
+        self.inflight = 0
+        self.short_rtt: Optional[float] = None
+        """Recent latency (exponential moving average)"""
+        self.long_rtt: Optional[float] = None
+        """Baseline latency (exponential moving average over a long window)"""
+        self.gradient = 1.0
+        self.last_ttft: Optional[float] = None
+        self.last_completion: Optional[float] = None
+        self.shed = 0
+        """Requests rejected because the limit was reached"""
+        self.dropped = 0
+        """Requests that failed because the upstream is overloaded"""
+        self.errors = 0
+        """Requests that failed for another reason, they leave the limit alone"""
+        metrics.register("concurrency", self.snapshot)
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        """Reserve a slot for an upstream request, rejecting it right away when the limit is reached"""
+        if not self.settings.enabled:
+            yield LatencyMeasurement()
+            return
+        if self.inflight >= int(self.limit):
+            self.shed += 1
+            logger.debug(f"[Concurrency] Limit {int(self.limit)} reached, shedding the request.")
+            raise UpstreamOverloadedException(int(self.limit))
+        self.inflight += 1
+        measurement = LatencyMeasurement()
+        try:
+            yield measurement
+        except Exception as e:
+            if is_overload(e):
+                self.on_dropped()
+            else:
+                self.errors += 1
+            raise
+        else:
+            self.on_sample(measurement)
+        finally:
+            self.inflight -= 1
+
+    def on_sample(self, measurement: LatencyMeasurement):
+        """Adjust the limit with the latency of a completed request"""
+        self.last_completion = measurement.elapsed
+        if measurement.first_token is not None:
+            self.last_ttft = measurement.first_token
+        # Time to first token does not depend on the length of the answer, prefer it when available
+        rtt = measurement.first_token if measurement.first_token is not None else measurement.elapsed
+        if rtt <= 0:
+            return
+
+        if self.long_rtt is None:
+            self.short_rtt = self.long_rtt = rtt
+            return
+        self.short_rtt = self.short_rtt + (rtt - self.short_rtt) * 2 / (self.settings.short_window + 1)
+        self.long_rtt = self.long_rtt + (rtt - self.long_rtt) * 2 / (self.settings.long_window + 1)
+        # The baseline recovers quickly once the upstream is fast again
+        if self.long_rtt / self.short_rtt > 2:
+            self.long_rtt *= 0.95
+
+        self.gradient = max(0.5, min(1.0, self.settings.tolerance * self.long_rtt / self.short_rtt))
+
+        # Do not grow the limit when it is not being used
+        if self.inflight < self.limit / 2 and self.gradient >= 1.0:
+            return
+
+        new_limit = self.limit * self.gradient + math.sqrt(self.limit)
+        self.update_limit(self.limit * (1 - self.settings.smoothing) + new_limit * self.settings.smoothing)
+
+    def on_dropped(self):
+        """Back off after a failed upstream request"""
+        self.dropped += 1
+        self.update_limit(self.limit * self.settings.backoff_ratio)
+
+    def update_limit(self, new_limit: float):
+        new_limit = max(self.settings.min_limit, min(self.settings.max_limit, new_limit))
+        if int(new_limit) != int(self.limit):
+            logger.debug(f"[Concurrency] Limit {int(self.limit)} -> {int(new_limit)}, gradient {self.gradient:.2f}")
+        self.limit = new_limit
+
+    def snapshot(self):
+        return {
+            "enabled": self.settings.enabled,
+            "limit": int(self.limit),
+            "inflight": self.inflight,
+            "gradient": self.gradient,
+            "short_rtt": self.short_rtt,
+            "long_rtt": self.long_rtt,
+            "last_time_to_first_token": self.last_ttft,
+            "last_completion_latency": self.last_completion,
+            "shed": self.shed,
+            "dropped": self.dropped,
+            "errors": self.errors,
+        }
@@ -1,133 +1,584 @@
+import atexit
+import contextlib
+import json
+import os
+import queue
+import sqlite3
+import threading
 import time
-from tinydb import TinyDB, Query
-from tinydb.operations import increment
-from tinydb.table import Document
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from loguru import logger
+
+from constants import config
+
+
+class QuotaTable:
+    """
+    Records of a quota file, indexed by (type, id) and written back to disk in the background.
+    Without a path the records are only kept in memory
+    """
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.records: Dict[Tuple[str, str], dict] = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """Read the file, which keeps the TinyDB layout so older data stays usable"""
+        if not self.path or not os.path.exists(self.path) or os.path.getsize(self.path) <= 0:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                documents = json.load(f).get("_default", {})
+        except (OSError, ValueError) as e:
+            logger.error(f"[RateLimit] Failed to load {self.path}: {e}")
+            return
+        for _, document in sorted(documents.items(), key=lambda item: int(item[0])):
+            self.records[(document["type"], document["id"])] = document
+
+    def get(self, _type: str, _id: str) -> Optional[dict]:
+        return self.records.get((_type, _id))
+
+    def put(self, record: dict) -> dict:
+        with self.lock:
+            self.records[(record["type"], record["id"])] = record
+            self.dirty = True
+        return record
+
+    def modify(self, _type: str, _id: str, change: Callable[[Optional[dict]], Optional[dict]]):
+        """Replace a record with change(record) atomically, change returns None to leave it as it is"""
+        with self.lock:
+            record = change(self.records.get((_type, _id)))
+            if record is not None:
+                self.records[(_type, _id)] = record
+                self.dirty = True
+
+    def modify_later(self, _type: str, _id: str, change: Callable[[Optional[dict]], Optional[dict]]):
+        """The records are in memory, the change is made right away"""
+        self.modify(_type, _id, change)
+
+    def all(self) -> List[dict]:
+        return list(self.records.values())
+
+    def flush(self):
+        """Write the records if they changed, replacing the file atomically"""
+        with self.lock:
+            if not self.dirty or not self.path:
+                return
+            documents = {str(i): dict(record) for i, record in enumerate(self.records.values(), start=1)}
+            self.dirty = False
+        temp_path = f"{self.path}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"_default": documents}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logger.error(f"[RateLimit] Failed to save {self.path}: {e}")
+            with self.lock:
+                self.dirty = True
+
+
+class SQLiteQuotaTable:
+    """
+    Records of a quota table in a SQLite database shared by all the bot processes of the host.
+    WAL lets readers go on while a process writes, each change is a read-modify-write in its own transaction.
+    The checked changes give up after busy_timeout instead of holding the event loop while other processes write,
+    the other changes are made by a writer thread of the table which waits as long as it takes
+    """
+
+    def __init__(self, path: str, name: str, import_from: Optional[str] = None, busy_timeout: float = 0.25):
+        self.path = path
+        self.name = name
+        self.lock = threading.Lock()
+        self.conn = self.connect(busy_timeout)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS {name} "
+                          f"(type TEXT NOT NULL, id TEXT NOT NULL, data TEXT NOT NULL, PRIMARY KEY (type, id))")
+        self.writes: "queue.Queue[Tuple[str, str, Callable]]" = queue.Queue()
+        self.writer: Optional[threading.Thread] = None
+        if import_from:
+            self.import_records(import_from)
+
+    def connect(self, timeout: float) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=timeout, isolation_level=None, check_same_thread=False)
+
+    def import_records(self, path: str):
+        """Take over the records of a JSON quota file the first time the table is used"""
+        conn = self.connect(30)
+        try:
+            with self._transaction(conn):
+                if conn.execute(f"SELECT 1 FROM {self.name} LIMIT 1").fetchone() is not None:
+                    return
+                for record in QuotaTable(path).all():
+                    self._upsert(conn, record)
+        finally:
+            conn.close()
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _transaction(conn: sqlite3.Connection):
+        # Take the write lock up front so that concurrent read-modify-writes are serialized
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self.lock, self._transaction(self.conn) as conn:
+            yield conn
+
+    def _select(self, conn: sqlite3.Connection, _type: str, _id: str) -> Optional[dict]:
+        row = conn.execute(f"SELECT data FROM {self.name} WHERE type = ? AND id = ?", (_type, _id)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _upsert(self, conn: sqlite3.Connection, record: dict):
+        conn.execute(f"INSERT INTO {self.name} (type, id, data) VALUES (?, ?, ?) "
+                     f"ON CONFLICT (type, id) DO UPDATE SET data = excluded.data",
+                     (record["type"], record["id"], json.dumps(record)))
+
+    def get(self, _type: str, _id: str) -> Optional[dict]:
+        with self.lock:
+            return self._select(self.conn, _type, _id)
+
+    def put(self, record: dict) -> dict:
+        with self.lock:
+            self._upsert(self.conn, record)
+        return record
+
+    def modify(self, _type: str, _id: str, change: Callable[[Optional[dict]], Optional[dict]]):
+        """
+        Replace a record with change(record) atomically across processes.
+        Raises sqlite3.OperationalError when other processes hold the database longer than busy_timeout
+        """
+        with self.transaction() as conn:
+            record = change(self._select(conn, _type, _id))
+            if record is not None:
+                self._upsert(conn, record)
+
+    def modify_later(self, _type: str, _id: str, change: Callable[[Optional[dict]], Optional[dict]]):
+        """Replace a record with change(record) in the writer thread, without waiting for it"""
+        if self.writer is None:
+            self.writer = threading.Thread(target=self.write_forever, name=f"ratelimit-{self.name}", daemon=True)
+            self.writer.start()
+        self.writes.put((_type, _id, change))
+
+    def write_forever(self):
+        conn = self.connect(30)
+        while True:
+            _type, _id, change = self.writes.get()
+            try:
+                with self._transaction(conn):
+                    record = change(self._select(conn, _type, _id))
+                    if record is not None:
+                        self._upsert(conn, record)
+            except sqlite3.Error as e:
+                logger.error(f"[RateLimit] Failed to update {self.name} of {_type} {_id}: {e}")
+            finally:
+                self.writes.task_done()
+
+    def all(self) -> List[dict]:
+        with self.lock:
+            return [json.loads(data) for data, in self.conn.execute(f"SELECT data FROM {self.name}")]
+
+    def flush(self):
+        """Wait for the writer thread to commit the changes it was given"""
+        if self.writer is not None:
+            self.writes.join()
+
+
+QuotaStore = Union[QuotaTable, SQLiteQuotaTable]
+
+HOUR = 3600
+
+BUSY_WAIT = 1.0
+"""Seconds to wait given to a request refused because the quota database was busy"""
+
+
+class FixedWindow:
+    """Counter reset at the hour"""
+    name = "fixed"
+
+    def refresh(self, record: Optional[dict], _type: str, _id: str, now: float) -> dict:
+        local = time.localtime(now)
+        if record is not None and record.get('time') == local.tm_hour and record.get('day') == local.tm_mday:
+            return record
+        return {'type': _type, 'id': _id, 'algorithm': self.name, 'count': 0,
+                'time': local.tm_hour, 'day': local.tm_mday}
+
+    def used(self, record: dict, limit: dict, now: float) -> float:
+        return record['count']
+
+    def consume(self, record: dict, limit: dict, now: float, amount: float = 1) -> dict:
+        return dict(record, count=max(0, record['count'] + amount))
+
+    def wait(self, record: dict, limit: dict, now: float, amount: float = 1) -> float:
+        if record['count'] + amount <= limit['rate']:
+            return 0
+        local = time.localtime(now)
+        return HOUR - local.tm_min * 60 - local.tm_sec
+
+
+class SlidingWindow:
+    """
+    Hourly counters of the current and the previous window, the previous one weighted by how much
+    of it still overlaps the last hour. No burst across the hour, O(1) memory
+    """
+    name = "sliding"
+
+    def refresh(self, record: Optional[dict], _type: str, _id: str, now: float) -> dict:
+        window = int(now // HOUR)
+        if record is not None and record.get('window') == window:
+            return record
+        previous = record['current'] if record is not None and record.get('window') == window - 1 else 0
+        return {'type': _type, 'id': _id, 'algorithm': self.name, 'window': window,
+                'current': 0, 'previous': previous}
+
+    def used(self, record: dict, limit: dict, now: float) -> float:
+        overlap = 1 - (now % HOUR) / HOUR
+        return record['previous'] * overlap + record['current']
+
+    def consume(self, record: dict, limit: dict, now: float, amount: float = 1) -> dict:
+        return dict(record, current=max(0, record['current'] + amount))
+
+    def wait(self, record: dict, limit: dict, now: float, amount: float = 1) -> float:
+        room = limit['rate'] - amount
+        if self.used(record, limit, now) <= room:
+            return 0
+        elapsed = now % HOUR
+        if record['current'] <= room:
+            # The previous window fades out enough within the current one
+            return max(0.0, HOUR * (1 - (room - record['current']) / record['previous']) - elapsed) + 1
+        # The current window becomes the previous one and has to fade out
+        return HOUR - elapsed + HOUR * (1 - max(room, 0) / record['current']) + 1
+
+
+class TokenBucket:
+    """Tokens refilled at rate per hour, up to burst (config.ratelimit.burst, then the rate, when not set)"""
+    name = "token_bucket"
+
+    @staticmethod
+    def capacity(limit: Optional[dict]) -> float:
+        if limit is None:
+            return 0
+        return limit.get('burst') or config.ratelimit.burst or limit['rate']
+
+    def refresh(self, record: Optional[dict], _type: str, _id: str, now: float) -> dict:
+        if record is None:
+            # Created full, the capacity is only known with the limit
+            return {'type': _type, 'id': _id, 'algorithm': self.name, 'tokens': None, 'updated': now}
+        return record
+
+    def tokens(self, record: dict, limit: dict, now: float) -> float:
+        capacity = self.capacity(limit)
+        if record['tokens'] is None:
+            return capacity
+        return min(capacity, record['tokens'] + (now - record['updated']) * limit['rate'] / HOUR)
+
+    def used(self, record: dict, limit: Optional[dict], now: float) -> float:
+        if limit is None:
+            return 0
+        return self.capacity(limit) - self.tokens(record, limit, now)
+
+    def consume(self, record: dict, limit: Optional[dict], now: float, amount: float = 1) -> dict:
+        if limit is None:
+            return record
+        tokens = min(self.capacity(limit), self.tokens(record, limit, now) - amount)
+        return dict(record, tokens=tokens, updated=now)
+
+    def wait(self, record: dict, limit: dict, now: float, amount: float = 1) -> float:
+        tokens = self.tokens(record, limit, now)
+        return 0 if tokens >= amount else (amount - tokens) * HOUR / limit['rate']
+
+
+algorithms = {algorithm.name: algorithm for algorithm in (FixedWindow(), SlidingWindow(), TokenBucket())}
 
 
 class RateLimitManager:
-    """Quota manager"""
+    """
+    Quota manager. Every dimension (messages, tokens, images, TTS characters) has its own limits per chat,
+    chat type default or tenant, metered with the algorithm of the limit
+    """
+
+    dimensions = ("messages", "tokens", "images", "tts")
+
+    def __init__(self, flush_interval: float = 5.0, backend: str = "json", sqlite_path: str = "data/ratelimit.db",
+                 sqlite_busy_timeout: float = 0.25):
+        self.backend = backend
+        self.sqlite_path = sqlite_path
+        self.sqlite_busy_timeout = sqlite_busy_timeout
+        self.limit_db = self.open_table("rate_limit")
+        self.usage_db = self.open_table("rate_usage")
+        self.draw_limit_db = self.open_table("draw_rate_limit")
+        self.draw_usage_db = self.open_table("draw_rate_usage")
+        self.quotas: Dict[str, Tuple[QuotaStore, QuotaStore]] = {
+            "messages": (self.limit_db, self.usage_db),
+            "tokens": (self.open_table("token_rate_limit"), self.open_table("token_rate_usage")),
+            "images": (self.draw_limit_db, self.draw_usage_db),
+            "tts": (self.open_table("tts_rate_limit"), self.open_table("tts_rate_usage")),
+        }
+        self.tables = [table for tables in self.quotas.values() for table in tables]
+
+        if backend == "json":
+            self.flush_interval = flush_interval
+            threading.Thread(target=self.flush_forever, name="ratelimit-flush", daemon=True).start()
+        atexit.register(self.flush)
+
+    def open_table(self, name: str) -> "QuotaStore":
+        if self.backend == "sqlite":
+            return SQLiteQuotaTable(self.sqlite_path, name, import_from=f"data/{name}.json",
+                                    busy_timeout=self.sqlite_busy_timeout)
+        # The memory backend forgets the quotas when the process ends
+        return QuotaTable(f"data/{name}.json" if self.backend == "json" else None)
+
+    def flush(self):
+        """Write the changed quota files to disk, or wait for the changes queued for the database"""
+        for table in self.tables:
+            table.flush()
+
+    def flush_forever(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    @staticmethod
+    def subjects(session_id: str) -> List[Tuple[str, str]]:
+        """The chat of the session and its tenant, each of them has its own quotas"""
+        _type = 'friend' if session_id.startswith("friend-") else 'group'
+        _id = session_id.split('-', 1)[1] if '-' in session_id else session_id
+        subjects = [(_type, _id)]
+        if tenant := config.fair_queue.tenants.get(session_id):
+            subjects.append(('tenant', tenant))
+        return subjects
+
+    def update_quota(self, dimension: str, _type: str, _id: str, rate: int,
+                     algorithm: Optional[str] = None, burst: int = 0):
+        """Update the limit of a dimension"""
+
+        limit_db, _ = self.quotas[dimension]
+        limit_db.put({"type": _type, "id": _id, "rate": rate, "algorithm": algorithm, "burst": burst})
+
+    def get_quota(self, dimension: str, _type: str, _id: str) -> Optional[dict]:
+        """Get the limit of a dimension, falling back to the default of the type"""
+
+        limit_db, _ = self.quotas[dimension]
+        entity = limit_db.get(_type, _id)
+        if entity is None and _id != 'default':
+            return limit_db.get(_type, 'default')
+        return entity
 
-    def __init__(self):
-        self.limit_db = TinyDB("data/rate_limit.json")
-        self.usage_db = TinyDB("data/rate_usage.json")
-        self.draw_limit_db = TinyDB("data/draw_rate_limit.json")
-        self.draw_usage_db = TinyDB("data/draw_rate_usage.json")
+    def get_quota_usage(self, dimension: str, _type: str, _id: str) -> dict:
+        """Get the usage of a dimension, 'count' is the amount used in the last hour"""
 
-    def update(self, _type: str, _id: str, rate: int):
+        now = time.time()
+        algorithm, record = self._record(dimension, _type, _id, now)
+        return dict(record, count=round(algorithm.used(record, self.get_quota(dimension, _type, _id), now)))
+
+    def check_quota(self, dimension: str, _type: str, _id: str, amount: float = 1) -> float:
+        """Return the usage/quota, 1 when amount does not fit in the quota"""
+
+        limit = self.get_quota(dimension, _type, _id)
+        # No restrictions under this type
+        if limit is None:
+            return 0
+
+        # This type is prohibited
+        if limit['rate'] == 0:
+            return 1
+
+        now = time.time()
+        algorithm, record = self._record(dimension, _type, _id, now)
+        capacity = TokenBucket.capacity(limit) if algorithm is algorithms['token_bucket'] else limit['rate']
+        if algorithm.wait(record, limit, now, min(amount, capacity)) > 0:
+            return 1
+        return min(algorithm.used(record, limit, now) / capacity, 1)
+
+    def time_until_quota(self, dimension: str, _type: str, _id: str, amount: float = 1) -> Optional[float]:
+        """Seconds until amount fits in the quota, None if it never does"""
+
+        limit = self.get_quota(dimension, _type, _id)
+        if limit is None:
+            return 0
+        if limit['rate'] == 0:
+            return None
+        now = time.time()
+        algorithm, record = self._record(dimension, _type, _id, now)
+        # A request larger than the whole quota is let through once the quota is untouched
+        capacity = TokenBucket.capacity(limit) if algorithm is algorithms['token_bucket'] else limit['rate']
+        return algorithm.wait(record, limit, now, min(amount, capacity))
+
+    def consume_quota(self, dimension: str, _type: str, _id: str, amount: float = 1):
+        """Add amount to the usage, a negative amount gives back what was reserved but not used"""
+
+        self._consume(dimension, _type, _id, amount, check=False)
+
+    def _consume(self, dimension: str, _type: str, _id: str, amount: float, check: bool) -> Optional[float]:
+        """
+        Add amount to the usage in a single atomic change of the record.
+        With check, nothing is added when amount does not fit and the seconds to wait are returned
+        """
+        limit = self.get_quota(dimension, _type, _id)
+        if check and limit is not None and limit['rate'] == 0:
+            return None
+        algorithm = self._algorithm(limit)
+        now = time.time()
+        wait = 0
+
+        def change(record: Optional[dict]) -> Optional[dict]:
+            nonlocal wait
+            record = self._refresh(algorithm, record, _type, _id, now)
+            if check and limit is not None:
+                capacity = TokenBucket.capacity(limit) if algorithm is algorithms['token_bucket'] else limit['rate']
+                wait = algorithm.wait(record, limit, now, min(amount, capacity))
+                if wait > 0:
+                    return None
+            return algorithm.consume(record, limit, now, amount)
+
+        _, usage_db = self.quotas[dimension]
+        if not check:
+            # Nothing to decide, the event loop does not wait for the other processes
+            usage_db.modify_later(_type, _id, change)
+            return wait
+        try:
+            usage_db.modify(_type, _id, change)
+        except sqlite3.OperationalError as e:
+            # Refused rather than holding every chat until the other processes let go of the database
+            logger.warning(f"[RateLimit] The quota database is busy, {dimension} of {_type} {_id} refused: {e}")
+            return BUSY_WAIT
+        return wait
+
+    def reserve(self, dimension: str, session_id: str, estimate: float) -> Optional[float]:
+        """
+        Pre-check the estimated amount against the quotas of the chat and its tenant and reserve it.
+        Returns the seconds to wait when it does not fit (None: never), otherwise 0.
+        The reservation is settled with settle() once the actual amount is known
+        """
+
+        reserved = []
+        for _type, _id in self.subjects(session_id):
+            if self.get_quota(dimension, _type, _id) is None:
+                # Nothing to meter, no usage record is written for it
+                continue
+            wait = self._consume(dimension, _type, _id, estimate, check=True)
+            if wait != 0:
+                # All or nothing, give back what the other quotas reserved
+                for reserved_type, reserved_id in reserved:
+                    self.consume_quota(dimension, reserved_type, reserved_id, -estimate)
+                return wait
+            reserved.append((_type, _id))
+        return 0
+
+    def settle(self, dimension: str, session_id: str, reserved: float, actual: float):
+        """Replace a reservation with the actual amount"""
+
+        if actual != reserved:
+            for _type, _id in self.subjects(session_id):
+                # The quotas without limit reserved nothing
+                if self.get_quota(dimension, _type, _id) is not None:
+                    self.consume_quota(dimension, _type, _id, actual - reserved)
+
+    def _record(self, dimension: str, _type: str, _id: str, now: float):
+        """Current usage record of the algorithm of the limit, read only"""
+        _, usage_db = self.quotas[dimension]
+        algorithm = self._algorithm(self.get_quota(dimension, _type, _id))
+        return algorithm, self._refresh(algorithm, usage_db.get(_type, _id), _type, _id, now)
+
+    @staticmethod
+    def _refresh(algorithm, record: Optional[dict], _type: str, _id: str, now: float) -> dict:
+        """The record started again when it expired or the algorithm changed"""
+        if record is not None and record.get('algorithm', 'fixed') != algorithm.name:
+            record = None
+        return algorithm.refresh(record, _type, _id, now)
+
+    @staticmethod
+    def _algorithm(limit: Optional[dict]):
+        name = (limit or {}).get('algorithm') or config.ratelimit.algorithm
+        return algorithms.get(name, algorithms['fixed'])
+
+    def update(self, _type: str, _id: str, rate: int, algorithm: Optional[str] = None, burst: int = 0):
         """Update quota limit"""
 
-        q = Query()
-        self.limit_db.upsert({"type": _type, "id": _id, "rate": rate}, q.fragment({"type": _type, "id": _id}))
+        self.update_quota("messages", _type, _id, rate, algorithm, burst)
 
-    def update_draw(self, _type: str, _id: str, rate: int):
+    def update_draw(self, _type: str, _id: str, rate: int, algorithm: Optional[str] = None, burst: int = 0):
         """Update drawing quota limit"""
 
-        q = Query()
-        self.draw_limit_db.upsert({"type": _type, "id": _id, "rate": rate}, q.fragment({"type": _type, "id": _id}))
+        self.update_quota("images", _type, _id, rate, algorithm, burst)
 
     def list(self):
         """List all quota limits"""
 
         return self.limit_db.all()
 
-    def get_limit(self, _type: str, _id: str) -> Document:
+    def get_limit(self, _type: str, _id: str) -> Optional[dict]:
         """Get restrictions"""
 
-        q = Query()
-        entity = self.limit_db.get(q.fragment({"type": _type, "id": _id}))
-        if entity is None and _id != 'default':
-            return self.limit_db.get(q.fragment({"type": _type, "id": 'default'}))
-        return entity
+        return self.get_quota("messages", _type, _id)
 
-    def get_draw_limit(self, _type: str, _id: str) -> Document:
+    def get_draw_limit(self, _type: str, _id: str) -> Optional[dict]:
         """Get drawing limits"""
 
-        q = Query()
-        entity = self.draw_limit_db.get(q.fragment({"type": _type, "id": _id}))
-        if entity is None and _id != 'default':
-            return self.draw_limit_db.get(q.fragment({"type": _type, "id": 'default'}))
-        return entity
-
-    def get_draw_usage(self, _type: str, _id: str) -> Document:
-        """Get drawing usage"""
-
-        q = Query()
-        usage = self.draw_usage_db.get(q.fragment({"type": _type, "id": _id}))
-        current_time = time.localtime(time.time()).tm_hour
-        current_day = time.localtime(time.time()).tm_mday
+        return self.get_quota("images", _type, _id)
 
-        # Delete expired records
-        if usage is not None and usage['time'] != current_time:
-            self.draw_usage_db.remove(doc_ids=[usage.doc_id])
-            usage = None
-
-        # initialization
-        if usage is None:
-            usage = {'type': _type, 'id': _id, 'count': 0, 'time': current_time, 'day': current_day}
-            self.draw_usage_db.insert(usage)
+    def get_usage(self, _type: str, _id: str) -> dict:
+        """Get usage"""
 
-        return usage
+        return self.get_quota_usage("messages", _type, _id)
 
-    def get_usage(self, _type: str, _id: str) -> Document:
-        """Get usage"""
+    def get_draw_usage(self, _type: str, _id: str) -> dict:
+        """Get drawing usage"""
 
-        q = Query()
-        usage = self.usage_db.get(q.fragment({"type": _type, "id": _id}))
-        current_time = time.localtime(time.time()).tm_hour
-        current_day = time.localtime(time.time()).tm_mday
-
-        # Delete expired records
-        time_diff_dondition = (usage is not None and usage['time'] != current_time)
-        day_diff_condition = (usage is not None and usage['time'] == current_time and usage['day'] != current_day)
-        if time_diff_dondition or day_diff_condition:
-            self.usage_db.remove(doc_ids=[usage.doc_id])
-            usage = None
-            
-        # initialization
-        if usage is None:
-            usage = {'type': _type, 'id': _id, 'count': 0, 'time': current_time, 'day': current_day}
-            self.usage_db.insert(usage)
-
-        return usage
+        return self.get_quota_usage("images", _type, _id)
 
     def increment_usage(self, _type, _id):
         """Update usage"""
 
-        self.get_usage(_type, _id)
+        self.consume_quota("messages", _type, _id)
 
-        q = Query()
-        self.usage_db.update(increment('count'), q.fragment({"type": _type, "id": _id}))
-
-    def increment_draw_usage(self, _type, _id):
+    def increment_draw_usage(self, _type, _id, count: int = 1):
         """Update drawing usage"""
 
-        self.get_usage(_type, _id)
-
-        q = Query()
-        self.draw_usage_db.update(increment('count'), q.fragment({"type": _type, "id": _id}))
+        self.consume_quota("images", _type, _id, count)
 
     def check_exceed(self, _type: str, _id: str) -> float:
         """Check whether the quota is exceeded and return the usage/quota"""
 
-        limit = self.get_limit(_type, _id)
-        usage = self.get_usage(_type, _id)
-
-        # No restrictions under this type
-        if limit is None:
-            return 0
-
-        # This type is prohibited
-        return 1 if limit['rate'] == 0 else usage['count'] / limit['rate']
+        return self.check_quota("messages", _type, _id)
 
     def check_draw_exceed(self, _type: str, _id: str) -> float:
         """Check whether the drawing exceeds the quota and return the usage/amount"""
 
-        limit = self.get_draw_limit(_type, _id)
-        usage = self.get_draw_usage(_type, _id)
+        return self.check_quota("images", _type, _id)
 
-        # No restrictions under this type
-        if limit is None:
-            return 0
+    def time_until_allowed(self, _type: str, _id: str) -> Optional[float]:
+        """Seconds until the next message is allowed, None if it never is"""
 
-        # This type is prohibited
-        return 1 if limit['rate'] == 0 else usage['count'] / limit['rate']
\ No newline at end of file
+        return self.time_until_quota("messages", _type, _id)
+
+    def time_until_draw_allowed(self, _type: str, _id: str) -> Optional[float]:
+        """Seconds until the next drawing is allowed, None if it never is"""
+
+        return self.time_until_quota("images", _type, _id)
+
+
+def format_wait(seconds: Optional[float]) -> str:
+    """Human readable waiting time"""
+    if seconds is None:
+        return "forever"
+    minutes, seconds = divmod(int(seconds + 0.999), 60)
+    if minutes and seconds:
+        return f"{minutes} min {seconds} s"
+    return f"{minutes} min" if minutes else f"{seconds} s"
+
+
+rateLimitManager = RateLimitManager(config.ratelimit.flush_interval, config.ratelimit.backend,
+                                    config.ratelimit.sqlite_path, config.ratelimit.sqlite_busy_timeout)
@@ -0,0 +1,153 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+from config import FairQueue
+from utils import metrics
+
+
+class _Waiter:
+    __slots__ = ("start", "finish", "seq", "session_id", "tenant", "future")
+
+    def __init__(self, start: float, finish: float, seq: int, session_id: str, tenant: str,
+                 future: asyncio.Future):
+        self.start = start
+        self.finish = finish
+        self.seq = seq
+        self.session_id = session_id
+        self.tenant = tenant
+        self.future = future
+
+    def __lt__(self, other: "_Waiter"):
+        return (self.finish, self.seq) < (other.finish, other.seq)
+
+
+class FairScheduler:
+    """
+    Shares the upstream slots between chats with weighted fair queueing (start-time fair queueing).
+    Every chat gets slots in proportion to its weight multiplied by the weight of its tenant,
+    and a tenant never holds more slots than its cap.
+    """
+
+    def __init__(self, settings: FairQueue):
+        self.settings = settings
+        self.virtual_time = 0.0
+        self.finish_tags: Dict[str, float] = {}
+        """Virtual finish time of the last request of each chat"""
+        self.waiting: List[_Waiter] = []
+        self.running = 0
+        self.tenant_running: Dict[str, int] = defaultdict(int)
+        self.seq = itertools.count()
+        metrics.register("fair_queue", self.snapshot)
+
+    def tenant_of(self, session_id: str) -> str:
+        """Chats without a tenant are a tenant of their own"""
+        return self.settings.tenants.get(session_id, session_id)
+
+    def weight_of(self, session_id: str) -> float:
+        chat_weight = self.settings.chat_weights.get(session_id, 1.0)
+        tenant_weight = self.settings.tenant_weights.get(self.tenant_of(session_id), 1.0)
+        return max(chat_weight * tenant_weight, 1e-3)
+
+    def tenant_cap(self, tenant: str) -> int:
+        return self.settings.tenant_max_concurrent.get(tenant, self.settings.default_tenant_max_concurrent)
+
+    def set_chat_weight(self, session_id: str, weight: float):
+        self.settings.chat_weights[session_id] = weight
+
+    def set_tenant(self, session_id: str, tenant: str):
+        self.settings.tenants[session_id] = tenant
+
+    def set_tenant_limit(self, tenant: str, max_concurrent: int, weight: Optional[float] = None):
+        self.settings.tenant_max_concurrent[tenant] = max_concurrent
+        if weight is not None:
+            self.settings.tenant_weights[tenant] = weight
+        self.dispatch()
+
+    def can_run(self, tenant: str) -> bool:
+        if 0 < self.settings.max_concurrent <= self.running:
+            return False
+        cap = self.tenant_cap(tenant)
+        return cap <= 0 or self.tenant_running[tenant] < cap
+
+    def dispatch(self):
+        """Hand free slots to the waiters with the smallest finish tags"""
+        skipped = []
+        while self.waiting and not (0 < self.settings.max_concurrent <= self.running):
+            waiter = heapq.heappop(self.waiting)
+            if waiter.future.done():
+                # Cancelled while waiting
+                continue
+            if not self.can_run(waiter.tenant):
+                skipped.append(waiter)
+                continue
+            self.running += 1
+            self.tenant_running[waiter.tenant] += 1
+            self.virtual_time = max(self.virtual_time, waiter.start)
+            waiter.future.set_result(None)
+        for waiter in skipped:
+            heapq.heappush(self.waiting, waiter)
+
+    def release(self, session_id: str, tenant: str):
+        self.running -= 1
+        self.tenant_running[tenant] -= 1
+        if self.tenant_running[tenant] <= 0:
+            del self.tenant_running[tenant]
+        if self.finish_tags.get(session_id, 0) <= self.virtual_time:
+            self.finish_tags.pop(session_id, None)
+        self.dispatch()
+
+    def withdraw(self, session_id: str, finish: float, previous: Optional[float]):
+        """The chat is not charged for a request which left the line before its turn"""
+        if self.finish_tags.get(session_id) != finish:
+            # A later request of the chat already queued after this one keeps its tag
+            return
+        if previous is None or previous <= self.virtual_time:
+            self.finish_tags.pop(session_id, None)
+        else:
+            self.finish_tags[session_id] = previous
+
+    @contextlib.asynccontextmanager
+    async def slot(self, session_id: str):
+        """Wait for the turn of this chat"""
+        if not self.settings.enabled:
+            yield
+            return
+        tenant = self.tenant_of(session_id)
+        previous = self.finish_tags.get(session_id)
+        start = max(self.virtual_time, previous or 0)
+        finish = start + 1 / self.weight_of(session_id)
+        self.finish_tags[session_id] = finish
+
+        waiter = _Waiter(start, finish, next(self.seq), session_id, tenant,
+                         asyncio.get_running_loop().create_future())
+        heapq.heappush(self.waiting, waiter)
+        self.dispatch()
+        if not waiter.future.done():
+            logger.debug(f"[FairQueue] {session_id} is waiting, {len(self.waiting)} chats in line")
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # The slot was granted at the same time
+                self.release(session_id, tenant)
+            else:
+                self.withdraw(session_id, finish, previous)
+            raise
+        try:
+            yield
+        finally:
+            self.release(session_id, tenant)
+
+    def snapshot(self):
+        return {
+            "enabled": self.settings.enabled,
+            "running": self.running,
+            "waiting": sum(not waiter.future.done() for waiter in self.waiting),
+            "tenants_running": dict(self.tenant_running),
+        }
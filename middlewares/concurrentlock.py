@@ -1,14 +1,24 @@
-from typing import Callable, Dict, Optional
+import asyncio
+import contextlib
+from typing import Callable, Dict, Optional, Tuple
 from loguru import logger
 
 from constants import config
-from middlewares.middleware import Middleware
+from manager.scheduler import FairScheduler
+from middlewares.middleware import Middleware, sender
 from conversation import ConversationContext, ConversationHandler
-from utils import QueueInfo
+from utils import QueueStats, RequestQueue, metrics
+
+scheduler = FairScheduler(config.fair_queue)
+
+queue_stats = QueueStats()
+metrics.register("request_queue", queue_stats.snapshot)
 
 
 class MiddlewareConcurrentLock(Middleware):
-    ctx: Dict[str, QueueInfo] = dict()
+    ctx: Dict[str, RequestQueue] = dict()
+    inflight: Dict[Tuple[str, str], asyncio.Task] = dict()
+    """Queued or running request of each sender, when the latest-wins policy is on"""
 
     def __init__(self):
         ...
@@ -16,28 +26,56 @@ class MiddlewareConcurrentLock(Middleware):
     async def handle_request(self, session_id: str, prompt: str, respond: Callable,
                              conversation_context: Optional[ConversationContext], action: Callable):
         handler = await ConversationHandler.get_handler(session_id)
+        if not handler.supersede:
+            return await self.execute(handler, session_id, prompt, respond, conversation_context, action)
 
+        # Latest wins: a new message cancels the request of the same sender which is still queued or running
+        key = (session_id, sender.get())
+        if previous := self.inflight.get(key):
+            logger.debug(f"[Concurrent] {key} sent a new message, cancelling the previous request")
+            previous.cancel()
+        task = asyncio.create_task(self.execute(handler, session_id, prompt, respond, conversation_context, action))
+        self.inflight[key] = task
+        try:
+            await task
+        except asyncio.CancelledError:
+            if task.cancelled() and not asyncio.current_task().cancelling():
+                logger.debug(f"[Concurrent] The request of {key} was superseded")
+                return
+            raise
+        finally:
+            if self.inflight.get(key) is task:
+                del self.inflight[key]
+
+    async def execute(self, handler: ConversationHandler, session_id: str, prompt: str, respond: Callable,
+                      conversation_context: Optional[ConversationContext], action: Callable):
         if session_id not in self.ctx:
-            self.ctx[session_id] = QueueInfo()
-        queue_info = self.ctx[session_id]
+            self.ctx[session_id] = RequestQueue(config.response.max_queue_size, queue_stats)
+        queues = [self.ctx[session_id]]
         selected_ctx = handler.current_conversation if conversation_context is None else conversation_context
         if internal_queue := selected_ctx.adapter.get_queue_info():
             logger.debug("[Concurrent] Use Adapter Internal Queue")
             # If Adapter implemented internally Queue，then you need to queue up the middleware first before using theirs.
-            logger.debug(f"[Concurrent] Queuing, there are others ahead{queue_info.size} private！")
-            async with queue_info:
-                queue_info = internal_queue
-        # Reject new messages when the queue is full
-        if 0 < config.response.max_queue_size < queue_info.size:
-            logger.debug("[Concurrent]Queue is full, denial of service！")
-            await respond(config.response.queue_full)
-            return
-        else:
-            # Prompt user: request has been queued
-            if queue_info.size > config.response.queued_notice_size:
-                await respond(config.response.queued_notice.format(queue_size=queue_info.size))
-        # execute in queue
-        logger.debug(f"[Concurrent] Queuing, there are others ahead {queue_info.size} private！")
-        async with queue_info:
-            logger.debug("[Concurrent] Arrive in line！")
-            await action(session_id, prompt, conversation_context, respond)
\ No newline at end of file
+            queues.append(internal_queue)
+
+        async with contextlib.AsyncExitStack() as stack:
+            tickets = []
+            for queue in queues:
+                # Reject new messages when the queue is full, before waiting in any of them
+                if (ticket := queue.join()) is None:
+                    logger.debug("[Concurrent]Queue is full, denial of service！")
+                    await respond(config.response.queue_full)
+                    return
+                tickets.append(await stack.enter_async_context(ticket))
+            position = max(ticket.position for ticket in tickets)
+            if position > config.response.queued_notice_size:
+                # Prompt user: request has been queued
+                await respond(config.response.queued_notice.format(queue_size=position))
+            # execute in queue
+            logger.debug(f"[Concurrent] Queuing, there are others ahead {position} private！")
+            for ticket in tickets:
+                await ticket.turn()
+            # Wait for the turn of this chat among all the others
+            async with scheduler.slot(session_id):
+                logger.debug("[Concurrent] Arrive in line！")
+                await action(session_id, prompt, conversation_context, respond)
@@ -2,9 +2,7 @@ import time
 from typing import Callable, Optional
 
 from constants import config
-from manager.ratelimit import RateLimitManager
-
-manager = RateLimitManager()
+from manager.ratelimit import format_wait, rateLimitManager as manager
 
 
 class MiddlewareRatelimit():
@@ -13,16 +11,16 @@ class MiddlewareRatelimit():
 
 
     def handle_draw_request(self, session_id: str, prompt: str):
-        _id = session_id.split('-', 1)[1] if '-' in session_id else session_id
-        rate_usage = manager.check_draw_exceed('friend' if session_id.startswith("friend-") else 'group', _id)
-        return config.ratelimit.draw_exceed if rate_usage >= 1 else "1"
-
+        # One image is reserved up front, settled with the number of images actually generated
+        wait = manager.reserve("images", session_id, 1)
+        return config.ratelimit.draw_exceed.format(wait=format_wait(wait)) if wait != 0 else "1"
 
+    def handle_draw_failed(self, session_id: str):
+        manager.settle("images", session_id, 1, 0)
 
-    def handle_draw_respond_completed(self, session_id: str, prompt: str):
-        key = 'friend' if session_id.startswith("friend-") else 'group'
-        msg_id = session_id.split('-', 1)[1]
-        manager.increment_draw_usage(key, msg_id)
+    def handle_draw_respond_completed(self, session_id: str, prompt: str, count: int = 1):
+        manager.settle("images", session_id, 1, count)
+        key, msg_id = manager.subjects(session_id)[0]
         rate_usage = manager.check_draw_exceed(key, msg_id)
         if rate_usage >= config.ratelimit.warning_rate:
             limit = manager.get_draw_limit(key, msg_id)
@@ -31,4 +29,15 @@ class MiddlewareRatelimit():
             return config.ratelimit.draw_warning_msg.format(usage=usage['count'],
                                                         limit=limit['rate'],
                                                         current_time=current_time)
-        return "1"
\ No newline at end of file
+        return "1"
+
+    def handle_token_request(self, session_id: str, estimate: int) -> Optional[str]:
+        """Reserve the estimated tokens of a request, returns the reply to send when the token quota is exceeded"""
+        wait = manager.reserve("tokens", session_id, estimate)
+        if wait != 0:
+            return config.ratelimit.token_exceed.format(wait=format_wait(wait))
+        return None
+
+    def handle_token_respond_completed(self, session_id: str, estimate: int, used: Optional[int]):
+        """Settle the reservation with the tokens reported by the adapter, the estimate when it reports none"""
+        manager.settle("tokens", session_id, estimate, estimate if used is None else used)
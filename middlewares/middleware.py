@@ -1,7 +1,11 @@
+from contextvars import ContextVar
 from typing import Callable, Optional
 
 from conversation import ConversationContext
 
+sender: ContextVar[str] = ContextVar("sender", default="")
+"""Platform user id of who sent the message being handled, display names are not unique"""
+
 
 class Middleware:
     async def handle_request(self, session_id: str, prompt: str, respond: Callable,
@@ -3,11 +3,9 @@ from typing import Callable, Optional
 
 from constants import config
 from conversation import ConversationContext
-from manager.ratelimit import RateLimitManager
+from manager.ratelimit import format_wait, rateLimitManager as manager
 from middlewares.middleware import Middleware
 
-manager = RateLimitManager()
-
 
 class MiddlewareRatelimit(Middleware):
     def __init__(self):
@@ -15,17 +13,16 @@ class MiddlewareRatelimit(Middleware):
 
     async def handle_request(self, session_id: str, prompt: str, respond: Callable,
                              conversation_context: Optional[ConversationContext], action: Callable):
-        _id = session_id.split('-', 1)[1] if '-' in session_id else session_id
-        rate_usage = manager.check_exceed('friend' if session_id.startswith("friend-") else 'group', _id)
-        if rate_usage >= 1:
-            await respond(config.ratelimit.exceed)
-            return
+        for key, _id in manager.subjects(session_id):
+            if manager.check_exceed(key, _id) >= 1:
+                await respond(config.ratelimit.exceed.format(wait=format_wait(manager.time_until_allowed(key, _id))))
+                return
         await action(session_id, prompt, conversation_context, respond)
 
     async def handle_respond_completed(self, session_id: str, prompt: str, respond: Callable):
-        key = 'friend' if session_id.startswith("friend-") else 'group'
-        msg_id = session_id.split('-', 1)[1]
-        manager.increment_usage(key, msg_id)
+        for key, msg_id in manager.subjects(session_id):
+            manager.increment_usage(key, msg_id)
+        key, msg_id = manager.subjects(session_id)[0]
         rate_usage = manager.check_exceed(key, msg_id)
         if rate_usage >= config.ratelimit.warning_rate:
             limit = manager.get_limit(key, msg_id)
@@ -1,4 +1,4 @@
-from typing import Callable, Dict, Optional
+from typing import Callable, Optional, Set
 
 import asyncio
 from conversation import ConversationContext
@@ -6,62 +6,64 @@ from loguru import logger
 
 from constants import config
 from middlewares.middleware import Middleware
+from utils.deadline import DeadlineScheduler, RequestDeadlines
+
+deadlines = DeadlineScheduler()
+"""Reminder and hard timeout of every running request, on a single timer"""
 
 
 class MiddlewareTimeout(Middleware):
-    timeout_task: Dict[str, asyncio.Task] = dict()
-    request_task: Dict[str, asyncio.Task] = dict()
-    ctx: Dict[str, ConversationContext] = dict()
+    requests = RequestDeadlines(deadlines)
+    """Deadlines of each running request, keyed by its task"""
+    reminders: Set[asyncio.Task] = set()
 
     def __init__(self):
         ...
 
     async def handle_request(self, session_id: str, prompt: str, respond: Callable,
                              conversation_context: Optional[ConversationContext], action: Callable):
-        if session_id in self.timeout_task:
-            self.timeout_task[session_id].cancel()
-        self.timeout_task[session_id] = asyncio.create_task(self.create_timeout_task(respond, session_id))
         coro_task = asyncio.create_task(action(session_id, prompt, conversation_context, respond))
-        self.request_task[session_id] = coro_task
+        logger.debug("[Timeout] start the timer……")
+        self.requests.start(coro_task, config.response.timeout, config.response.max_timeout,
+                            lambda: self.remind(session_id, respond))
         try:
-            await asyncio.wait_for(coro_task, config.response.max_timeout)
-            if session_id in self.timeout_task and not (
-                    self.timeout_task[session_id].cancel() or self.timeout_task[session_id].done()
-            ):
-                self.timeout_task[session_id].cancel()
-                del self.timeout_task[session_id]
-        except asyncio.TimeoutError:
-            await respond(config.response.cancel_wait_too_long)
+            await coro_task
+        except asyncio.CancelledError:
+            if coro_task in self.requests.expired and not asyncio.current_task().cancelling():
+                logger.debug("[Timeout] The request ran out of time")
+                await respond(config.response.cancel_wait_too_long)
+                return
+            # Superseded by a newer message
+            logger.debug("[Timeout] The request was cancelled, cancel the timer...")
+            raise
         except Exception as e:
             logger.error(f"An error occurred: {e}")
-            if session_id in self.timeout_task:
-                self.timeout_task[session_id].cancel()
-                del self.timeout_task[session_id]
             raise e
+        finally:
+            self.requests.finish(coro_task)
 
     async def on_respond(self, session_id: str, prompt: str, rendered: str):
-        if rendered and session_id in self.timeout_task:
-            self.timeout_task[session_id].cancel()
-            del self.timeout_task[session_id]
-            logger.debug("[Timeout] Cancel the timer...")
+        if rendered:
+            # Something was sent, the reminder waits again from now
+            self.requests.touch()
 
     async def handle_respond(self, session_id: str, prompt: str, rendered: str, respond: Callable, action: Callable):
-        if rendered and session_id in self.timeout_task:
-            self.timeout_task[session_id].cancel()
-            del self.timeout_task[session_id]
-            logger.debug("[Timeout] Cancel the timer...")
+        if rendered:
+            self.requests.touch()
 
         await action(session_id, prompt, rendered, respond)
 
-        if not self.request_task[session_id].done():
-            # Create the task again
-            self.timeout_task[session_id] = asyncio.create_task(self.create_timeout_task(respond, session_id))
+        # The reminder may have been sent already, then it waits for the next silence
+        self.requests.responded()
 
-    async def create_timeout_task(self, respond, session_id):
-        logger.debug("[Timeout] start the timer……")
-        await asyncio.sleep(config.response.timeout)
-        respond_msg = await respond(config.response.timeout_format)
-        logger.debug("[Timeout] If you wait too long, send a reminder")
-        await asyncio.sleep(90)
-        if ctx := self.ctx[session_id]:
-            await ctx.delete_message(respond_msg)
\ No newline at end of file
+    def remind(self, session_id: str, respond: Callable):
+        task = asyncio.create_task(self.send_reminder(session_id, respond))
+        self.reminders.add(task)
+        task.add_done_callback(self.reminders.discard)
+
+    async def send_reminder(self, session_id: str, respond: Callable):
+        logger.debug(f"[Timeout] {session_id} waited too long, send a reminder")
+        try:
+            await respond(config.response.timeout_format)
+        except Exception as e:
+            logger.error(f"[Timeout] Failed to send the reminder: {e}")
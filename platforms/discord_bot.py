@@ -1,6 +1,7 @@
 import os
 import sys
 from io import BytesIO
+from typing import List
 
 import discord
 from discord.ext import commands
@@ -15,6 +16,10 @@ from universal import handle_message
 sys.path.append(os.getcwd())
 
 from constants import config, BotPlatform
+from utils import image_mime, split_message
+
+max_message_length = config.response.max_message_length.get(BotPlatform.DiscordBot.value,
+                                                           config.response.default_max_message_length)
 
 intents = discord.Intents.default()
 intents.typing = False
@@ -23,6 +28,16 @@ intents.presences = False
 bot = commands.Bot(command_prefix='!', intents=intents)
 
 
+def image_file(data: bytes) -> discord.File:
+    return discord.File(BytesIO(data), filename=f"image.{image_mime(data).split('/')[1]}")
+
+
+async def reply_images(message: discord.Message, images: List[Image]):
+    """Send the images in order, up to 10 attachments per message"""
+    for i in range(0, len(images), 10):
+        await message.reply(files=[image_file(await image.get_bytes()) for image in images[i:i + 10]])
+
+
 async def send_group_message(channel_id, message):
     try:
         user = await bot.fetch_user(channel_id)
@@ -66,23 +81,29 @@ async def on_message_event(message: discord.Message) -> None:
 
     async def response(msg):
         if isinstance(msg, MessageChain):
+            images = []
             for elem in msg:
+                if isinstance(elem, Image):
+                    # Consecutive images, e.g. the pages of a long reply, go out together
+                    images.append(elem)
+                    continue
+                if images:
+                    await reply_images(message, images)
+                    images = []
                 if isinstance(elem, Plain) and str(elem):
-                    chunks = [str(elem)[i:i + 1500] for i in range(0, len(str(elem)), 1500)]
-                    for chunk in chunks:
+                    for chunk in split_message(str(elem), max_message_length):
                         await message.reply(chunk)
-                if isinstance(elem, Image):
-                    await message.reply(file=discord.File(BytesIO(await elem.get_bytes()), filename='image.png'))
                 if isinstance(elem, Voice):
                     await message.reply(file=discord.File(BytesIO(await elem.get_bytes()), filename="voice.wav"))
+            if images:
+                await reply_images(message, images)
             return
         if isinstance(msg, str):
-            chunks = [str(msg)[i:i + 1500] for i in range(0, len(str(msg)), 1500)]
-            for chunk in chunks:
+            for chunk in split_message(str(msg), max_message_length):
                 await message.reply(chunk)
             return
         if isinstance(msg, Image):
-            return await message.reply(file=discord.File(BytesIO(await msg.get_bytes()), filename='image.png'))
+            return await message.reply(file=image_file(await msg.get_bytes()))
         if isinstance(msg, Voice):
             await message.reply(file=discord.File(BytesIO(await msg.get_bytes()), filename="voice.wav"))
             return
@@ -91,7 +112,8 @@ async def on_message_event(message: discord.Message) -> None:
     await handle_message(response,
                          f"{'friend' if isinstance(message.channel, discord.DMChannel) else 'group'}-{message.channel.id}",
                          message.content.replace(f"<@{bot_id}>", "").strip(), is_manager=False,
-                         nickname=message.author.name, request_from=BotPlatform.DiscordBot)
+                         nickname=message.author.name, request_from=BotPlatform.DiscordBot,
+                         user_id=str(message.author.id))
 
 @bot.event
 async def on_message(message):
@@ -1,3 +1,4 @@
+import base64
 import json
 import threading
 import time
@@ -12,6 +13,8 @@ from quart import Quart, request
 
 from constants import config, BotPlatform
 from universal import handle_message
+from utils import image_mime, metrics
+from utils.text_to_img import shared_texts
 
 from platforms.discord_bot import send_group_message
 from platforms.telegram_bot import send_telegram_message
@@ -96,7 +99,8 @@ async def process_request(bot_request: BotRequest):
             if isinstance(ele, Plain) and str(ele):
                 bot_request.append_result("message", str(ele))
             elif isinstance(ele, Image):
-                bot_request.append_result("image", f"data:image/png;base64,{ele.base64}")
+                mime = image_mime(base64.b64decode(ele.base64[:16]))
+                bot_request.append_result("image", f"data:{mime};base64,{ele.base64}")
             elif isinstance(ele, Voice):
                 # mp3
                 bot_request.append_result("voice", f"data:audio/mpeg;base64,{ele.base64}")
@@ -176,6 +180,20 @@ async def v2_chat_response():
     return response
 
 
+@app.route('/v1/metrics', methods=['GET'])
+async def v1_metrics():
+    """Runtime metrics for dashboards"""
+    return json.dumps(metrics.collect())
+
+
+@app.route('/v1/markdown/<key>', methods=['GET'])
+async def v1_markdown(key):
+    """Markdown text behind the QR code of a rendered image"""
+    if (text := shared_texts.get(key)) is None:
+        return "Not found", 404
+    return text, 200, {"Content-Type": "text/markdown; charset=utf-8"}
+
+
 def clear_request_dict():
     logger.debug("Watch and clean request_dic.")
     while True:
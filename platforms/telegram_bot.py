@@ -1,22 +1,38 @@
 import time
 import openai
+from typing import List
 
 from graia.ariadne.message.chain import MessageChain
 from graia.ariadne.message.element import Image, Plain, Voice
 
 from loguru import logger
 
-from telegram import Update, constants, Bot 
+from telegram import Update, constants, Bot, InputMediaPhoto
 from telegram.ext import ApplicationBuilder, ContextTypes, MessageHandler, filters, CommandHandler
 from telegram.request import HTTPXRequest
 
+from manager.ratelimit import algorithms, format_wait
 from middlewares.ratelimit import manager as ratelimit_manager
+from middlewares.concurrentlock import scheduler as fair_scheduler
 
 from constants import config, BotPlatform
+from utils import split_message
 from universal import handle_message
 
 send_bot = Bot(config.telegram.bot_token)
 
+max_message_length = config.response.max_message_length.get(BotPlatform.TelegramBot.value,
+                                                           config.response.default_max_message_length)
+
+async def reply_photos(message, images: List[Image]):
+    """Send the images in order, as albums of up to 10 photos"""
+    for i in range(0, len(images), 10):
+        group = images[i:i + 10]
+        if len(group) == 1:
+            await message.reply_photo(photo=await group[0].get_bytes())
+        else:
+            await message.reply_media_group([InputMediaPhoto(await image.get_bytes()) for image in group])
+
 async def send_telegram_message(chat_id, text):
     if chat_id and text != '':
         await send_bot.send_message(chat_id=chat_id, text=text)
@@ -40,16 +56,27 @@ async def on_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
 
     async def response(msg):
         if isinstance(msg, MessageChain):
+            images = []
             for elem in msg:
-                if isinstance(elem, Plain):
-                    await update.message.reply_text(str(elem))
                 if isinstance(elem, Image):
-                    await update.message.reply_photo(photo=await elem.get_bytes())
+                    # Consecutive images, e.g. the pages of a long reply, go out as an album
+                    images.append(elem)
+                    continue
+                if images:
+                    await reply_photos(update.message, images)
+                    images = []
+                if isinstance(elem, Plain):
+                    for chunk in split_message(str(elem), max_message_length):
+                        await update.message.reply_text(chunk)
                 if isinstance(elem, Voice):
                     await update.message.reply_audio(audio=await elem.get_bytes())
+            if images:
+                await reply_photos(update.message, images)
             return
         if isinstance(msg, str):
-            return await update.message.reply_text(msg)
+            for chunk in split_message(msg, max_message_length):
+                await update.message.reply_text(chunk)
+            return
         if isinstance(msg, Image):
             return await update.message.reply_photo(photo=await msg.get_bytes())
         if isinstance(msg, Voice):
@@ -62,7 +89,8 @@ async def on_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         update.message.text.replace(f"@{bot_username}", '').strip(),
         is_manager=update.message.from_user.id == config.telegram.manager_chat,
         nickname=update.message.from_user.full_name or "NTFND",
-        request_from=BotPlatform.TelegramBot
+        request_from=BotPlatform.TelegramBot,
+        user_id=str(update.message.from_user.id)
     )
     logger.debug(f"telegram chat_id : {update.message.chat.id}")
 
@@ -87,17 +115,53 @@ async def on_limit_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
             update.message.from_user.id != config.telegram.manager_chat
     ):
         return await update.message.reply_text("???")
-    msg_type, msg_id, rate = update.message.text.split(' ')
+    try:
+        _, msg_type, msg_id, rate, *options = update.message.text.split(' ')
+        rate = int(rate)
+        algorithm = options[0] if options else None
+        burst = int(options[1]) if len(options) > 1 else 0
+    except ValueError:
+        return await update.message.reply_text(
+            "Usage: /limit_chat <group|friend> <chat id|default> <rate> [fixed|sliding|token_bucket] [burst]")
     if msg_type not in ["group", "friend"]:
         return await update.message.reply_text("Must be group or private chat")
     if msg_id != 'default' and not msg_id.isdecimal():
         return await update.message.reply_text("not default chat id")
-    ratelimit_manager.update(msg_type, msg_id, rate)
+    if algorithm is not None and algorithm not in algorithms:
+        return await update.message.reply_text(f"Algorithm must be one of {', '.join(algorithms)}")
+    ratelimit_manager.update(msg_type, msg_id, rate, algorithm, burst)
+    return await update.message.reply_text("Updated")
+
+
+async def on_limit_quota(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if (
+            update.message.from_user.id != config.telegram.manager_chat
+    ):
+        return await update.message.reply_text("???")
+    try:
+        _, dimension, msg_type, msg_id, rate, *options = update.message.text.split(' ')
+        rate = int(rate)
+        algorithm = options[0] if options else None
+        burst = int(options[1]) if len(options) > 1 else 0
+    except ValueError:
+        return await update.message.reply_text(
+            "Usage: /limit_quota <messages|tokens|images|tts> <group|friend|tenant> <id|default> <rate> "
+            "[fixed|sliding|token_bucket] [burst]")
+    if dimension not in ratelimit_manager.dimensions:
+        return await update.message.reply_text(f"Quota must be one of {', '.join(ratelimit_manager.dimensions)}")
+    if msg_type not in ["group", "friend", "tenant"]:
+        return await update.message.reply_text("Must be group, private chat or tenant")
+    if algorithm is not None and algorithm not in algorithms:
+        return await update.message.reply_text(f"Algorithm must be one of {', '.join(algorithms)}")
+    ratelimit_manager.update_quota(dimension, msg_type, msg_id, rate, algorithm, burst)
     return await update.message.reply_text("Updated")
 
 
 async def on_query_chat_limit(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    msg_type, msg_id, rate = update.message.text.split(' ')
+    try:
+        _, msg_type, msg_id = update.message.text.split(' ')
+    except ValueError:
+        return await update.message.reply_text("Usage: /query_limit <group|friend> <chat id|default>")
 
     if msg_type not in ["group", "friend"]:
         return await update.message.reply_text("Must be group or private chat")
@@ -107,9 +171,62 @@ async def on_query_chat_limit(update: Update, context: ContextTypes.DEFAULT_TYPE
     if limit is None:
         return await update.message.reply_text(f"{msg_type} {msg_id} no limit by quota")
     usage = ratelimit_manager.get_usage(msg_type, msg_id)
+    wait = ratelimit_manager.time_until_allowed(msg_type, msg_id)
+    algorithm = limit.get('algorithm') or config.ratelimit.algorithm
     current_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(time.time()))
     return await update.message.reply_text(
-        f"{msg_type} {msg_id} Quota usage: {limit['rate']}msg/hour, currently sent：{usage['count']}message\nReset on the hour, current server time：{current_time}")
+        f"{msg_type} {msg_id} Quota usage: {limit['rate']}msg/hour ({algorithm}), currently sent：{usage['count']}message\n"
+        f"Next message allowed in：{format_wait(wait) if wait else 'now'}, current server time：{current_time}")
+
+
+async def on_chat_weight(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if (
+            update.message.from_user.id != config.telegram.manager_chat
+    ):
+        return await update.message.reply_text("???")
+    try:
+        _, msg_type, msg_id, weight = update.message.text.split(' ')
+        weight = float(weight)
+    except ValueError:
+        return await update.message.reply_text("Usage: /chat_weight <group|friend> <chat id> <weight>")
+    if msg_type not in ["group", "friend"]:
+        return await update.message.reply_text("Must be group or private chat")
+    if weight <= 0:
+        return await update.message.reply_text("Weight must be positive")
+    fair_scheduler.set_chat_weight(f"{msg_type}-{msg_id}", weight)
+    return await update.message.reply_text("Updated")
+
+
+async def on_chat_tenant(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if (
+            update.message.from_user.id != config.telegram.manager_chat
+    ):
+        return await update.message.reply_text("???")
+    try:
+        _, msg_type, msg_id, tenant = update.message.text.split(' ')
+    except ValueError:
+        return await update.message.reply_text("Usage: /chat_tenant <group|friend> <chat id> <tenant>")
+    if msg_type not in ["group", "friend"]:
+        return await update.message.reply_text("Must be group or private chat")
+    fair_scheduler.set_tenant(f"{msg_type}-{msg_id}", tenant)
+    return await update.message.reply_text("Updated")
+
+
+async def on_tenant_limit(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if (
+            update.message.from_user.id != config.telegram.manager_chat
+    ):
+        return await update.message.reply_text("???")
+    try:
+        _, tenant, max_concurrent, *weight = update.message.text.split(' ')
+        max_concurrent = int(max_concurrent)
+        weight = float(weight[0]) if weight else None
+    except (ValueError, IndexError):
+        return await update.message.reply_text("Usage: /tenant_limit <tenant> <max concurrent> [weight]")
+    if weight is not None and weight <= 0:
+        return await update.message.reply_text("Weight must be positive")
+    fair_scheduler.set_tenant_limit(tenant, max_concurrent, weight)
+    return await update.message.reply_text("Updated")
 
 
 async def bootstrap() -> None:
@@ -128,6 +245,10 @@ async def bootstrap() -> None:
     app.add_handler(CommandHandler("presets", on_check_presets_list))
     app.add_handler(CommandHandler("limit_chat", on_limit_chat))
     app.add_handler(CommandHandler("query_limit", on_query_chat_limit))
+    app.add_handler(CommandHandler("limit_quota", on_limit_quota))
+    app.add_handler(CommandHandler("chat_weight", on_chat_weight))
+    app.add_handler(CommandHandler("chat_tenant", on_chat_tenant))
+    app.add_handler(CommandHandler("tenant_limit", on_tenant_limit))
     await app.initialize()
     await app.start()
     logger.info("Startup completed, receiving messages...")
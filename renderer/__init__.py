@@ -5,6 +5,19 @@ class Renderer:
 
     async def result(self): ...
 
+    async def flush(self): ...
+    """Content held back whose time to be sent has come, without new input"""
+
+    async def render_parts(self, msg: str):
+        """Same as render, in parts that are sent as soon as each of them is ready"""
+        yield await self.render(msg)
+
+    async def result_parts(self):
+        yield await self.result()
+
+    async def flush_parts(self):
+        yield await self.flush()
+
     async def __aenter__(self): ...
 
     async def __aexit__(self, exc_type: type[BaseException], exc: BaseException, tb): ...
\ No newline at end of file
@@ -0,0 +1,63 @@
+import time
+from typing import AsyncGenerator, AsyncIterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class DeltaBatcher:
+    """
+    Picks which snapshots of a streamed reply go down the renderer chain.
+    A segment only completes on a line break or a closing fence, the snapshots adding neither are held back
+    until the window is over or enough text has piled up, the next snapshot sent carries their text.
+    """
+
+    def __init__(self, window: float, size: int):
+        self.window = window
+        """Longest time in seconds a snapshot is held back, 0 sends every snapshot"""
+        self.size = size
+        """Characters after which the snapshot is sent anyway"""
+        self.sent = ''
+        self.sent_at = time.monotonic()
+        self.held: Optional[str] = None
+        self.lines = 0
+        """Line breaks passed on the splitter may still have to act on, it sends one segment per snapshot"""
+        self.offered = 0
+        self.passed = 0
+        self.render_cpu = 0.0
+        """CPU time of the event loop thread spent in the renderers"""
+
+    def offer(self, snapshot: str) -> bool:
+        """Whether the snapshot should be rendered now, otherwise it is held back"""
+        self.offered = self.offered + 1
+        now = time.monotonic()
+        sent = len(self.sent)
+        # Only the end of the text sent is compared, the splitter finds the rewrites this misses by itself.
+        # After a line break the splitter needs the start of the next line to tell whether the line before
+        # ends a segment, and a snapshot for each segment when several are ready
+        if not self.lines and sent <= len(snapshot) < sent + self.size and now - self.sent_at < self.window \
+                and snapshot.startswith(self.sent[-16:], max(0, sent - 16)):
+            delta = snapshot[sent:]
+            if '\n' not in delta and '`' not in delta and '$' not in delta:
+                self.held = snapshot
+                return False
+        self.passed = self.passed + 1
+        self.lines = max(self.lines - 1, 0) + snapshot.count('\n', sent)
+        self.sent, self.sent_at, self.held = snapshot, now, None
+        return True
+
+    def take(self) -> Optional[str]:
+        """The snapshot held back, to be rendered before the reply ends"""
+        held, self.held = self.held, None
+        if held is not None:
+            self.offered = self.offered - 1
+            self.offer(held)
+        return held
+
+    async def timed(self, parts: AsyncIterator[T]) -> AsyncGenerator[T, None]:
+        """Pass the parts of a renderer on, adding the CPU time spent producing them to render_cpu"""
+        cpu = time.thread_time()
+        async for part in parts:
+            self.render_cpu = self.render_cpu + time.thread_time() - cpu
+            yield part
+            cpu = time.thread_time()
+        self.render_cpu = self.render_cpu + time.thread_time() - cpu
@@ -1,3 +1,5 @@
+import asyncio
+
 from renderer import Renderer
 from constants import config
 
@@ -11,6 +13,9 @@ from graia.ariadne.message.element import Plain
 class BufferedContentMerger(Renderer):
     last_arrived = None
     hold = None
+    flush_ready: Optional[asyncio.Event] = None
+    """Set by the timer once the held content has waited buffer_delay"""
+    timer: Optional[asyncio.TimerHandle] = None
 
     def __init__(self, parent: Renderer):
         self.parent = parent
@@ -18,9 +23,11 @@ class BufferedContentMerger(Renderer):
     async def __aenter__(self) -> None:
         self.hold = []
         self.last_arrived = time.time()
+        self.flush_ready = asyncio.Event()
         await self.parent.__aenter__()
 
     async def __aexit__(self, exc_type: type[BaseException], exc: BaseException, tb) -> None:
+        self.cancel_timer()
         self.hold = None
         await self.parent.__aexit__(exc_type, exc, tb)
 
@@ -35,13 +42,29 @@ class BufferedContentMerger(Renderer):
             self.hold = []
         self.hold.append(Plain(rendered + '\n'))
         if time_delta < config.response.buffer_delay:
+            # Sent by the timer if nothing else arrives in time
+            if self.timer is None:
+                self.timer = asyncio.get_running_loop().call_later(
+                    self.last_arrived + config.response.buffer_delay - current_time, self.flush_ready.set)
             return None
-        elif self.hold:
-            self.last_arrived = current_time
-            rendered = MessageChain(self.hold)
-            self.hold = []
-            return rendered
-        return None
+        return self.take(current_time)
+
+    def take(self, current_time: float) -> Optional[MessageChain]:
+        self.cancel_timer()
+        self.last_arrived = current_time
+        rendered = MessageChain(self.hold) if self.hold else None
+        self.hold = []
+        return rendered
+
+    def cancel_timer(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.flush_ready is not None:
+            self.flush_ready.clear()
+
+    async def flush(self) -> Optional[Any]:
+        return self.take(time.time())
 
     async def result(self) -> Optional[Any]:
         result = MessageChain([])
@@ -55,11 +78,15 @@ class BufferedContentMerger(Renderer):
 class LengthContentMerger(Renderer):
     hold = None
 
-    def __init__(self, parent: Renderer):
+    def __init__(self, parent: Renderer, max_length: int = 1500):
         self.parent = parent
+        self.max_length = max_length
+        """Longest message the platform takes"""
+        self.hold_length = 0
 
     async def __aenter__(self) -> None:
-        self.hold = MessageChain([])
+        self.hold = []
+        self.hold_length = 0
         self.last_arrived = time.time()
         await self.parent.__aenter__()
 
@@ -71,12 +98,16 @@ class LengthContentMerger(Renderer):
         rendered = await self.parent.render(msg)
         if not rendered:
             return None
-        if len(str(self.hold + rendered + '\n')) > 1500:
+        part = rendered + '\n'
+        # Segments are held until the next one would not fit in the same message
+        if self.hold and self.hold_length + len(part) > self.max_length:
             chain = MessageChain(self.hold)
-            self.hold = MessageChain([Plain(rendered + '\n')])
+            self.hold = [Plain(part)]
+            self.hold_length = len(part)
             return chain
-        else:
-            self.hold = self.hold + Plain(rendered + '\n')
+        self.hold.append(Plain(part))
+        self.hold_length = self.hold_length + len(part)
+        return None
 
     async def result(self) -> Optional[Any]:
         result = MessageChain([])
@@ -84,4 +115,4 @@ class LengthContentMerger(Renderer):
             result = result + MessageChain(self.hold)
         if parent := await self.parent.result():
             result = result + parent
-        return result if len(result) > 0 else None
\ No newline at end of file
+        return result if len(result) > 0 else None
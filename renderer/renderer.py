@@ -1,14 +1,36 @@
+import asyncio
+import itertools
 import re
 
 from renderer import Renderer
-from utils.asyncutils import evaluate_array
-from utils.text_to_img import to_image
+from utils.text_to_img import can_draw_plain, split_pages, to_image
 
-from typing import Optional
+from typing import AsyncGenerator, Optional
 
 from graia.ariadne.message.chain import MessageChain
 from graia.ariadne.message.element import Plain
 
+from constants import config
+
+# Regular expressions to search for Markdown or LaTeX patterns
+markdown_pattern = re.compile(
+    r"(\*\*|__|\*|_|\[|\]|\(|\)|#|\+|\-|`|~|>|!)\w*(\*\*|__|\*|_|\[|\]\(|\(|\)|#|\+|\-|`|~|>|!)")
+latex_pattern = re.compile(r"\$(.*?)\$")
+
+
+render_slots = asyncio.Semaphore(config.text_to_image.parallel_renders)
+"""Bounds the images rendered at the same time"""
+
+
+async def draw_image(text: str, plain: bool = False, platform: Optional[str] = None):
+    async with render_slots:
+        return await to_image(text, plain, platform)
+
+
+def is_rich_content(input_str: str) -> bool:
+    """Whether the text has Markdown or LaTeX that only the Markdown renderer draws"""
+    return bool(markdown_pattern.search(input_str) or latex_pattern.search(input_str))
+
 
 class PlainTextRenderer(Renderer):
     def __init__(self, parent: Renderer):
@@ -37,10 +59,15 @@ class PlainTextRenderer(Renderer):
     async def result(self) -> Optional[MessageChain]:
         return await self.parse(await self.parent.result())
 
+    async def flush(self) -> Optional[MessageChain]:
+        return await self.parse(await self.parent.flush())
+
 
 class MarkdownImageRenderer(Renderer):
-    def __init__(self, parent: Renderer):
+    def __init__(self, parent: Renderer, platform: Optional[str] = None):
         self.parent = parent
+        self.platform = platform
+        """Platform the images are encoded for"""
 
     async def __aenter__(self) -> None:
         await self.parent.__aenter__()
@@ -57,7 +84,15 @@ class MarkdownImageRenderer(Renderer):
             if not str(rendered).strip():
                 continue
             everything = everything + str(rendered) + '  \n'
-        return MessageChain([await to_image(everything)]) if everything else None
+        if not everything:
+            return None
+        plain = config.text_to_image.plain_fast_path and not is_rich_content(everything) \
+            and can_draw_plain(everything)
+        pages = [everything]
+        if config.text_to_image.page_height > 0:
+            pages = split_pages(everything, config.text_to_image.page_height, config.text_to_image.max_pages)
+        # The pages of a long reply render in parallel and are sent together, in order
+        return MessageChain(list(await asyncio.gather(*(draw_image(page, plain, self.platform) for page in pages))))
 
     async def render(self, msg: str) -> Optional[MessageChain]:
         return await self.parse(await self.parent.render(msg))
@@ -65,11 +100,16 @@ class MarkdownImageRenderer(Renderer):
     async def result(self) -> Optional[MessageChain]:
         return await self.parse(await self.parent.result())
 
+    async def flush(self) -> Optional[MessageChain]:
+        return await self.parse(await self.parent.flush())
+
 
 class MixedContentMessageChainRenderer(Renderer):
 
-    def __init__(self, parent: Renderer):
+    def __init__(self, parent: Renderer, platform: Optional[str] = None):
         self.parent = parent
+        self.platform = platform
+        """Platform the images are encoded for"""
 
     async def __aenter__(self) -> None:
         await self.parent.__aenter__()
@@ -78,23 +118,16 @@ class MixedContentMessageChainRenderer(Renderer):
         await self.parent.__aexit__(exc_type, exc, tb)
 
     def is_rich_content(self, input_str: str):
-        # Regular expressions to search for Markdown or LaTeX patterns
-        markdown_pattern = r"(\*\*|__|\*|_|\[|\]|\(|\)|#|\+|\-|`|~|>|!)\w*(\*\*|__|\*|_|\[|\]\(|\(|\)|#|\+|\-|`|~|>|!)"
-        latex_pattern = r"\$(.*?)\$"
-
-        # Search for Markdown or LaTeX patterns in the input string
-        return bool(
-            re.search(markdown_pattern, input_str)
-            or re.search(latex_pattern, input_str)
-        )
+        return is_rich_content(input_str)
 
-    async def parse(self, groups: Optional[MessageChain]) -> Optional[MessageChain]:
+    async def parse_parts(self, groups: Optional[MessageChain]) -> AsyncGenerator[Optional[MessageChain], None]:
         if not groups:
-            return None
+            yield None
+            return
         holds = []
         rich_blocks = ''
         plain_blocks = ''
-        # Merger of similar items
+        # Merger of similar items, the images start rendering as soon as their block is complete
         for rendered in groups:
             if not str(rendered).strip():
                 continue
@@ -105,19 +138,51 @@ class MixedContentMessageChainRenderer(Renderer):
                 rich_blocks = rich_blocks + str(rendered) + '  \n'
             else:
                 if rich_blocks.strip():
-                    holds.append(await to_image(rich_blocks.strip()))
+                    holds.append(asyncio.create_task(draw_image(rich_blocks.strip(), platform=self.platform)))
                     rich_blocks = ''
                 plain_blocks = plain_blocks + str(rendered)
         # Judge the last item and throw the rest in
         if rich_blocks.strip():
-            holds.append(await to_image(rich_blocks))
+            holds.append(asyncio.create_task(draw_image(rich_blocks, platform=self.platform)))
         if plain_blocks.strip():
             holds.append(Plain(plain_blocks))
-        await evaluate_array(holds)
-        return MessageChain(holds) if holds else None
+        if not holds:
+            yield None
+            return
+
+        try:
+            # The text before the first image is sent while the images render
+            first = next((i for i, hold in enumerate(holds) if isinstance(hold, asyncio.Task)), len(holds))
+            if 0 < first < len(holds):
+                yield MessageChain(holds[:first])
+                holds = holds[first:]
+            yield MessageChain([await hold if isinstance(hold, asyncio.Task) else hold for hold in holds])
+        finally:
+            for hold in holds:
+                if isinstance(hold, asyncio.Task):
+                    hold.cancel()
+
+    async def parse(self, groups: Optional[MessageChain]) -> Optional[MessageChain]:
+        parts = [part async for part in self.parse_parts(groups) if part]
+        return MessageChain(list(itertools.chain.from_iterable(parts))) if parts else None
 
     async def render(self, msg: str) -> Optional[MessageChain]:
         return await self.parse(await self.parent.render(msg))
 
     async def result(self) -> Optional[MessageChain]:
-        return await self.parse(await self.parent.result())
\ No newline at end of file
+        return await self.parse(await self.parent.result())
+
+    async def flush(self) -> Optional[MessageChain]:
+        return await self.parse(await self.parent.flush())
+
+    async def render_parts(self, msg: str):
+        async for part in self.parse_parts(await self.parent.render(msg)):
+            yield part
+
+    async def result_parts(self):
+        async for part in self.parse_parts(await self.parent.result()):
+            yield part
+
+    async def flush_parts(self):
+        async for part in self.parse_parts(await self.parent.flush()):
+            yield part
@@ -1,62 +1,137 @@
-from typing import Optional
+import bisect
+from typing import List, Optional
 
 from renderer import Renderer
 
+FENCES = ("```", "$$")
+
 
 class MultipleSegmentSplitter(Renderer):
-    last_commit: str = ''
-    uncommitted_msg: str = ''
+    """
+    Splits the streamed reply into segments: lines, ``` code and $$ math blocks once they are closed,
+    and "* " lists once a line that is not an item follows.
+    Only the characters that arrived since the previous call are looked at, so a long block costs O(1) per token
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.text = ''
+        """The reply received so far"""
+        self.start = 0
+        """Beginning of the part which has not been sent yet"""
+        self.lead: Optional[int] = None
+        """First non-whitespace character of the pending part"""
+        self.last: Optional[int] = None
+        """Last non-whitespace character of the pending part"""
+        self.newlines: List[int] = []
+        """Line breaks of the pending part"""
+        self.scan: Optional[int] = None
+        """Beginning of the next line of an open block to look for the closing fence in"""
 
     async def render(self, msg: str) -> Optional[str]:
-        self.uncommitted_msg = msg.removeprefix(self.last_commit)
-        segments = self.uncommitted_msg.strip().split("\n")
+        if msg.startswith(self.text):
+            self.feed(msg, len(self.text))
+        else:
+            # The reply was rewritten, go on after what was sent if it is still there
+            start = self.start if msg.startswith(self.text[:self.start]) else 0
+            self.reset()
+            self.start = start
+            self.feed(msg, start)
+        return self.split()
+
+    def feed(self, msg: str, offset: int):
+        self.text = msg
+        chunk = msg[offset:]
+        position = chunk.find('\n')
+        while position >= 0:
+            self.newlines.append(offset + position)
+            position = chunk.find('\n', position + 1)
+        if stripped := len(chunk.rstrip()):
+            self.last = offset + stripped - 1
+            if self.lead is None:
+                self.lead = offset + len(chunk) - len(chunk.lstrip())
+
+    def commit(self, end: int) -> None:
+        """Mark the text up to end as sent"""
+        self.start = end
+        del self.newlines[:bisect.bisect_left(self.newlines, end)]
+        self.scan = None
+        pending = self.text[end:]
+        if stripped := pending.lstrip():
+            self.lead = len(self.text) - len(stripped)
+            self.last = end + len(pending.rstrip()) - 1
+        else:
+            self.lead = self.last = None
+
+    def emit(self, end: int, commit: Optional[int] = None) -> str:
+        """Send the pending text from its first character with content to end, sent up to commit"""
+        segment = self.text[self.lead:end]
+        self.commit(end if commit is None else commit)
+        return segment
+
+    def split(self) -> Optional[str]:
+        text, lead = self.text, self.lead
         # Skip empty message
-        if not self.uncommitted_msg.strip():
-            self.last_commit = msg
+        if lead is None:
+            self.commit(len(text))
             return None
-        # Merge code
-        if segments[0].startswith("```"):
-            if len(segments) == 1:
-                # Waiting for more line
-                return None
-            tokens = segments[0]
-            for seg in segments[1:]:
-                tokens = tokens + '\n' + seg
-                if seg.endswith("```"):
-                    # Keep left
-                    self.last_commit = self.last_commit + \
-                                           self.uncommitted_msg[:len(tokens) + self.uncommitted_msg.find(tokens)]
-                    return tokens
-            return None
-        elif segments[0].startswith("$$"):
-            if len(segments) == 1:
+        # Merge code and formulas
+        for fence in FENCES:
+            if text.startswith(fence, lead):
+                return self.close_block(fence)
+        if text.startswith("* ", lead) and self.last > lead + 1:
+            return self.split_list()
+        if text[-1] == '\n':
+            return self.emit(self.last + 1, len(text))
+        return None
+
+    def close_block(self, fence: str) -> Optional[str]:
+        """Send the block once a line after its first one ends with the fence"""
+        text, last, size = self.text, self.last, len(fence)
+        if self.scan is None:
+            i = bisect.bisect_left(self.newlines, self.lead)
+            if i == len(self.newlines):
                 # Waiting for more line
                 return None
-            tokens = segments[0]
-            for seg in segments[1:]:
-                tokens = tokens + '\n' + seg
-                if seg.endswith("$$"):
-                    # Keep left
-                    self.last_commit = self.last_commit + \
-                                           self.uncommitted_msg[:len(tokens) + self.uncommitted_msg.find(tokens)]
-                    return tokens
-            return None
-        elif segments[0].startswith("* "):
-            if segments[-1] == '' or segments[-1].startswith("*"):
+            self.scan = self.newlines[i] + 1
+        for end in self.newlines[bisect.bisect_left(self.newlines, self.scan):]:
+            line = self.scan
+            if last < line:
                 return None
-            self.last_commit = msg.removesuffix(segments[-1])
-            return self.uncommitted_msg.removesuffix(segments[-1]).strip()
-        elif self.uncommitted_msg[-1] == '\n':
-            self.last_commit = msg
-            # logger.debug("Send a message directly:" + '\n'.join(segments).strip())
-            return '\n'.join(segments).strip()
+            if last < end:
+                # The last line with content counts without its trailing whitespace
+                if last - size + 1 >= line and text.startswith(fence, last - size + 1):
+                    return self.emit(last + 1)
+            elif end - size >= line and text.startswith(fence, end - size):
+                return self.emit(end)
+            # A complete line which does not close the block never will
+            self.scan = end + 1
+        line = self.scan
+        if last - size + 1 >= line and text.startswith(fence, last - size + 1):
+            return self.emit(last + 1)
         return None
 
+    def split_list(self) -> Optional[str]:
+        """Send the list once its last line with content is not an item"""
+        text, last = self.text, self.last
+        i = bisect.bisect_left(self.newlines, last)
+        line = self.newlines[i - 1] + 1 if i > 0 and self.newlines[i - 1] > self.lead else self.lead
+        if text[line] == '*':
+            return None
+        if last < len(text) - 1:
+            # Followed by whitespace, the line goes along with the list
+            return self.emit(last + 1, len(text))
+        segment = text[self.start:line].strip()
+        self.commit(line)
+        return segment
+
     async def result(self) -> str:
-        return self.uncommitted_msg
+        return self.text[self.start:]
 
     async def __aenter__(self) -> None:
-        self.msg = ''
+        self.reset()
 
     async def __aexit__(self, exc_type: type[BaseException], exc: BaseException, tb) -> None:
-        self.msg = None
\ No newline at end of file
+        self.reset()
@@ -0,0 +1,61 @@
+"""
+Renderer CPU per streamed reply with and without the DeltaBatcher in front of the splitter, run with
+    python -m tests.bench_batcher [tokens per second]
+The stream is replayed on a simulated clock, a token of about 4 characters at the given rate
+"""
+import asyncio
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+from renderer import batcher as batcher_module
+from renderer.batcher import DeltaBatcher
+from renderer.splitter import MultipleSegmentSplitter
+from tests.splitter_reference import random_reply
+
+clock = SimpleNamespace(now=0.0)
+# Only the batcher reads the simulated clock, the CPU time is the real one
+batcher_module.time = SimpleNamespace(monotonic=lambda: clock.now, thread_time=time.thread_time)
+
+
+async def stream_through(stream, rate: float, batched: bool):
+    """CPU seconds spent in the splitter for the stream and the number of snapshots it was given"""
+    splitter = MultipleSegmentSplitter()
+    batcher = DeltaBatcher(0.2, 64) if batched else None
+    cpu, rendered = 0.0, 0
+    for snapshot in stream:
+        clock.now += 1 / rate
+        if batcher is None or batcher.offer(snapshot):
+            start = time.thread_time()
+            await splitter.render(snapshot)
+            cpu += time.thread_time() - start
+            rendered += 1
+    if batcher is not None and (held := batcher.take()) is not None:
+        await splitter.render(held)
+        rendered += 1
+    await splitter.result()
+    return cpu, rendered
+
+
+async def main(rate: float):
+    rng = random.Random(1)
+    replies = {
+        "mixed replies": [random_reply(rng) for _ in range(300)],
+        "20 KB code block": ["```python\n" + "print('a line of code')\n" * 850 + "```\n"],
+        "40 KB of paragraphs": [("a sentence of a long reply, " * 30 + "\n") * 50],
+    }
+    print(f"{rate:.0f} tokens/s")
+    for name, texts in replies.items():
+        streams = [[text[:end] for end in range(4, len(text) + 4, 4)] for text in texts if text]
+        snapshots = sum(len(stream) for stream in streams)
+        before = [await stream_through(stream, rate, False) for stream in streams]
+        after = [await stream_through(stream, rate, True) for stream in streams]
+        cpu_before = sum(cpu for cpu, _ in before) / len(streams)
+        cpu_after = sum(cpu for cpu, _ in after) / len(streams)
+        print(f"{name}: {cpu_before * 1000:.2f} ms of CPU per stream before, {cpu_after * 1000:.2f} ms after, "
+              f"{sum(count for _, count in after)} of {snapshots} snapshots rendered")
+
+
+if __name__ == '__main__':
+    asyncio.run(main(float(sys.argv[1]) if len(sys.argv) > 1 else 50))
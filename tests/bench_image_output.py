@@ -0,0 +1,50 @@
+"""
+Size and encode time of a rendered reply for each image output option. Run from a configured bot folder with
+    python -m tests.bench_image_output [image.png]
+which encodes the image given, or a long reply drawn by the plain renderer
+"""
+import sys
+import time
+from io import BytesIO
+
+from PIL import Image
+
+from config import ImageOutput
+from utils.text_to_img import encode_png, text_to_image_plain, transcode
+
+REPLY = "\n".join(f"{i}. The renderer draws the reply as an image, 中文字符也在这里 — line {i}" for i in range(120))
+
+OPTIONS = {
+    "png (as rendered)": ImageOutput(),
+    "png optimize": ImageOutput(optimize=True),
+    "png compress_level 9": ImageOutput(compress_level=9),
+    "png 64 colors": ImageOutput(colors=64),
+    "png 16 colors + optimize": ImageOutput(colors=16, optimize=True),
+    "jpeg quality 85": ImageOutput(format="jpeg"),
+    "jpeg quality 85 optimize": ImageOutput(format="jpeg", optimize=True),
+    "jpeg quality 60": ImageOutput(format="jpeg", quality=60),
+    "webp quality 85": ImageOutput(format="webp"),
+    "webp quality 85 optimize": ImageOutput(format="webp", optimize=True),
+    "webp max 100 KB": ImageOutput(format="webp", max_bytes=100_000),
+}
+
+
+def main(path: str = ''):
+    if path:
+        with open(path, 'rb') as f:
+            data = f.read()
+    else:
+        data = encode_png(text_to_image_plain(REPLY))
+    size = Image.open(BytesIO(data)).size
+    print(f"{size[0]}x{size[1]} image, {len(data) / 1024:.0f} KB as rendered")
+    for name, output in OPTIONS.items():
+        runs = 5
+        start = time.perf_counter()
+        for _ in range(runs):
+            encoded = transcode(data, output)
+        elapsed = (time.perf_counter() - start) / runs
+        print(f"{name:26} {len(encoded) / 1024:8.0f} KB {elapsed * 1000:8.1f} ms")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else '')
@@ -0,0 +1,42 @@
+"""
+Markdown to HTML conversions per second on code-heavy replies: a fresh converter for each reply the way it was
+before, a pooled converter, and a pooled converter with the highlighted blocks cached. Run from a configured
+bot folder with
+    python -m tests.bench_markdown [replies]
+"""
+import random
+import sys
+import time
+
+from tests.markdown_reference import code_reply, reference_md_to_html, uncached_highlighting
+from utils.text_to_img import CachedCodeHilite, md_to_html
+
+
+def measure(convert, replies) -> float:
+    start = time.perf_counter()
+    for reply in replies:
+        convert(reply)
+    return len(replies) / (time.perf_counter() - start)
+
+
+def main(count: int):
+    rng = random.Random(1)
+    replies = [code_reply(rng) for _ in range(count)]
+    # Warm up the imports and the pool
+    md_to_html(replies[0])
+
+    fresh = measure(reference_md_to_html, replies)
+    with uncached_highlighting():
+        pooled = measure(md_to_html, replies)
+    CachedCodeHilite.cache.clear()
+    # The blocks come back across replies, like the pages and the edits of a reply
+    cached = measure(md_to_html, replies)
+    print(f"{count} code-heavy replies")
+    print(f"fresh converter:  {fresh:.0f} replies/s")
+    print(f"pooled converter: {pooled:.0f} replies/s ({pooled / fresh:.1f}x)")
+    print(f"pooled + cache:   {cached:.0f} replies/s ({cached / fresh:.1f}x), "
+          f"{len(CachedCodeHilite.cache)} blocks cached")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
@@ -0,0 +1,75 @@
+"""
+Bot processes sharing the quotas of the same chats through the sqlite backend. Every process reserves tokens
+and counts messages as fast as it can, the totals in the database must match what the processes were granted.
+Run from a configured bot folder with
+    python -m tests.bench_quota_processes [processes] [requests per process]
+"""
+import multiprocessing
+import os
+import sys
+import time
+from tempfile import TemporaryDirectory
+
+from manager.ratelimit import BUSY_WAIT, RateLimitManager
+
+CHATS = [f"group-bench-{i}" for i in range(4)]
+BURST = 500
+"""Tokens each chat may reserve, refilled at one token per hour so the total granted is fixed"""
+
+
+def worker(path: str, requests: int, results: multiprocessing.Queue):
+    manager = RateLimitManager(backend="sqlite", sqlite_path=path)
+    granted = {chat: 0 for chat in CHATS}
+    busy = 0
+    latencies = []
+    for i in range(requests):
+        chat = CHATS[i % len(CHATS)]
+        start = time.perf_counter()
+        wait = manager.reserve("tokens", chat, 1)
+        latencies.append(time.perf_counter() - start)
+        if wait == 0:
+            granted[chat] += 1
+        elif wait == BUSY_WAIT:
+            busy += 1
+        _type, _id = manager.subjects(chat)[0]
+        manager.consume_quota("messages", _type, _id)
+    manager.flush()
+    results.put((granted, busy, max(latencies)))
+
+
+def main(processes: int, requests: int):
+    with TemporaryDirectory() as folder:
+        path = os.path.join(folder, "ratelimit.db")
+        manager = RateLimitManager(backend="sqlite", sqlite_path=path)
+        for chat in CHATS:
+            _type, _id = manager.subjects(chat)[0]
+            manager.update_quota("tokens", _type, _id, 1, algorithm="token_bucket", burst=BURST)
+
+        context = multiprocessing.get_context("spawn")
+        results = context.Queue()
+        workers = [context.Process(target=worker, args=(path, requests, results)) for _ in range(processes)]
+        start = time.perf_counter()
+        for process in workers:
+            process.start()
+        reports = [results.get() for _ in workers]
+        for process in workers:
+            process.join()
+        elapsed = time.perf_counter() - start
+
+        for chat in CHATS:
+            _type, _id = manager.subjects(chat)[0]
+            granted = sum(report[0][chat] for report in reports)
+            messages = manager.get_quota_usage("messages", _type, _id)['count']
+            tokens = manager.get_quota_usage("tokens", _type, _id)['count']
+            # Every message counted once, every token granted charged once and never more than the burst
+            sent = processes * sum(CHATS[i % len(CHATS)] == chat for i in range(requests))
+            assert messages == sent, (chat, messages, sent)
+            assert tokens == granted <= BURST, (chat, tokens, granted)
+        print(f"{processes} processes, {processes * requests} requests on {len(CHATS)} chats in {elapsed:.2f} s")
+        print(f"{processes * requests * 2 / elapsed:.0f} quota operations/s, "
+              f"{sum(report[1] for report in reports)} refused as busy, "
+              f"slowest check {max(report[2] for report in reports) * 1000:.0f} ms")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 8, int(sys.argv[2]) if len(sys.argv) > 2 else 400)
@@ -0,0 +1,84 @@
+"""
+Images per second of the renderer pool against one wkhtmltoimage process started through imgkit per image,
+the way images were rendered before. Run from a configured bot folder with
+    python -m tests.bench_render_pool [images] [concurrency]
+"""
+import asyncio
+import os
+import sys
+import time
+from io import StringIO
+from tempfile import NamedTemporaryFile
+
+import imgkit
+from PIL import Image
+
+from utils.text_to_img import asset_folder, config, fill_template, md_to_html, render_page, renderer_pool
+
+REPLY = """## Sorting a list
+
+Use `sorted` to get a new list, or `list.sort` to sort in place:
+
+```python
+numbers = [5, 2, 9, 1]
+print(sorted(numbers))
+numbers.sort(reverse=True)
+```
+
+| Function | Returns |
+|----------|---------|
+| sorted | a new list |
+| list.sort | None |
+
+Both run in $O(n \\log n)$.
+"""
+
+
+def render_with_imgkit(text: str) -> Image.Image:
+    html = fill_template(md_to_html(text), '')
+    temp_file = NamedTemporaryFile(mode='w+b', suffix='.png')
+    temp_filename = temp_file.name
+    temp_file.close()
+    try:
+        with StringIO(html) as input_file:
+            imgkit.from_file(input_file, temp_filename, {
+                "enable-local-file-access": "",
+                "allow": asset_folder,
+                "width": config.text_to_image.width,
+            }, config=imgkit.config(wkhtmltoimage=config.text_to_image.wkhtmltoimage))
+        return Image.open(temp_filename, formats=['PNG']).convert('RGB')
+    finally:
+        os.remove(temp_filename)
+
+
+async def render_with_pool(text: str) -> bytes:
+    html = await renderer_pool.run(md_to_html, text)
+    return await renderer_pool.run(render_page, fill_template(html, ''))
+
+
+async def measure(render, images: int, concurrency: int) -> float:
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with slots:
+            # A different text each time, nothing can be reused
+            await render(f"{REPLY}\nReply {i}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(images)))
+    return images / (time.perf_counter() - start)
+
+
+async def main(images: int, concurrency: int):
+    loop = asyncio.get_running_loop()
+    # The workers are started and warmed up before measuring
+    await asyncio.gather(*(render_with_pool(REPLY) for _ in range(max(renderer_pool.size, 1))))
+    before = await measure(lambda text: loop.run_in_executor(None, render_with_imgkit, text), images, concurrency)
+    after = await measure(render_with_pool, images, concurrency)
+    print(f"{images} images, {concurrency} at a time, {renderer_pool.size} renderer workers")
+    print(f"imgkit per image: {before:.1f} images/s")
+    print(f"renderer pool:    {after:.1f} images/s ({after / before:.1f}x)")
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 50, int(sys.argv[2]) if len(sys.argv) > 2 else 8))
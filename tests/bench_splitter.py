@@ -0,0 +1,42 @@
+"""
+Throughput of MultipleSegmentSplitter against the splitter it replaced, run with
+    python -m tests.bench_splitter
+"""
+import asyncio
+import random
+import time
+
+from renderer.splitter import MultipleSegmentSplitter
+from tests.splitter_reference import ReferenceSplitter, random_reply
+
+
+async def stream_through(splitter_type, streams) -> float:
+    start = time.perf_counter()
+    for stream in streams:
+        splitter = splitter_type()
+        for snapshot in stream:
+            await splitter.render(snapshot)
+        await splitter.result()
+    return time.perf_counter() - start
+
+
+async def main():
+    rng = random.Random(1)
+    # Kept short of the worst case, the splitter it replaced is quadratic in the length of a block
+    replies = {
+        "mixed replies": [random_reply(rng) for _ in range(300)],
+        "20 KB code block": ["```python\n" + "print('a line of code')\n" * 850 + "```\n"],
+        "40 KB of paragraphs": [("a sentence of a long reply, " * 30 + "\n") * 50],
+    }
+    for name, texts in replies.items():
+        # Tokens of about 4 characters, like the upstream sends them
+        streams = [[text[:end] for end in range(4, len(text) + 4, 4)] for text in texts if text]
+        characters = sum(len(stream[-1]) for stream in streams)
+        before = await stream_through(ReferenceSplitter, streams)
+        after = await stream_through(MultipleSegmentSplitter, streams)
+        print(f"{name}: {characters / before / 1e3:.0f} K chars/s before, {characters / after / 1e3:.0f} K chars/s after"
+              f" ({before / after:.1f}x)")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
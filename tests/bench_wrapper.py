@@ -0,0 +1,35 @@
+"""
+Wrapping speed of the fallback renderer's TextWrapper against the one it replaced, on long CJK and Latin texts.
+Run from a configured bot folder with
+    python -m tests.bench_wrapper
+"""
+import random
+import time
+
+from tests.wrapper_reference import ReferenceTextWrapper, random_text
+from utils.text_to_img import TextWrapper
+
+
+def measure(wrapper_type, text: str, width: int) -> float:
+    start = time.perf_counter()
+    wrapper_type(width=width, break_long_words=True).wrap(text)
+    return time.perf_counter() - start
+
+
+def main():
+    rng = random.Random(1)
+    texts = {
+        # A run without spaces is cut into a line at a time, the old wrapper measured the rest again each time
+        "36k CJK characters without spaces": "".join(rng.choice("中文字符宽度测试汉字") for _ in range(36000)),
+        "160 kB of Latin text": " ".join(rng.choice(["the", "wrapper", "counts", "display", "width"])
+                                         for _ in range(27000)),
+        "mixed replies": "\n".join(random_text(rng) for _ in range(300)),
+    }
+    for name, text in texts.items():
+        before = sum(measure(ReferenceTextWrapper, line, 80) for line in text.split('\n'))
+        after = sum(measure(TextWrapper, line, 80) for line in text.split('\n'))
+        print(f"{name}: {before * 1000:.1f} ms before, {after * 1000:.1f} ms after ({before / after:.0f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+md_to_html as it was before the converters were pooled and the highlighted blocks cached,
+for the equivalence test and the benchmark
+"""
+import contextlib
+import random
+
+import markdown
+from markdown.extensions import codehilite, fenced_code
+from markdown.extensions.codehilite import CodeHiliteExtension
+from markdown.extensions.tables import TableExtension
+from mdx_math import MathExtension
+from pygments.formatters import HtmlFormatter
+from pygments.styles.xcode import XcodeStyle
+
+from utils.text_to_img import CachedCodeHilite, DisableHTMLExtension
+
+
+@contextlib.contextmanager
+def uncached_highlighting():
+    """Highlight with the CodeHilite of markdown itself"""
+    codehilite.CodeHilite = fenced_code.CodeHilite = CachedCodeHilite.__bases__[0]
+    try:
+        yield
+    finally:
+        codehilite.CodeHilite = fenced_code.CodeHilite = CachedCodeHilite
+
+
+def reference_md_to_html(text: str) -> str:
+    text = text.replace("\n", "  \n")
+    extensions = [
+        DisableHTMLExtension(),
+        MathExtension(enable_dollar_delimiter=True),
+        CodeHiliteExtension(linenums=False, css_class='highlight', noclasses=False, guess_lang=True),
+        TableExtension(),
+        'fenced_code'
+    ]
+    md = markdown.Markdown(extensions=extensions)
+    with uncached_highlighting():
+        h = md.convert(text)
+    css_style = HtmlFormatter(style=XcodeStyle).get_style_defs('.highlight')
+    return f"<style>{css_style}</style>\n{h}"
+
+
+SNIPPETS = [
+    ("python", "def fib(n):\n    a, b = 0, 1\n    for _ in range(n):\n        a, b = b, a + b\n    return a"),
+    ("", "import os\nfor name in os.listdir('.'):\n    print(name)"),
+    ("javascript", "const total = items.reduce((sum, item) => sum + item.price, 0);\nconsole.log(total);"),
+    ("", "SELECT name, COUNT(*) FROM users GROUP BY name HAVING COUNT(*) > 1;"),
+    ("bash", "for f in *.log; do\n  gzip \"$f\"\ndone"),
+    ("", "#include <stdio.h>\nint main(void) {\n    printf(\"hi\\n\");\n    return 0;\n}"),
+]
+PROSE = ["Here is how to do it:", "Run it with `python main.py`.", "The cost is $O(n)$.", "* one\n* two",
+         "| a | b |\n|---|---|\n| 1 | 2 |", "**Note:** the order matters.", "1. first\n2. second"]
+
+
+def code_reply(rng: random.Random) -> str:
+    """A reply with a few code blocks between short paragraphs, lists, tables and math"""
+    parts = []
+    for _ in range(rng.randint(1, 4)):
+        parts.append(rng.choice(PROSE))
+        lang, code = rng.choice(SNIPPETS)
+        parts.append(f"```{lang}\n{code}\n```")
+    parts.append(rng.choice(PROSE))
+    return "\n\n".join(parts)
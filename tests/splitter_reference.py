@@ -0,0 +1,101 @@
+"""
+MultipleSegmentSplitter as it was before it became incremental, the reference its output is checked against,
+and the replies streamed through both
+"""
+import random
+from typing import List, Optional
+
+
+class ReferenceSplitter:
+    last_commit: str = ''
+    uncommitted_msg: str = ''
+
+    async def render(self, msg: str) -> Optional[str]:
+        self.uncommitted_msg = msg.removeprefix(self.last_commit)
+        segments = self.uncommitted_msg.strip().split("\n")
+        # Skip empty message
+        if not self.uncommitted_msg.strip():
+            self.last_commit = msg
+            return None
+        # Merge code
+        if segments[0].startswith("```"):
+            if len(segments) == 1:
+                # Waiting for more line
+                return None
+            tokens = segments[0]
+            for seg in segments[1:]:
+                tokens = tokens + '\n' + seg
+                if seg.endswith("```"):
+                    # Keep left
+                    self.last_commit = self.last_commit + \
+                                           self.uncommitted_msg[:len(tokens) + self.uncommitted_msg.find(tokens)]
+                    return tokens
+            return None
+        elif segments[0].startswith("$$"):
+            if len(segments) == 1:
+                # Waiting for more line
+                return None
+            tokens = segments[0]
+            for seg in segments[1:]:
+                tokens = tokens + '\n' + seg
+                if seg.endswith("$$"):
+                    # Keep left
+                    self.last_commit = self.last_commit + \
+                                           self.uncommitted_msg[:len(tokens) + self.uncommitted_msg.find(tokens)]
+                    return tokens
+            return None
+        elif segments[0].startswith("* "):
+            if segments[-1] == '' or segments[-1].startswith("*"):
+                return None
+            self.last_commit = msg.removesuffix(segments[-1])
+            return self.uncommitted_msg.removesuffix(segments[-1]).strip()
+        elif self.uncommitted_msg[-1] == '\n':
+            self.last_commit = msg
+            # logger.debug("Send a message directly:" + '\n'.join(segments).strip())
+            return '\n'.join(segments).strip()
+        return None
+
+    async def result(self) -> str:
+        return self.uncommitted_msg
+
+    async def __aenter__(self) -> None:
+        self.msg = ''
+
+    async def __aexit__(self, exc_type: type[BaseException], exc: BaseException, tb) -> None:
+        self.msg = None
+
+WORDS = ["the", "reply", "token", "streams", "in", "small", "chunks", "and", "中文", "字符", "**bold**", "`code`",
+         "x", "$a$", "*", "-", "1."]
+
+
+def random_line(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(0, 12)))
+
+
+def random_reply(rng: random.Random) -> str:
+    """A reply made of paragraphs, lists, code and math blocks, with the odd stray space and empty line"""
+    lines = []
+    for _ in range(rng.randint(1, 30)):
+        kind = rng.random()
+        if kind < 0.15:
+            fence = rng.choice(["```", "$$"])
+            lines.append(fence + rng.choice(["", "python", " "]))
+            lines.extend(random_line(rng) for _ in range(rng.randint(0, 8)))
+            lines.append(rng.choice(["", "  "]) + fence + rng.choice(["", " "]))
+        elif kind < 0.3:
+            lines.extend("* " + random_line(rng) for _ in range(rng.randint(1, 5)))
+        elif kind < 0.35:
+            lines.append(rng.choice(["", " ", "\t"]))
+        else:
+            lines.append(random_line(rng))
+    return "\n".join(lines) + rng.choice(["", "\n", "\n\n"])
+
+
+def snapshots(reply: str, rng: random.Random) -> List[str]:
+    """The growing text of the reply as an adapter yields it, a few characters at a time"""
+    result = []
+    end = 0
+    while end < len(reply):
+        end = min(len(reply), end + rng.choice([1, 1, 2, 3, 5, 8, 20]))
+        result.append(reply[:end])
+    return result
@@ -0,0 +1,115 @@
+import asyncio
+
+from utils.asyncutils import Relay
+
+
+async def upstream(lines, delay, cleaned_up):
+    """Yields the growing reply like an adapter, the stop lands while it waits for the next line"""
+    reply = ''
+    try:
+        for line in lines:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                asyncio.current_task().uncancel()
+                break
+            reply += line
+            yield reply
+    finally:
+        cleaned_up.append(reply)
+
+
+def test_flushes_while_the_source_is_silent():
+    async def main():
+        event = asyncio.Event()
+        relay = Relay(upstream(["a", "b"], 0.2, []), event)
+        asyncio.get_running_loop().call_later(0.1, event.set)
+        assert [item async for item in relay.items()] == [None, "a", "ab"]
+
+    asyncio.run(main())
+
+
+def test_stopping_the_producer_leaves_the_consumer_alone():
+    async def main():
+        cleaned_up = []
+        event = asyncio.Event()
+        relay = Relay(upstream(["a", "b", "c"], 0.05, cleaned_up), event)
+        received = []
+        async for item in relay.items():
+            received.append(item)
+            # Stopped while the consumer is busy with what arrived, e.g. sending it
+            relay.producer.cancel()
+            await asyncio.sleep(0.1)
+        await relay.aclose()
+        assert received == ["a"]
+        assert cleaned_up == ["a"]
+        assert not asyncio.current_task().cancelling()
+
+    asyncio.run(main())
+
+
+def test_cancelled_consumer_waits_for_the_clean_up():
+    async def main():
+        cleaned_up = []
+
+        async def consume():
+            relay = Relay(upstream(["a"] * 10, 0.05, cleaned_up))
+            items = relay.items()
+            try:
+                async for _ in items:
+                    pass
+            finally:
+                await items.aclose()
+                await relay.aclose()
+
+        task = asyncio.create_task(consume())
+        await asyncio.sleep(0.12)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert task.cancelled()
+        assert cleaned_up == ["aa"]
+
+    asyncio.run(main())
+
+
+def test_raises_what_the_source_raised():
+    async def failing():
+        yield "a"
+        raise ValueError("upstream")
+
+    async def main():
+        relay = Relay(failing(), asyncio.Event())
+        received = []
+        try:
+            async for item in relay.items():
+                received.append(item)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("the error of the source was not raised")
+        await relay.aclose()
+        assert received == ["a"]
+
+    asyncio.run(main())
+
+
+def test_slow_consumer_only_gets_the_newest_text():
+    async def source():
+        for item in ["a", "ab", 42, "abc", "abcd"]:
+            await asyncio.sleep(0.01)
+            yield item
+
+    async def main():
+        relay = Relay(source(), asyncio.Event())
+        received = []
+        async for item in relay.items():
+            received.append(item)
+            # Busy sending the first text while the rest arrives
+            if len(received) == 1:
+                await asyncio.sleep(0.2)
+        await relay.aclose()
+        # The texts are whole replies, the ones in between are skipped, the other items are all kept
+        assert received == ["a", "ab", 42, "abcd"]
+        assert len(relay.pending) == 0
+
+    asyncio.run(main())
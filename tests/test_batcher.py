@@ -0,0 +1,51 @@
+import asyncio
+import random
+
+from renderer.batcher import DeltaBatcher
+from renderer.splitter import MultipleSegmentSplitter
+from tests.splitter_reference import random_reply, snapshots
+
+
+async def segments(stream, batcher=None):
+    """Segments the splitter sends for the stream, through the batcher the way Conversation.ask uses it"""
+    splitter = MultipleSegmentSplitter()
+    result = []
+    for snapshot in stream:
+        if batcher is None or batcher.offer(snapshot):
+            result.append(await splitter.render(snapshot))
+    if batcher is not None and (held := batcher.take()) is not None:
+        result.append(await splitter.render(held))
+    result.append(await splitter.result())
+    # The rest left at the end may start with whitespace a snapshot held back would have let the splitter skip
+    return [segment.strip() for segment in result if segment and segment.strip()]
+
+
+def test_list_then_paragraph():
+    async def main():
+        reply = "* apple\n* pear\nThat is all, enjoy them.\n\n1. one\n2. two\nBye"
+        stream = [reply[:end] for end in range(1, len(reply) + 1)]
+        # Nothing is ever sent because of time or size, only line breaks and fences let the snapshots through
+        assert await segments(stream, DeltaBatcher(3600, 10 ** 6)) == await segments(stream)
+
+    asyncio.run(main())
+
+
+def test_code_fence():
+    async def main():
+        reply = "Run this:\n```python\nprint(1)\nprint(2)\n```\nIt prints two lines.\n```\nplain\n```"
+        for step in (1, 2, 3, 7):
+            stream = [reply[:end] for end in range(step, len(reply) + step, step)]
+            assert await segments(stream, DeltaBatcher(3600, 10 ** 6)) == await segments(stream)
+
+    asyncio.run(main())
+
+
+def test_same_segments_with_and_without_the_batcher():
+    rng = random.Random(0)
+
+    async def main():
+        for _ in range(2000):
+            stream = snapshots(random_reply(rng), rng)
+            assert await segments(stream, DeltaBatcher(3600, rng.choice([8, 64, 10 ** 6]))) == await segments(stream)
+
+    asyncio.run(main())
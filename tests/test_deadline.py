@@ -0,0 +1,80 @@
+import asyncio
+import random
+
+from utils.deadline import DeadlineScheduler, RequestDeadlines
+
+
+async def handle(requests: RequestDeadlines, duration: float, timeout: float, max_timeout: float,
+                 chunks: int = 0) -> dict:
+    """Run one request the way MiddlewareTimeout does, sending a chunk now and then"""
+    result = {"reminders": 0, "expired": False, "finished": False}
+
+    async def request():
+        for _ in range(chunks):
+            await asyncio.sleep(duration / (chunks + 1))
+            requests.responded()
+        await asyncio.sleep(duration / (chunks + 1))
+        result["finished"] = True
+
+    def remind():
+        result["reminders"] += 1
+
+    task = asyncio.create_task(request())
+    requests.start(task, timeout, max_timeout, remind)
+    try:
+        await task
+    except asyncio.CancelledError:
+        result["expired"] = task in requests.expired
+        if not result["expired"]:
+            raise
+    finally:
+        requests.finish(task)
+    return result
+
+
+def test_requests_of_one_chat_keep_their_own_deadlines():
+    async def main():
+        scheduler = DeadlineScheduler()
+        requests = RequestDeadlines(scheduler)
+        # The first request ends while the second one, of the same chat, is still running
+        first = asyncio.create_task(handle(requests, 0.05, 0.3, 0.2))
+        second = asyncio.create_task(handle(requests, 2, 0.3, 0.2))
+        assert (await first)["finished"]
+        result = await asyncio.wait_for(second, 1)
+        assert result["expired"] and not result["finished"]
+        assert len(requests) == 0 and len(scheduler) == 0
+
+    asyncio.run(main())
+
+
+def test_many_requests_in_one_chat():
+    async def main():
+        scheduler = DeadlineScheduler()
+        requests = RequestDeadlines(scheduler)
+        rng = random.Random(0)
+        durations = [rng.choice([0.02, 0.1, 0.6]) for _ in range(3000)]
+        # Silence before the reminder 0.25 s, hard timeout 0.4 s
+        results = await asyncio.gather(*(handle(requests, duration, 0.25, 0.4, chunks=5) for duration in durations))
+        for duration, result in zip(durations, results):
+            if duration < 0.4:
+                assert result["finished"] and not result["expired"]
+                assert result["reminders"] == 0
+            else:
+                assert result["expired"] and not result["finished"]
+        assert len(requests) == 0 and len(scheduler) == 0
+        assert not requests.expired
+
+    asyncio.run(main())
+
+
+def test_reminder_is_sent_again_after_the_next_silence():
+    async def main():
+        scheduler = DeadlineScheduler()
+        requests = RequestDeadlines(scheduler)
+        # Chunks every 0.2 s with a reminder after 0.05 s of silence, each gap gets its own reminder
+        result = await handle(requests, 0.8, 0.05, 5, chunks=3)
+        assert result["finished"]
+        assert result["reminders"] == 4
+        assert len(scheduler) == 0
+
+    asyncio.run(main())
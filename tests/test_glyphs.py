@@ -0,0 +1,35 @@
+from utils.glyphs import font_covers, needs_browser
+
+# Stands in for a font like sarasa-mono: Latin, CJK and punctuation, no emoji and no Cyrillic
+FONT = set("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789.,!?'-:;()你好世界。，")
+
+
+def has_glyph(char: str) -> bool:
+    return char in FONT
+
+
+def test_text_the_font_has_is_drawn_plain():
+    assert font_covers("Hello, world!\n你好，世界。\n\n  It's 42.", has_glyph)
+    assert font_covers("", has_glyph)
+
+
+def test_emoji_go_to_the_browser():
+    for text in ["Done 😀", "Sunny ☀", "Sunny ☀️", "Press 1⃣", "Family 👨‍👩‍👧", "Yes ✅"]:
+        assert not font_covers(text, lambda char: True), text
+
+
+def test_characters_outside_the_bmp_go_to_the_browser():
+    # Rare CJK of extension B and a math letter, both above U+FFFF
+    for char in ["\U00020000", "\U0001D400"]:
+        assert needs_browser(char)
+        assert not font_covers(f"abc{char}", lambda char: True)
+
+
+def test_characters_without_glyph_go_to_the_browser():
+    assert not font_covers("Привет", has_glyph)
+    assert not font_covers("hello é", has_glyph)
+
+
+def test_common_characters_do_not_need_the_browser():
+    for char in "aZ9你。→€±—":
+        assert not needs_browser(char), char
@@ -0,0 +1,44 @@
+import random
+from io import BytesIO
+
+from PIL import Image
+
+from config import ImageOutput
+from utils.text_to_img import max_dimensions, transcode
+
+
+def png(image: Image.Image) -> bytes:
+    b = BytesIO()
+    image.save(b, format="png")
+    return b.getvalue()
+
+
+def noise(width: int, height: int) -> bytes:
+    """A picture nothing compresses well"""
+    rng = random.Random(0)
+    return png(Image.frombytes('RGB', (width, height), rng.randbytes(width * height * 3)))
+
+
+def test_transcode_respects_max_bytes():
+    data = noise(800, 600)
+    for fmt in ("png", "jpeg", "webp"):
+        output = ImageOutput(format=fmt, max_bytes=100_000)
+        encoded = transcode(data, output)
+        assert len(encoded) <= output.max_bytes, fmt
+        assert Image.open(BytesIO(encoded)).format.lower() == fmt
+
+
+def test_transcode_keeps_what_fits():
+    data = png(Image.new('RGB', (400, 300), 'white'))
+    assert transcode(data, ImageOutput(max_bytes=len(data))) is data
+    encoded = transcode(data, ImageOutput(format="jpeg", max_bytes=10 ** 6))
+    assert Image.open(BytesIO(encoded)).size == (400, 300)
+
+
+def test_images_too_tall_for_the_format_stay_png():
+    for fmt in ("jpeg", "webp"):
+        data = png(Image.new('RGB', (50, max_dimensions[fmt] + 1), 'white'))
+        encoded = transcode(data, ImageOutput(format=fmt))
+        assert Image.open(BytesIO(encoded)).format == "PNG", fmt
+    data = png(Image.new('RGB', (50, max_dimensions["webp"]), 'white'))
+    assert Image.open(BytesIO(transcode(data, ImageOutput(format="webp")))).format == "WEBP"
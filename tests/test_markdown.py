@@ -0,0 +1,13 @@
+import random
+
+from tests.markdown_reference import code_reply, reference_md_to_html
+from utils.text_to_img import md_to_html
+
+
+def test_pooled_converters_give_the_html_of_a_fresh_one():
+    rng = random.Random(0)
+    replies = [code_reply(rng) for _ in range(100)]
+    replies.append("<b>raw html</b> stays text\n\n$$\nx^2\n$$\n\n```\nplain block\n```")
+    # Every reply twice, the second time from a converter used before and with its code blocks cached
+    for reply in replies + replies:
+        assert md_to_html(reply) == reference_md_to_html(reply)
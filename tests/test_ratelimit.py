@@ -0,0 +1,143 @@
+import time
+
+import pytest
+
+from manager.ratelimit import HOUR, FixedWindow, RateLimitManager, SlidingWindow, TokenBucket
+
+# Start of an hour in local time, the fixed window resets at the hour of the server clock
+NOW = time.time()
+HOUR_START = int(NOW) - time.localtime(NOW).tm_min * 60 - time.localtime(NOW).tm_sec
+
+
+def fill(algorithm, limit: dict, now: float, count: int, record=None) -> dict:
+    record = algorithm.refresh(record, 'group', '1', now)
+    for _ in range(count):
+        assert algorithm.wait(record, limit, now) == 0
+        record = algorithm.consume(record, limit, now)
+    return record
+
+
+def test_sliding_window_refuses_the_burst_across_the_hour():
+    limit = {'rate': 10}
+    fixed, sliding = FixedWindow(), SlidingWindow()
+    # Ten messages in the last second of an hour and ten more in the first second of the next one
+    end, start = HOUR_START + HOUR - 1, HOUR_START + HOUR + 1
+    record = fill(fixed, limit, end, 10)
+    assert fixed.wait(record, limit, end) > 0
+    fill(fixed, limit, start, 10, record)
+
+    window = int(start // HOUR) * HOUR
+    record = fill(sliding, limit, window - 1, 10)
+    record = sliding.refresh(record, 'group', '1', window + 1)
+    assert sliding.used(record, limit, window + 1) > 9
+    assert sliding.wait(record, limit, window + 1) > 0
+
+
+def test_sliding_window_wait_while_the_previous_window_fades_out():
+    limit = {'rate': 10}
+    sliding = SlidingWindow()
+    window = int(NOW // HOUR) * HOUR
+    record = sliding.refresh(fill(sliding, limit, window - 1, 10), 'group', '1', window + 1)
+    wait = sliding.wait(record, limit, window + 1)
+    # 10 * (1 - elapsed / HOUR) drops to 9 after a tenth of the hour
+    assert wait == pytest.approx(HOUR / 10)
+    later = window + 1 + wait
+    assert sliding.wait(sliding.refresh(record, 'group', '1', later), limit, later) == 0
+    assert sliding.wait(record, limit, later - 2) > 0
+
+
+def test_sliding_window_wait_rolls_over_into_the_next_window():
+    limit = {'rate': 10}
+    sliding = SlidingWindow()
+    window = int(NOW // HOUR) * HOUR
+    now = window + HOUR / 2
+    record = fill(sliding, limit, now, 10)
+    wait = sliding.wait(record, limit, now)
+    # The rest of this window, then a tenth of the next one for the count to fade out to 9
+    assert wait == pytest.approx(HOUR / 2 + HOUR / 10 + 1)
+    later = now + wait
+    assert sliding.wait(sliding.refresh(record, 'group', '1', later), limit, later) == 0
+    earlier = later - 2
+    assert sliding.wait(sliding.refresh(record, 'group', '1', earlier), limit, earlier) > 0
+
+
+def test_fixed_window_waits_until_the_hour():
+    limit = {'rate': 3}
+    fixed = FixedWindow()
+    now = HOUR_START + 20 * 60
+    record = fill(fixed, limit, now, 3)
+    assert fixed.wait(record, limit, now) == 40 * 60
+    assert fixed.wait(fixed.refresh(record, 'group', '1', HOUR_START + HOUR), limit, HOUR_START + HOUR) == 0
+
+
+def test_token_bucket_wait_for_the_next_token():
+    limit = {'rate': 10, 'burst': 5}
+    bucket = TokenBucket()
+    record = fill(bucket, limit, NOW, 5)
+    # A token every 6 minutes
+    assert bucket.wait(record, limit, NOW) == pytest.approx(HOUR / 10)
+    assert bucket.wait(record, limit, NOW + HOUR / 10) == 0
+    assert bucket.wait(record, limit, NOW, 3) == pytest.approx(3 * HOUR / 10)
+
+
+def test_token_bucket_refill_is_capped_at_the_burst():
+    limit = {'rate': 10, 'burst': 5}
+    bucket = TokenBucket()
+    record = fill(bucket, limit, NOW, 5)
+    assert bucket.tokens(record, limit, NOW + 10 * HOUR) == 5
+    assert bucket.used(record, limit, NOW + 10 * HOUR) == 0
+    # Idle for a day, still only the burst goes through at once
+    record = fill(bucket, limit, NOW + 24 * HOUR, 5, record)
+    assert bucket.wait(record, limit, NOW + 24 * HOUR) > 0
+    # Giving back more than was taken does not overfill it either
+    record = bucket.consume(record, limit, NOW + 24 * HOUR, -100)
+    assert bucket.tokens(record, limit, NOW + 24 * HOUR) == 5
+
+
+def memory_manager() -> RateLimitManager:
+    manager = RateLimitManager(backend="memory")
+    manager.update_quota("tokens", "group", "1", 1000, algorithm="fixed")
+    return manager
+
+
+def tokens_used(manager: RateLimitManager) -> float:
+    return manager.get_quota_usage("tokens", "group", "1")['count']
+
+
+def test_settle_gives_back_what_was_not_used():
+    manager = memory_manager()
+    assert manager.reserve("tokens", "group-1", 300) == 0
+    assert tokens_used(manager) == 300
+    manager.settle("tokens", "group-1", 300, 120)
+    assert tokens_used(manager) == 120
+
+
+def test_settle_charges_what_was_used_above_the_estimate():
+    manager = memory_manager()
+    assert manager.reserve("tokens", "group-1", 300) == 0
+    manager.settle("tokens", "group-1", 300, 450)
+    assert tokens_used(manager) == 450
+
+
+def test_request_the_upstream_did_not_accept_costs_nothing():
+    manager = memory_manager()
+    manager.consume_quota("tokens", "group", "1", 200)
+    assert manager.reserve("tokens", "group-1", 300) == 0
+    # Shed by the concurrency limiter, the adapter reported 0 tokens
+    manager.settle("tokens", "group-1", 300, 0)
+    assert tokens_used(manager) == 200
+
+
+def test_reservation_that_does_not_fit_is_refused_whole():
+    manager = memory_manager()
+    assert manager.reserve("tokens", "group-1", 800) == 0
+    assert manager.reserve("tokens", "group-1", 300) > 0
+    assert tokens_used(manager) == 800
+
+
+def test_no_usage_is_recorded_without_a_limit():
+    manager = RateLimitManager(backend="memory")
+    assert manager.reserve("tokens", "group-2", 300) == 0
+    manager.settle("tokens", "group-2", 300, 250)
+    _, usage_db = manager.quotas["tokens"]
+    assert usage_db.all() == []
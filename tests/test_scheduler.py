@@ -0,0 +1,60 @@
+import asyncio
+
+from config import FairQueue
+from manager.scheduler import FairScheduler
+
+
+def test_cancelled_waiter_is_not_charged():
+    async def main():
+        scheduler = FairScheduler(FairQueue(enabled=True, max_concurrent=1))
+        entered = asyncio.Event()
+        leave = asyncio.Event()
+
+        async def request(session_id: str, hold: bool = False):
+            async with scheduler.slot(session_id):
+                if hold:
+                    entered.set()
+                    await leave.wait()
+
+        running = asyncio.create_task(request("group-1", hold=True))
+        await entered.wait()
+        # Superseded while it waits behind the running request
+        waiting = asyncio.create_task(request("group-2"))
+        await asyncio.sleep(0)
+        assert "group-2" in scheduler.finish_tags
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        assert "group-2" not in scheduler.finish_tags
+
+        leave.set()
+        await running
+        assert scheduler.running == 0 and "group-2" not in scheduler.finish_tags
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_gives_back_the_tag_of_the_request_before():
+    async def main():
+        scheduler = FairScheduler(FairQueue(enabled=True, max_concurrent=1))
+        leave = asyncio.Event()
+
+        async def request(session_id: str):
+            async with scheduler.slot(session_id):
+                await leave.wait()
+
+        first = asyncio.create_task(request("group-1"))
+        second = asyncio.create_task(request("group-1"))
+        await asyncio.sleep(0)
+        before = scheduler.finish_tags["group-1"]
+        third = asyncio.create_task(request("group-1"))
+        await asyncio.sleep(0)
+        assert scheduler.finish_tags["group-1"] > before
+        third.cancel()
+        await asyncio.gather(third, return_exceptions=True)
+        assert scheduler.finish_tags["group-1"] == before
+
+        leave.set()
+        await asyncio.gather(first, second)
+        assert scheduler.running == 0 and not scheduler.waiting
+
+    asyncio.run(main())
@@ -0,0 +1,34 @@
+import asyncio
+import random
+
+from renderer.splitter import MultipleSegmentSplitter
+from tests.splitter_reference import ReferenceSplitter, random_reply, snapshots
+
+
+async def segments(splitter, stream):
+    result = [await splitter.render(snapshot) for snapshot in stream]
+    return result, await splitter.result()
+
+
+def test_same_segments_as_the_reference():
+    rng = random.Random(0)
+
+    async def main():
+        for _ in range(3000):
+            stream = snapshots(random_reply(rng), rng) or ['']
+            splitter, reference = MultipleSegmentSplitter(), ReferenceSplitter()
+            result, rest = await segments(splitter, stream)
+            assert result == (await segments(reference, stream))[0]
+            # The reference also repeated the segment it sent last, only what was not sent is left now
+            assert rest == stream[-1].removeprefix(reference.last_commit)
+
+    asyncio.run(main())
+
+
+def test_examples():
+    async def main():
+        stream = ["Hello", "Hello\n", "Hello\n```py\nprint(1)", "Hello\n```py\nprint(1)\n```", "Hello\n```py\nprint(1)\n```\n* a\n* b\nEnd"]
+        assert (await segments(MultipleSegmentSplitter(), stream)) == (
+            [None, "Hello", None, "```py\nprint(1)\n```", "* a\n* b"], "End")
+
+    asyncio.run(main())
@@ -0,0 +1,19 @@
+import random
+
+from tests.wrapper_reference import ReferenceTextWrapper, random_text
+from utils.text_to_img import TextWrapper
+
+
+def test_same_lines_as_the_reference():
+    rng = random.Random(0)
+    for _ in range(3000):
+        text = random_text(rng)
+        width = rng.choice([1, 2, 3, 10, 37, 80])
+        break_long_words = rng.random() < 0.8
+        wrapped = TextWrapper(width=width, break_long_words=break_long_words).wrap(text)
+        assert wrapped == ReferenceTextWrapper(width=width, break_long_words=break_long_words).wrap(text), text
+
+
+def test_wide_characters_count_twice():
+    assert TextWrapper(width=6).wrap("中文字符 ab") == ["中文字", "符 ab"]
+    assert TextWrapper(width=4).wrap("ｆｕｌｌ") == ["ｆｕ", "ｌｌ"]
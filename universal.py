@@ -17,9 +17,11 @@ from constants import config
 from conversation import ConversationHandler, ConversationContext
 from exceptions import PresetNotFoundException, BotRatelimitException, ConcurrentMessageException, \
     BotTypeNotFoundException, NoAvailableBotException, BotOperationNotSupportedException, CommandRefusedException, \
-    DrawingFailedException
+    DrawingFailedException, UpstreamOverloadedException
 
+from manager.ratelimit import rateLimitManager
 from middlewares.concurrentlock import MiddlewareConcurrentLock
+from middlewares.middleware import sender
 from middlewares.ratelimit import MiddlewareRatelimit
 from middlewares.timeout import MiddlewareTimeout
 
@@ -43,7 +45,7 @@ async def get_ping_response(conversation_context: ConversationContext):
 
 async def handle_message(_respond: Callable, session_id: str, message: str,
                          chain: MessageChain = MessageChain("Unsupported"), is_manager: bool = False,
-                         nickname: str = 'Someone', request_from=None):
+                         nickname: str = 'Someone', request_from=None, user_id: str = ''):
     conversation_context = None
 
     def wrap_request(n, m):
@@ -90,16 +92,29 @@ async def handle_message(_respond: Callable, session_id: str, message: str,
                 voice_type = VoiceType.Mp3
             else:
                 voice_type = VoiceType.Wav
-            tasks = []
+            # TTS is metered in characters, reserved before synthesis and settled with what was synthesized
+            reserved = sum(len(elem.text) for elem in msg if isinstance(elem, Plain))
+            wait = rateLimitManager.reserve("tts", session_id, reserved) if reserved else 0
+            if wait != 0:
+                logger.debug(f"[TTS] {session_id} exceeded the TTS quota, the reply is sent without voice")
+                return ret
+            tasks = {}
             for elem in msg:
                 task = asyncio.create_task(get_tts_voice(elem, conversation_context, voice_type))
-                tasks.append(task)
-            while tasks:
-                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
-                for voice_task in done:
-                    voice = await voice_task
-                    if voice:
-                        await _respond(voice)
+                tasks[task] = len(elem.text) if isinstance(elem, Plain) else 0
+            synthesized = 0
+            try:
+                pending = set(tasks)
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for voice_task in done:
+                        voice = await voice_task
+                        if voice:
+                            synthesized += tasks[voice_task]
+                            await _respond(voice)
+            finally:
+                if reserved:
+                    rateLimitManager.settle("tts", session_id, reserved, synthesized)
 
         return ret
 
@@ -138,6 +153,18 @@ async def handle_message(_respond: Callable, session_id: str, message: str,
             await respond(await get_ping_response(conversation_context))
             return
 
+        elif prompt in config.trigger.supersede_command:
+            # The mode applies to everyone in the chat
+            if not (config.trigger.allow_switching_supersede or is_manager or session_id.startswith('friend-')):
+                await respond("Sorry, only administrators can switch the latest-wins mode of a group!")
+                return
+            conversation_handler.supersede = not conversation_handler.supersede
+            if conversation_handler.supersede:
+                await respond("Latest-wins mode is on, a new message will cancel your unfinished one.")
+            else:
+                await respond("Latest-wins mode is off, your messages will be answered one by one.")
+            return
+
         elif voice_type_search := re.search(config.trigger.switch_voice, prompt):
             if not config.azure.tts_speech_key and config.text_to_speech.engine == "azure":
                 await respond("The Azure TTS account is not configured and voice switching cannot be performed!")
@@ -223,8 +250,17 @@ async def handle_message(_respond: Callable, session_id: str, message: str,
                 logger.debug(f"re {r}")
                 return
 
+        sender.set(user_id or nickname)
         # 
-        conversation_handler = await ConversationHandler.get_handler(session_id)
+        conversation_handler = await ConversationHandler.get_handler(session_id, request_from)
+
+        # Stop does not wait in line behind the reply it stops
+        if message.strip() in config.trigger.stop_command:
+            # Only the reply being generated is stopped, the messages queued behind it are answered as usual
+            stopping = [context for context in conversation_handler.conversations.values() if context.stop()]
+            if not stopping:
+                await respond(config.response.stop_nothing)
+            return
         # 
         if ' ' in message and (config.trigger.allow_switching_ai or is_manager):
             for ai_type, prefixes in config.trigger.prefix_ai.items():
@@ -257,6 +293,8 @@ async def handle_message(_respond: Callable, session_id: str, message: str,
         await _respond(f"InvalidRequestError {str(e)}")
     except BotOperationNotSupportedException:
         await _respond("BotOperationNotSupportedException")
+    except UpstreamOverloadedException:  # Shed by the adaptive concurrency limit
+        await _respond(config.response.queue_full)
     except ConcurrentMessageException as e:  # Chatbot 
         await _respond(config.response.error_request_concurrent_error)
     except BotRatelimitException as e:  # Chatbot
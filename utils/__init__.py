@@ -1,19 +1,123 @@
 import asyncio
+import itertools
+import time
+from collections import OrderedDict
+from typing import List, Optional
 
 from .retry import retry
 
-class QueueInfo:
-    lock: asyncio.Lock
-    size: int
+
+def split_message(text: str, limit: int) -> List[str]:
+    """Cut a text into messages of at most limit characters, at line breaks when there are some"""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind('\n', 0, limit + 1)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip('\n')
+    if text:
+        parts.append(text)
+    return parts
+
+
+def image_mime(data: bytes) -> str:
+    """MIME type of encoded image data, told by its first bytes"""
+    if data.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data.startswith(b'GIF8'):
+        return 'image/gif'
+    return 'image/png'
+
+
+class QueueStats:
+    """Waiting time of the requests that went through the queues"""
 
     def __init__(self):
-        self.lock = asyncio.Lock()
-        self.size = 0
+        self.served = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, waited: float):
+        self.served = self.served + 1
+        self.wait_total = self.wait_total + waited
+        self.wait_max = max(self.wait_max, waited)
+
+    def snapshot(self):
+        return {
+            "served": self.served,
+            "rejected": self.rejected,
+            "wait_avg": self.wait_total / self.served if self.served else 0.0,
+            "wait_max": self.wait_max,
+        }
+
+
+class QueueTicket:
+    """Place of a request in a RequestQueue, leaving the `async with` block gives the place up"""
 
-    async def __aenter__(self) -> None:
-        self.size = self.size + 1
-        return await self.lock.__aenter__()
+    def __init__(self, queue: "RequestQueue", ticket_id: int, position: int, future: asyncio.Future):
+        self.queue = queue
+        self.id = ticket_id
+        self.position = position
+        """Number of requests ahead when joining"""
+        self.future = future
+        self.joined_at = time.monotonic()
+
+    async def turn(self):
+        """Wait until every request ahead is done"""
+        await self.future
+
+    async def __aenter__(self) -> "QueueTicket":
+        return self
 
     async def __aexit__(self, exc_type: type[BaseException], exc: BaseException, tb) -> None:
-        self.size = self.size - 1
-        return await self.lock.__aexit__(exc_type, exc, tb)
\ No newline at end of file
+        self.queue.leave(self)
+
+
+class RequestQueue:
+    """FIFO in which the requests of a session wait for their turn, one request runs at a time"""
+
+    def __init__(self, max_size: int = 0, stats: Optional[QueueStats] = None):
+        self.max_size = max_size
+        """Maximum number of requests ahead of a new one, 0 means no limit"""
+        self.stats = stats or QueueStats()
+        self.waiters: OrderedDict[int, QueueTicket] = OrderedDict()
+        self.running: Optional[QueueTicket] = None
+        self.ids = itertools.count()
+
+    @property
+    def size(self) -> int:
+        return len(self.waiters) + (self.running is not None)
+
+    def join(self) -> Optional[QueueTicket]:
+        """Take a place at the end of the queue, returns None when the queue is full"""
+        position = self.size
+        if 0 < self.max_size < position:
+            self.stats.rejected = self.stats.rejected + 1
+            return None
+        ticket = QueueTicket(self, next(self.ids), position, asyncio.get_running_loop().create_future())
+        self.waiters[ticket.id] = ticket
+        if self.running is None:
+            self.grant_next()
+        return ticket
+
+    def grant_next(self):
+        while self.waiters:
+            _, ticket = self.waiters.popitem(last=False)
+            if ticket.future.done():
+                continue
+            self.running = ticket
+            ticket.future.set_result(None)
+            self.stats.record(time.monotonic() - ticket.joined_at)
+            return
+        self.running = None
+
+    def leave(self, ticket: QueueTicket):
+        if self.running is ticket:
+            self.grant_next()
+        elif self.waiters.pop(ticket.id, None) is not None:
+            # Left before its turn, e.g. cancelled
+            ticket.future.cancel()
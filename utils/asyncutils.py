@@ -1,4 +1,8 @@
 import asyncio
+from collections import deque
+from typing import AsyncGenerator, AsyncIterator, Deque, Generic, Optional, TypeVar
+
+T = TypeVar("T")
 
 
 async def evaluate_array(array):
@@ -18,4 +22,80 @@ async def evaluate_array(array):
         # Replace the coroutines with their evaluated values in the original positions
         for i in range(len(positions)):
             array[positions[i]] = evaluated[i]
-    return array
\ No newline at end of file
+    return array
+
+class Relay(Generic[T]):
+    """
+    Iterates source in a producer task of its own, the items are handed over through a buffer.
+    The adapters yield the whole reply so far, so only the newest text waiting in the buffer is kept
+    and a slow consumer skips the ones in between, the other items are all handed over in order.
+    items() waits for the next item or for event, and yields None whenever event is set in between
+    (the event is cleared then). Cancelling the producer interrupts source wherever it waits and only ends
+    the iteration, the consumer is left alone.
+    """
+
+    def __init__(self, source: AsyncIterator[T], event: Optional[asyncio.Event] = None):
+        self.pending: Deque = deque()
+        self.ready = asyncio.Event()
+        """Set when pending has items"""
+        self.event = event
+        self.producer = asyncio.create_task(self.produce(source))
+
+    def push(self, item):
+        if isinstance(item, str) and self.pending and isinstance(self.pending[-1], str):
+            self.pending[-1] = item
+        else:
+            self.pending.append(item)
+        self.ready.set()
+
+    async def produce(self, source: AsyncIterator[T]):
+        try:
+            async for item in source:
+                self.push(item)
+        finally:
+            self.push(_END)
+
+    async def items(self) -> AsyncGenerator[Optional[T], None]:
+        getter: Optional[asyncio.Future] = None
+        waiter: Optional[asyncio.Future] = None
+        try:
+            while True:
+                if not self.pending:
+                    self.ready.clear()
+                    if self.event is None:
+                        await self.ready.wait()
+                        continue
+                    # The futures are kept until they are done, nothing is created for the items already there
+                    getter = getter or asyncio.ensure_future(self.ready.wait())
+                    waiter = waiter or asyncio.ensure_future(self.event.wait())
+                    await asyncio.wait((getter, waiter), return_when=asyncio.FIRST_COMPLETED)
+                    if waiter.done():
+                        waiter = None
+                        self.event.clear()
+                        yield None
+                    if getter.done():
+                        getter = None
+                    continue
+                item = self.pending.popleft()
+                if item is _END:
+                    if not self.producer.cancelled():
+                        # Raises what source raised
+                        self.producer.result()
+                    return
+                yield item
+        finally:
+            for future in (getter, waiter):
+                if future is not None:
+                    future.cancel()
+
+    async def aclose(self):
+        """Stop the producer and wait for source to finish its own clean-up"""
+        if not self.producer.done():
+            self.producer.cancel()
+        await asyncio.wait((self.producer,))
+        if not self.producer.cancelled():
+            # Raised to the consumer already, if it was still iterating
+            self.producer.exception()
+
+
+_END = object()
@@ -1,4 +1,9 @@
 import asyncio
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
 from loguru import logger
 from constants import config
 
@@ -23,34 +28,57 @@ except ImportError as e:
 try:
     import azure.cognitiveservices.speech as speechsdk
 
+    tts_pool = ThreadPoolExecutor(config.azure.tts_workers, thread_name_prefix="azure-tts")
+    """Threads the blocking synthesis runs in, so the event loop keeps serving the other chats"""
+
+    output_formats = {
+        "wav": speechsdk.SpeechSynthesisOutputFormat.Riff16Khz16BitMonoPcm,
+        "mp3": speechsdk.SpeechSynthesisOutputFormat.Audio16Khz32KBitRateMonoMp3,
+    }
+
+    idle_synthesizers: Dict[Tuple[str, str], List[speechsdk.SpeechSynthesizer]] = defaultdict(list)
+    """Synthesizers ready for the next text, by voice and audio format"""
+    synthesizers_lock = threading.Lock()
 
-    async def synthesize_speech(text: str, output_file: str,
-                                voice):
-        if not config.azure.tts_speech_key:
-            logger.warning("[Azure TTS] tts_speech_key is not detected, no speech conversion is performed.")
-            return False
-        loop = asyncio.get_event_loop()
-        future = loop.create_future()
 
-        def create_synthesizer():
-            speech_key, service_region = config.azure.tts_speech_key, config.azure.tts_speech_service_region
-            speech_config = speechsdk.SpeechConfig(subscription=speech_key, region=service_region)
-            # https://learn.microsoft.com/en-us/azure/cognitive-services/speech-service/language-support?tabs=tts#neural-voices
-            speech_config.set_property(speechsdk.PropertyId.SpeechServiceConnection_SynthVoice, voice.full_name)
-            audio_config = speechsdk.audio.AudioOutputConfig(filename=output_file)
-            return speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=audio_config)
+    def acquire_synthesizer(voice_name: str, audio_format: str) -> speechsdk.SpeechSynthesizer:
+        with synthesizers_lock:
+            if idle := idle_synthesizers[(voice_name, audio_format)]:
+                return idle.pop()
+        speech_key, service_region = config.azure.tts_speech_key, config.azure.tts_speech_service_region
+        speech_config = speechsdk.SpeechConfig(subscription=speech_key, region=service_region)
+        # https://learn.microsoft.com/en-us/azure/cognitive-services/speech-service/language-support?tabs=tts#neural-voices
+        speech_config.set_property(speechsdk.PropertyId.SpeechServiceConnection_SynthVoice, voice_name)
+        speech_config.set_speech_synthesis_output_format(output_formats[audio_format])
+        # Without audio output the audio stays in the result
+        return speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=None)
 
-        # result = await asyncio.get_event_loop().run_in_executor(None, synthesizer.speak_text_async(text).get)
-        # result = synthesizer.speak_text_async(text).get()
-        synthesizer = await loop.run_in_executor(None, create_synthesizer)
-        loop.call_soon_threadsafe(run_synthesize_speech, synthesizer, text, future)
 
-        return await future
+    def release_synthesizer(voice_name: str, audio_format: str, synthesizer: speechsdk.SpeechSynthesizer):
+        with synthesizers_lock:
+            if len(idle := idle_synthesizers[(voice_name, audio_format)]) < config.azure.tts_workers:
+                idle.append(synthesizer)
 
 
-    def run_synthesize_speech(synthesizer, text, future):
+    def run_synthesize_speech(text: str, voice_name: str, audio_format: str) -> Optional[bytes]:
+        synthesizer = acquire_synthesizer(voice_name, audio_format)
         result = synthesizer.speak_text_async(text).get()
-        future.set_result(result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted)
+        if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
+            release_synthesizer(voice_name, audio_format, synthesizer)
+            return result.audio_data
+        # A synthesizer which failed is not reused
+        details = result.cancellation_details
+        logger.warning(f"[Azure TTS] Synthesis failed: {result.reason} {details.reason} {details.error_details}")
+        return None
+
+
+    async def synthesize_speech(text: str, voice, audio_format: str = "wav") -> Optional[bytes]:
+        """Synthesize text with the voice, returns the audio in the format, wav or mp3"""
+        if not config.azure.tts_speech_key:
+            logger.warning("[Azure TTS] tts_speech_key is not detected, no speech conversion is performed.")
+            return None
+        return await asyncio.get_running_loop().run_in_executor(tts_pool, run_synthesize_speech,
+                                                                text, voice.full_name, audio_format)
 
 except FileNotFoundError as e:
     async def synthesize_speech(a=None, b=None, c=None):
@@ -0,0 +1,151 @@
+import asyncio
+import heapq
+import itertools
+from typing import Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+
+class _Deadline:
+    __slots__ = ("key", "when", "queued_at", "callback", "cancelled")
+
+    def __init__(self, key: Hashable, when: float, callback: Callable[[], None]):
+        self.key = key
+        self.when = when
+        self.queued_at = when
+        """Time of the entry of this deadline in the heap"""
+        self.callback = callback
+        self.cancelled = False
+
+
+class DeadlineScheduler:
+    """
+    Runs callbacks at deadlines with a single timer for the whole event loop.
+    Pushing a deadline back only updates its entry, the heap is fixed lazily when the timer fires,
+    so re-arming after every streamed chunk costs O(1).
+    """
+
+    def __init__(self):
+        self.deadlines: Dict[Hashable, _Deadline] = {}
+        self.heap: List[Tuple[float, int, _Deadline]] = []
+        self.seq = itertools.count()
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.timer_at: Optional[float] = None
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def arm(self, key: Hashable, delay: float, callback: Callable[[], None]):
+        """Run callback after delay seconds, replacing the previous deadline of key"""
+        self.cancel(key)
+        loop = asyncio.get_running_loop()
+        deadline = _Deadline(key, loop.time() + delay, callback)
+        self.deadlines[key] = deadline
+        self._push(deadline)
+        self._schedule(loop)
+
+    def rearm(self, key: Hashable, delay: float) -> bool:
+        """Move the deadline of key to delay seconds from now, returns False if there is none"""
+        deadline = self.deadlines.get(key)
+        if deadline is None:
+            return False
+        loop = asyncio.get_running_loop()
+        deadline.when = loop.time() + delay
+        if deadline.when < deadline.queued_at:
+            # Moved forward, it needs a new place in the heap
+            self._push(deadline)
+            self._schedule(loop)
+        return True
+
+    def cancel(self, key: Hashable):
+        if deadline := self.deadlines.pop(key, None):
+            deadline.cancelled = True
+            # Drop the stale entries once they are the majority of the heap
+            if len(self.heap) > 64 and len(self.heap) > 2 * len(self.deadlines):
+                self.heap = [item for item in self.heap if not item[2].cancelled]
+                heapq.heapify(self.heap)
+
+    def _push(self, deadline: _Deadline):
+        deadline.queued_at = deadline.when
+        heapq.heappush(self.heap, (deadline.when, next(self.seq), deadline))
+
+    def _schedule(self, loop: asyncio.AbstractEventLoop):
+        while self.heap and self.heap[0][2].cancelled:
+            heapq.heappop(self.heap)
+        if not self.heap:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = self.timer_at = None
+            return
+        head = self.heap[0][0]
+        if self.timer is not None and self.timer_at <= head:
+            return
+        if self.timer:
+            self.timer.cancel()
+        self.timer_at = head
+        self.timer = loop.call_at(head, self._fire, loop)
+
+    def _fire(self, loop: asyncio.AbstractEventLoop):
+        self.timer = self.timer_at = None
+        now = loop.time()
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            queued_at, _, deadline = heapq.heappop(self.heap)
+            if deadline.cancelled or deadline.queued_at != queued_at:
+                continue
+            if deadline.when > now:
+                # Pushed back since it was queued
+                self._push(deadline)
+                continue
+            deadline.cancelled = True
+            del self.deadlines[deadline.key]
+            due.append(deadline)
+        self._schedule(loop)
+        for deadline in due:
+            deadline.callback()
+
+
+class RequestDeadlines:
+    """
+    Reminder and hard timeout of the requests being handled, keyed by the task running each request.
+    Requests of the same chat, queued or superseded, never touch each other's deadlines.
+    """
+
+    def __init__(self, scheduler: DeadlineScheduler):
+        self.scheduler = scheduler
+        self.reminders: Dict[asyncio.Task, Tuple[float, Callable[[], None]]] = {}
+        """Silence before the reminder of each request, and how to send it"""
+        self.expired: Set[asyncio.Task] = set()
+        """Requests cancelled because they ran out of time"""
+
+    def __len__(self):
+        return len(self.reminders)
+
+    def start(self, task: asyncio.Task, timeout: float, max_timeout: float, remind: Callable[[], None]):
+        self.reminders[task] = (timeout, remind)
+        self.scheduler.arm((task, "reminder"), timeout, remind)
+        self.scheduler.arm((task, "timeout"), max_timeout, lambda: self.expire(task))
+
+    def expire(self, task: asyncio.Task):
+        if not task.done():
+            self.expired.add(task)
+            task.cancel()
+
+    def touch(self, task: Optional[asyncio.Task] = None) -> bool:
+        """Something was sent, the reminder waits again from now, returns False if it was sent already"""
+        task = task or asyncio.current_task()
+        if task not in self.reminders:
+            return True
+        return self.scheduler.rearm((task, "reminder"), self.reminders[task][0])
+
+    def responded(self, task: Optional[asyncio.Task] = None):
+        """Like touch, and waits for the next silence when the reminder was sent already"""
+        task = task or asyncio.current_task()
+        if not self.touch(task):
+            timeout, remind = self.reminders[task]
+            self.scheduler.arm((task, "reminder"), timeout, remind)
+
+    def finish(self, task: asyncio.Task):
+        """Drop the deadlines of a request that ended"""
+        self.scheduler.cancel((task, "reminder"))
+        self.scheduler.cancel((task, "timeout"))
+        self.reminders.pop(task, None)
+        self.expired.discard(task)
@@ -0,0 +1,32 @@
+from typing import Callable
+
+# Blocks of the Basic Multilingual Plane the browser draws as color emoji
+_EMOJI_RANGES = (
+    (0x231A, 0x231B), (0x23E9, 0x23FA), (0x24C2, 0x24C2), (0x25AA, 0x25FE),
+    (0x2600, 0x27BF), (0x2934, 0x2935), (0x2B05, 0x2B55), (0x3030, 0x3030),
+    (0x303D, 0x303D), (0x3297, 0x3299),
+)
+_EMOJI_MARKS = {
+    '\u200d',  # Zero width joiner of emoji sequences
+    '\u20e3',  # Keycap
+    '\ufe0e', '\ufe0f',  # Text and emoji presentation selectors
+}
+
+
+def needs_browser(char: str) -> bool:
+    """Whether a character is drawn by the browser's fallback fonts whatever the font of the page has"""
+    code = ord(char)
+    # Emoji, most of them outside the BMP, and the historic scripts and rare CJK up there
+    if code > 0xFFFF or char in _EMOJI_MARKS:
+        return True
+    return any(start <= code <= end for start, end in _EMOJI_RANGES)
+
+
+def font_covers(text: str, has_glyph: Callable[[str], bool]) -> bool:
+    """Whether a single font draws all of the text the way the browser would"""
+    for char in set(text):
+        if char.isspace():
+            continue
+        if needs_browser(char) or not has_glyph(char):
+            return False
+    return True
@@ -0,0 +1,155 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from loguru import logger
+
+from utils import metrics
+
+
+class ImageCache:
+    """
+    LRU cache of encoded images, keyed by a hash of everything that decides how they look.
+    The memory tier is bounded by the total size of the images, the optional disk tier
+    keeps one file per image in a folder and evicts the least recently used files the same way.
+    """
+
+    def __init__(self, max_memory: int, path: Optional[str] = None, max_disk: int = 0, ttl: float = 0):
+        self.max_memory = max_memory
+        """Total size in bytes of the images kept in memory, 0 disables the cache"""
+        self.path = path
+        self.max_disk = max_disk
+        self.ttl = ttl
+        """Seconds an image stays valid, 0 means forever"""
+        self.memory: OrderedDict[str, Tuple[float, bytes]] = OrderedDict()
+        self.memory_size = 0
+        self.disk: OrderedDict[str, int] = OrderedDict()
+        """Size of the files of the disk tier, least recently used first"""
+        self.disk_size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if path:
+            self.scan()
+        metrics.register("image_cache", self.snapshot)
+
+    @staticmethod
+    def key(*parts) -> str:
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(str(part).encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def expired(self, created: float) -> bool:
+        return self.ttl > 0 and time.time() - created > self.ttl
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Look the image up in memory"""
+        entry = self.memory.get(key)
+        if entry is None:
+            return None
+        created, data = entry
+        if self.expired(created):
+            self._forget(key)
+            return None
+        self.memory.move_to_end(key)
+        self.hits = self.hits + 1
+        return data
+
+    def put(self, key: str, data: bytes, created: Optional[float] = None):
+        if len(data) > self.max_memory:
+            return
+        if key in self.memory:
+            self._forget(key)
+        self.memory[key] = (created or time.time(), data)
+        self.memory_size = self.memory_size + len(data)
+        while self.memory_size > self.max_memory:
+            self._forget(next(iter(self.memory)))
+
+    def _forget(self, key: str):
+        _, data = self.memory.pop(key)
+        self.memory_size = self.memory_size - len(data)
+
+    def file(self, key: str) -> str:
+        return os.path.join(self.path, key)
+
+    def scan(self):
+        """Index the files left in the disk tier by a previous run, oldest first"""
+        os.makedirs(self.path, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, key, size in sorted(entries):
+            self.disk[key] = size
+            self.disk_size = self.disk_size + size
+        self._evict()
+
+    def load(self, key: str) -> Optional[Tuple[float, bytes]]:
+        """Look the image up on disk, blocking, returns its creation time and its bytes"""
+        if not self.path:
+            return None
+        with self.lock:
+            if key not in self.disk:
+                return None
+            self.disk.move_to_end(key)
+        try:
+            created = os.path.getmtime(self.file(key))
+            if self.expired(created):
+                self._remove(key)
+                return None
+            with open(self.file(key), 'rb') as f:
+                data = f.read()
+        except OSError:
+            self._remove(key)
+            return None
+        self.disk_hits = self.disk_hits + 1
+        return created, data
+
+    def store(self, key: str, data: bytes):
+        """Write the image to the disk tier, blocking"""
+        if not self.path or len(data) > self.max_disk:
+            return
+        temp = self.file(key) + '.tmp'
+        try:
+            with open(temp, 'wb') as f:
+                f.write(data)
+            os.replace(temp, self.file(key))
+        except OSError as e:
+            logger.warning(f"[ImageCache] Failed to write the image to disk: {e}")
+            return
+        with self.lock:
+            self.disk_size = self.disk_size - self.disk.pop(key, 0) + len(data)
+            self.disk[key] = len(data)
+        self._evict()
+
+    def _remove(self, key: str):
+        with self.lock:
+            self.disk_size = self.disk_size - self.disk.pop(key, 0)
+        try:
+            os.remove(self.file(key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        while True:
+            with self.lock:
+                if self.disk_size <= self.max_disk or not self.disk:
+                    return
+                key = next(iter(self.disk))
+            self._remove(key)
+
+    def snapshot(self):
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "memory_bytes": self.memory_size,
+            "disk_bytes": self.disk_size,
+        }
@@ -0,0 +1,14 @@
+from typing import Any, Callable, Dict
+
+collectors: Dict[str, Callable[[], Dict[str, Any]]] = {}
+"""Metric sources, exported by the HTTP service for dashboards"""
+
+
+def register(name: str, collector: Callable[[], Dict[str, Any]]):
+    """Register a callable that returns a snapshot of the metrics of a component"""
+    collectors[name] = collector
+
+
+def collect() -> Dict[str, Any]:
+    """Take a snapshot of all registered metrics"""
+    return {name: collector() for name, collector in collectors.items()}
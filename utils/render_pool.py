@@ -0,0 +1,135 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, List, Optional
+
+from loguru import logger
+
+from utils import metrics
+
+
+class RendererPool:
+    """
+    Long-lived worker processes for the rendering work.
+    Workers are forked by a forkserver which has the preload modules imported already, so they start with
+    the assets loaded and never inherit the threads and locks of the bot. The pool is replaced by a fresh one
+    after max_tasks jobs and restarted when a worker dies or stops answering.
+    At most size jobs are handed to the workers at a time, the others wait their turn here,
+    so the timeout only counts the time a job runs.
+    """
+
+    def __init__(self, size: int, max_tasks: int = 0, timeout: float = 30.0, health_check_interval: float = 60.0,
+                 initializer: Optional[Callable[[], None]] = None, preload: Optional[List[str]] = None):
+        self.size = size
+        """Number of worker processes, 0 runs the jobs in the default executor"""
+        self.max_tasks = max_tasks
+        """Jobs after which the workers are replaced by fresh ones, 0 means never"""
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.initializer = initializer
+        self.preload = preload or []
+        """Modules the forkserver imports before forking the workers"""
+        self.slots = asyncio.Semaphore(max(size, 1))
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.executor_jobs = 0
+        self.watcher: Optional[asyncio.Task] = None
+        self.jobs = 0
+        self.failures = 0
+        self.restarts = 0
+        metrics.register("renderer_pool", self.snapshot)
+
+    def start(self) -> Optional[ProcessPoolExecutor]:
+        if "forkserver" not in multiprocessing.get_all_start_methods():
+            logger.warning("[Renderer] Renderer processes need forkserver, rendering in threads")
+            self.size = 0
+            return None
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(self.preload)
+        self.executor = ProcessPoolExecutor(self.size, mp_context=context, initializer=self.initializer)
+        self.executor_jobs = 0
+        logger.debug(f"[Renderer] Started {self.size} renderer workers")
+        return self.executor
+
+    def retire(self):
+        """Replace the workers by fresh ones, the jobs they are running still finish"""
+        executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def restart(self):
+        """Kill the workers, the next job starts a new pool"""
+        executor, self.executor = self.executor, None
+        if executor is None:
+            return
+        self.restarts = self.restarts + 1
+        # A hung worker would block shutdown forever
+        for process in list((executor._processes or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        """Run fn(*args) in a worker, fn and its arguments must be picklable"""
+        loop = asyncio.get_running_loop()
+        if self.size > 0 and self.executor is None:
+            self.start()
+        if self.executor is None:
+            return await loop.run_in_executor(None, fn, *args)
+        async with self.slots:
+            return await self.submit(loop, fn, *args)
+
+    async def submit(self, loop: asyncio.AbstractEventLoop, fn: Callable[..., Any], *args) -> Any:
+        if self.executor is None:
+            self.start()
+        executor = self.executor
+        if self.health_check_interval > 0 and (self.watcher is None or self.watcher.done()):
+            self.watcher = asyncio.create_task(self.watch())
+        self.jobs = self.jobs + 1
+        self.executor_jobs = self.executor_jobs + 1
+        future = loop.run_in_executor(executor, fn, *args)
+        if 0 < self.max_tasks <= self.executor_jobs:
+            self.retire()
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except (BrokenProcessPool, asyncio.TimeoutError):
+            self.failures = self.failures + 1
+            logger.warning("[Renderer] A renderer worker died or hung, restarting the pool")
+            if self.executor is executor:
+                self.restart()
+            raise
+
+    async def health_check(self) -> bool:
+        """Ping the workers, restarts the pool if they do not answer"""
+        if self.executor is None:
+            return True
+        # Waits for a free worker like a job, so a busy pool is not taken for a hung one
+        async with self.slots:
+            executor = self.executor
+            if executor is None:
+                return True
+            return await self.ping(executor)
+
+    async def ping(self, executor: ProcessPoolExecutor) -> bool:
+        try:
+            await asyncio.wait_for(asyncio.get_running_loop().run_in_executor(executor, os.getpid), self.timeout)
+            return True
+        except (BrokenProcessPool, asyncio.TimeoutError):
+            logger.warning("[Renderer] Renderer workers failed the health check, restarting the pool")
+            if self.executor is executor:
+                self.restart()
+            return False
+
+    async def watch(self):
+        while self.executor is not None:
+            await asyncio.sleep(self.health_check_interval)
+            await self.health_check()
+
+    def snapshot(self):
+        return {
+            "size": self.size,
+            "running": self.executor is not None,
+            "jobs": self.jobs,
+            "failures": self.failures,
+            "restarts": self.restarts,
+        }
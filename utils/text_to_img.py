@@ -1,18 +1,23 @@
 import base64
+import functools
+import hashlib
 import itertools
+import math
 import os
 import pathlib
 import shutil
+import subprocess
 import textwrap
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from io import StringIO
-from tempfile import NamedTemporaryFile
-from typing import Optional
+from typing import Deque, Dict, List, Optional, Tuple
 
 import aiohttp
 import unicodedata
 import asyncio
-import imgkit
 from pydantic import BaseModel
 from pydantic.dataclasses import dataclass
 
@@ -26,13 +31,17 @@ from PIL import ImageDraw, ImageFont
 from charset_normalizer import from_bytes
 from graia.ariadne.message.element import Image as GraiaImage
 from loguru import logger
-from markdown.extensions.codehilite import CodeHiliteExtension
+from markdown.extensions import codehilite, fenced_code
+from markdown.extensions.codehilite import CodeHilite, CodeHiliteExtension
 from markdown.extensions.tables import TableExtension
 from mdx_math import MathExtension
 from pygments.formatters import HtmlFormatter
 from pygments.styles.xcode import XcodeStyle
 
-from config import Config
+from config import Config, ImageOutput
+from utils.glyphs import font_covers
+from utils.image_cache import ImageCache
+from utils.render_pool import RendererPool
 
 patch()
 
@@ -66,13 +75,18 @@ class TextWrapper(textwrap.TextWrapper):
         'N': 1  # Neutral
     }
 
-    def _strlen(self, text):
+    def _strlen(self, text, limit=None):
         """
-        Calcaute display length of a line
+        Calcaute display length of a line, counting stops once it is over limit
         """
-        return sum(
-            self.char_widths[unicodedata.east_asian_width(char)] for char in text
-        )
+        if text.isascii():
+            return len(text)
+        length = 0
+        for char in text:
+            length += display_width(char)
+            if limit is not None and length > limit:
+                break
+        return length
 
     def _wrap_chunks(self, chunks):
         """_wrap_chunks(chunks : [string]) -> [string]
@@ -117,7 +131,7 @@ class TextWrapper(textwrap.TextWrapper):
                 del chunks[-1]
 
             while chunks:
-                l = self._strlen(chunks[-1])
+                l = self._strlen(chunks[-1], width - cur_len)
 
                 if cur_len + l > width:
                     break
@@ -127,7 +141,7 @@ class TextWrapper(textwrap.TextWrapper):
 
             # The current line is full, and the next chunk is too big to
             # fit on *any* line (not just this one).
-            if chunks and self._strlen(chunks[-1]) > width:
+            if chunks and self._strlen(chunks[-1], width) > width:
                 self._handle_long_word(chunks, cur_line, cur_len, width)
                 cur_len = sum(map(self._strlen, cur_line))
 
@@ -138,10 +152,10 @@ class TextWrapper(textwrap.TextWrapper):
 
             if cur_line:
                 if (self.max_lines is None or
-                        self._strlen(lines) + 1 < self.max_lines or
+                        len(lines) + 1 < self.max_lines or
                         (not chunks or
                          self.drop_whitespace and
-                         self._strlen(chunks) == 1 and
+                         len(chunks) == 1 and
                          not chunks[0].strip()) and cur_len <= width):
                     # Convert current line back to a string and store it in
                     # list of all lines (return value).
@@ -175,7 +189,7 @@ class TextWrapper(textwrap.TextWrapper):
         counter = 0
         for char in text:
             counter = counter + 1
-            charslen += self.char_widths[unicodedata.east_asian_width(char)]
+            charslen += display_width(char)
             if (charslen >= requested_len):
                 break
         return counter
@@ -214,17 +228,28 @@ class TextWrapper(textwrap.TextWrapper):
         return self._split(text)
 
 
+char_width_table = bytes(TextWrapper.char_widths[unicodedata.east_asian_width(chr(code))] for code in range(0x10000))
+"""Display width of the characters of the Basic Multilingual Plane"""
+
+
+def display_width(char: str) -> int:
+    code = ord(char)
+    if code < 0x10000:
+        return char_width_table[code]
+    return TextWrapper.char_widths[unicodedata.east_asian_width(char)]
+
+
+@functools.lru_cache(maxsize=16)
+def load_font(font_name: str, font_size: int) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(font_name, font_size)
+
+
 def text_to_image_raw(text, width=config.text_to_image.width, font_name=config.text_to_image.font_path,
                       font_size=config.text_to_image.font_size, offset_x=config.text_to_image.offset_x,
                       offset_y=config.text_to_image.offset_y):
-    # Create a draw object that can be used to measure the size of the text
-    draw = ImageDraw.Draw(Image.new('RGB', (width, 1)))
-
     # Use the specified font to measure the size of the text
-    font = ImageFont.truetype(font_name, font_size)
+    font = load_font(font_name, font_size)
     lines = text.split('\n')
-    line_lengths = [draw.textlength(line, font=font) for line in lines]
-    text_width = max(line_lengths)
     _, top, _, bottom = font.getbbox(text)
     text_height = bottom - top
     left, _, right, _ = font.getbbox('.')
@@ -249,15 +274,46 @@ def text_to_image_raw(text, width=config.text_to_image.width, font_name=config.t
     # Create a draw object that can be used to draw on the image
     draw = ImageDraw.Draw(image)
 
-    # Use the specified font to write the text on the image
-    font = ImageFont.truetype(font_name, font_size)
-
     # Draw the wrapped text on the image
     draw.text((offset_x, offset_y), '\n'.join(wrapped_text), font=font, fill='black')
 
     return image
 
 
+@functools.lru_cache(maxsize=4096)
+def has_glyph(font_name: str, font_size: int, char: str) -> bool:
+    """Whether the font has its own glyph for the character, the missing ones are drawn as the .notdef box"""
+    font = load_font(font_name, font_size)
+    mask = font.getmask(char)
+    # A code point of the private use plane, no font of ours has it
+    notdef = font.getmask('\U0010FFFD')
+    return mask.size != notdef.size or tuple(mask) != tuple(notdef)
+
+
+def can_draw_plain(text: str, font_name=config.text_to_image.font_path,
+                   font_size=config.text_to_image.font_size) -> bool:
+    """Whether text_to_image_plain draws the text like the browser, emoji and missing glyphs need the browser"""
+    return font_covers(text, lambda char: has_glyph(font_name, font_size, char))
+
+
+def text_to_image_plain(text, width=config.text_to_image.width, font_name=config.text_to_image.font_path,
+                        font_size=config.text_to_image.font_size):
+    """Lay plain text out like the Markdown template does, without the browser"""
+    # Same page as template.html: white background, black text, 30px padding and 1.6 line height
+    padding = 30
+    line_height = round(font_size * 1.6)
+    font = load_font(font_name, font_size)
+    left, _, right, _ = font.getbbox('.')
+    wrapper = TextWrapper(width=max(1, int((width - padding * 2) / (right - left))), break_long_words=True)
+    lines = list(itertools.chain.from_iterable(wrapper.wrap(line) or [''] for line in text.strip().split('\n')))
+
+    image = Image.new('RGB', (width, padding * 2 + line_height * len(lines)), color='white')
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(lines):
+        draw.text((padding, padding + i * line_height + (line_height - font_size) // 2), line, font=font, fill='black')
+    return image
+
+
 class DisableHTMLExtension(markdown.Extension):
     def extendMarkdown(self, md):
         md.inlinePatterns.deregister('html')
@@ -268,8 +324,35 @@ def makeExtension(*args, **kwargs):
     return DisableHTMLExtension(*args, **kwargs)
 
 
-def md_to_html(text: str) -> str:
-    text = text.replace("\n", "  \n")
+class CachedCodeHilite(CodeHilite):
+    """CodeHilite remembering the HTML of the code blocks it highlighted, guessed languages included"""
+    cache: OrderedDict[Tuple, str] = OrderedDict()
+    lock = threading.Lock()
+
+    def hilite(self, shebang=True):
+        key = (self.src, self.lang, shebang, self.guess_lang, self.use_pygments, self.lang_prefix,
+               repr(self.pygments_formatter), repr(sorted(self.options.items())))
+        with self.lock:
+            if (html := self.cache.get(key)) is not None:
+                self.cache.move_to_end(key)
+                return html
+        html = super().hilite(shebang)
+        with self.lock:
+            self.cache[key] = html
+            while len(self.cache) > config.text_to_image.highlight_cache_size:
+                self.cache.popitem(last=False)
+        return html
+
+
+# Both extensions look CodeHilite up in their own module when they highlight a block
+codehilite.CodeHilite = CachedCodeHilite
+fenced_code.CodeHilite = CachedCodeHilite
+
+markdown_pool: Deque[markdown.Markdown] = deque()
+"""Converters ready for the next text, a converter is not thread safe so each conversion takes its own"""
+
+
+def new_markdown() -> markdown.Markdown:
     extensions = [
         DisableHTMLExtension(),
         MathExtension(enable_dollar_delimiter=True),  # Turn on dollar sign rendering
@@ -277,94 +360,306 @@ def md_to_html(text: str) -> str:
         TableExtension(),
         'fenced_code'
     ]
-    md = markdown.Markdown(extensions=extensions)
-    h = md.convert(text)
-    # Get the CSS styles generated by Pygments
-    css_style = HtmlFormatter(style=XcodeStyle).get_style_defs('.highlight')
+    return markdown.Markdown(extensions=extensions)
+
 
-    # Insert CSS styles into HTML
-    h = f"<style>{css_style}</style>\n{h}"
+def md_to_html(text: str) -> str:
+    text = text.replace("\n", "  \n")
+    try:
+        md = markdown_pool.pop()
+    except IndexError:
+        md = new_markdown()
+    try:
+        h = md.convert(text)
+    finally:
+        md.reset()
+        markdown_pool.append(md)
+
+    # Insert the CSS styles generated by Pygments into HTML
+    h = f"<style>{highlight_css}</style>\n{h}"
     return h
 
 
-async def get_qr_data(text):
+qrcode_cache: OrderedDict[str, str] = OrderedDict()
+"""QR codes of the recently rendered texts, by hash of the text"""
+shared_texts: OrderedDict[str, str] = OrderedDict()
+"""Texts the HTTP service serves for the local QR codes, by hash of the text"""
+qrcode_uploads: Dict[str, asyncio.Task] = {}
+"""Pastebin uploads in progress, by hash of the text"""
+qrcode_failures: OrderedDict[str, float] = OrderedDict()
+"""When the upload of the texts failed, by hash of the text"""
+
+
+def remember(cache: OrderedDict, key: str, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > config.text_to_image.qrcode_cache_size:
+        cache.popitem(last=False)
+
+
+def make_qr_data(url: str) -> str:
+    image = qrcode.make(url)
+    buffered = BytesIO()
+    image.save(buffered, format="JPEG")
+    img_str = base64.b64encode(buffered.getvalue())
+    return "data:image/jpeg;base64," + img_str.decode('utf-8')
+
+
+async def upload_to_pastebin(text: str) -> str:
     """Save Markdown text to Mozilla Pastebin and get URL"""
     async with aiohttp.ClientSession() as session:
         payload = {'expires': '86400', 'format': 'url', 'lexer': '_markdown', 'content': text}
-        try:
-            async with session.post('https://pastebin.mozilla.org/api/',
-                                    data=payload) as resp:
-                resp.raise_for_status()
-                url = await resp.text()
-        except Exception as e:
-            url = f"upload failed: {str(e)}"
-        image = qrcode.make(url)
-        buffered = BytesIO()
-        image.save(buffered, format="JPEG")
-        img_str = base64.b64encode(buffered.getvalue())
-        return "data:image/jpeg;base64," + img_str.decode('utf-8')
-
-
-async def text_to_image(text):
-    ok = False
+        async with session.post('https://pastebin.mozilla.org/api/', data=payload) as resp:
+            resp.raise_for_status()
+            return (await resp.text()).strip()
+
+
+def share_text(text: str) -> str:
+    """Serve the text for its local QR code, returns its key"""
+    key = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    remember(shared_texts, key, text)
+    return key
+
+
+async def upload_qr_data(text: str, key: str) -> Optional[str]:
     try:
-        content = md_to_html(text)
-
-        image = None
-
-        asset_folder = os.path.join(os.getcwd(), 'assets', 'texttoimg')
-
-        font_path = os.path.join(os.getcwd(), config.text_to_image.font_path)
-
-        # Output html to string io stream
-        with StringIO() as output_file:
-            # fill text
-            html = template_html.replace('{path_texttoimg}', pathlib.Path(asset_folder).as_uri()) \
-                .replace("{qrcode}", await get_qr_data(text)) \
-                .replace("{content}", content) \
-                .replace("{font_size_texttoimg}", str(config.text_to_image.font_size)) \
-                .replace("{font_path_texttoimg}", pathlib.Path(font_path).as_uri())
-            output_file.write(html)
-
-            # Create temporary jpg file
-            temp_jpg_file = NamedTemporaryFile(mode='w+b', suffix='.png')
-            temp_jpg_filename = temp_jpg_file.name
-            temp_jpg_file.close()
-
-        imgkit_config = imgkit.config(wkhtmltoimage=config.text_to_image.wkhtmltoimage)
-        with StringIO(html) as input_file:
-            ok = False
-            try:
-                if config.text_to_image.wkhtmltoimage:
-                    # Call imgkit to convert html to images
-                    ok = await asyncio.get_event_loop().run_in_executor(None, imgkit.from_file, input_file,
-                                                                        temp_jpg_filename, {
-                                                                            "enable-local-file-access": "",
-                                                                            "allow": asset_folder,
-                                                                            "width": config.text_to_image.width,  # Image width
-                                                                        }, None, None, None, imgkit_config)
-                    # Call PIL to read the image as JPEG，RGB format
-                    image = Image.open(temp_jpg_filename, formats=['PNG']).convert('RGB')
-                    ok = True
-                else:
-                    ok = False
-            except Exception as e:
-                logger.exception(e)
-            finally:
-                # Delete temporary files
-                if os.path.exists(temp_jpg_filename):
-                    os.remove(temp_jpg_filename)
+        url = await asyncio.wait_for(upload_to_pastebin(text), config.text_to_image.qrcode_timeout)
+        data = await asyncio.get_event_loop().run_in_executor(None, make_qr_data, url)
+    except Exception as e:
+        logger.warning(f"[TextToImage] Failed to upload the Markdown to pastebin: {e!r}")
+        remember(qrcode_failures, key, time.monotonic())
+        return None
+    finally:
+        qrcode_uploads.pop(key, None)
+    remember(qrcode_cache, key, data)
+    return data
+
+
+async def get_qr_data(text: str) -> Optional[str]:
+    """QR code linking to the Markdown text, empty when turned off, None when it could not be made"""
+    mode = config.text_to_image.qrcode
+    if mode == "off":
+        return ''
+    if mode == "local":
+        if not config.text_to_image.qrcode_url:
+            logger.warning("[TextToImage] qrcode_url is needed for local QR codes")
+            return ''
+        key = share_text(text)
+    else:
+        key = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    if data := qrcode_cache.get(key):
+        qrcode_cache.move_to_end(key)
+        return data
+
+    if mode == "local":
+        url = f"{config.text_to_image.qrcode_url.rstrip('/')}/v1/markdown/{key}"
+        data = await asyncio.get_event_loop().run_in_executor(None, make_qr_data, url)
+        remember(qrcode_cache, key, data)
+        return data
+    if (failed := qrcode_failures.get(key)) is not None \
+            and time.monotonic() - failed < config.text_to_image.qrcode_retry:
+        return None
+    if (upload := qrcode_uploads.get(key)) is None:
+        upload = qrcode_uploads[key] = asyncio.create_task(upload_qr_data(text, key))
+    # The upload goes on for the next image of the text when the caller stops waiting
+    return await asyncio.shield(upload)
+
+
+def split_pages(text: str, page_height: int, max_pages: int) -> List[str]:
+    """Cut Markdown text between its blocks into pages of about page_height pixels once rendered"""
+    # Estimated on the template: 30px padding, 1.6 line height and half-width characters of half the font size
+    line_height = config.text_to_image.font_size * 1.6
+    columns = max(1, (config.text_to_image.width - 60) * 2 // config.text_to_image.font_size)
+
+    # Blocks are separated by blank lines, except in code and math blocks
+    blocks: List[List[str]] = [[]]
+    fence = None
+    for line in text.split('\n'):
+        stripped = line.strip()
+        if not stripped and fence is None:
+            if blocks[-1]:
+                blocks.append([])
+            continue
+        marker = '$$' if stripped == '$$' else stripped[:3] if stripped.startswith(('```', '~~~')) else None
+        if marker and fence is None:
+            fence = marker
+        elif marker == fence:
+            fence = None
+        blocks[-1].append(line)
+
+    pages = []
+    page: List[str] = []
+    height = 0.0
+    for block in filter(None, blocks):
+        lines = sum(max(1, math.ceil((len(line) if line.isascii() else sum(map(display_width, line))) / columns))
+                    for line in block)
+        block_height = (lines + 1) * line_height
+        if page and height + block_height > page_height and len(pages) < max_pages - 1:
+            pages.append('\n\n'.join(page))
+            page, height = [], 0.0
+        page.append('\n'.join(block))
+        height = height + block_height
+    if page:
+        pages.append('\n\n'.join(page))
+    return pages
+
+
+asset_folder = os.path.join(os.getcwd(), 'assets', 'texttoimg')
+
+
+def warm_up():
+    """Load the Markdown extensions and Pygments lexers before the first image of a renderer process"""
+    md_to_html("# warm up\n\n```python\nprint('ok')\n```\n$x$")
+
+
+def fill_template(content: str, qr_data: str) -> str:
+    font_path = os.path.join(os.getcwd(), config.text_to_image.font_path)
+    return template_html.replace('{path_texttoimg}', pathlib.Path(asset_folder).as_uri()) \
+        .replace("{qrcode_display}", "block" if qr_data else "none") \
+        .replace("{qrcode}", qr_data) \
+        .replace("{content}", content) \
+        .replace("{font_size_texttoimg}", str(config.text_to_image.font_size)) \
+        .replace("{font_path_texttoimg}", pathlib.Path(font_path).as_uri())
+
+
+def render_page(html: str) -> Optional[bytes]:
+    """Render an HTML page to PNG bytes with wkhtmltoimage, runs in a renderer process"""
+    if not config.text_to_image.wkhtmltoimage:
+        return None
+    # The page comes in on stdin and the PNG goes out on stdout, no temporary files
+    result = subprocess.run([config.text_to_image.wkhtmltoimage, "--quiet", "--enable-local-file-access",
+                             "--allow", asset_folder, "--width", str(config.text_to_image.width),
+                             "--format", "png", "-", "-"],
+                            input=html.encode('utf-8'), capture_output=True,
+                            timeout=config.text_to_image.renderer_timeout)
+    if result.returncode != 0 or not result.stdout:
+        raise RuntimeError(f"wkhtmltoimage failed: {result.stderr.decode('utf-8', 'replace').strip()}")
+    return result.stdout
+
+
+renderer_pool = RendererPool(config.text_to_image.renderer_workers, config.text_to_image.renderer_max_tasks,
+                             config.text_to_image.renderer_timeout,
+                             config.text_to_image.renderer_health_check_interval, warm_up,
+                             # Each worker imports the main module again, which mostly imports constants
+                             preload=["constants", "utils.text_to_img"])
+
+
+image_cache = ImageCache(config.text_to_image.cache_memory_mb * 1024 * 1024, config.text_to_image.cache_path,
+                         config.text_to_image.cache_disk_mb * 1024 * 1024, config.text_to_image.cache_ttl)
+
+
+def encode_png(image: Image.Image) -> bytes:
+    b = BytesIO()
+    image.save(b, format="png")
+    return b.getvalue()
+
+
+def text_to_png_raw(text: str) -> bytes:
+    return encode_png(text_to_image_raw(text))
+
+
+def text_to_png_plain(text: str) -> bytes:
+    return encode_png(text_to_image_plain(text))
+
+
+async def render_image(text) -> Tuple[bytes, bool]:
+    """Render Markdown text to PNG bytes, returns them and whether the image is complete and can be reused"""
+    # The QR code is made while a renderer process converts the Markdown
+    qr_task = asyncio.create_task(get_qr_data(text))
+    try:
+        content = await renderer_pool.run(md_to_html, text)
+        if config.text_to_image.qrcode == "local":
+            qr_data = await qr_task
+        else:
+            # Pastebin is not waited for, the image goes without QR code until the upload is done
+            qr_data = qr_task.result() if qr_task.done() else None
+        # wkhtmltoimage wrote the PNG to its stdout, the bytes are used as they are
+        if png := await renderer_pool.run(render_page, fill_template(content, qr_data or '')):
+            return png, qr_data is not None
     except Exception as e:
         logger.exception(e)
         logger.error("Markdown Rendering failed, using fallback mode")
-    if not ok or not image:
-        image = await asyncio.get_event_loop().run_in_executor(None, text_to_image_raw, text)
+    finally:
+        qr_task.cancel()
+    return await asyncio.get_event_loop().run_in_executor(None, text_to_png_raw, text), False
 
-    return image
+
+encoder_pool = ThreadPoolExecutor(config.text_to_image.encode_workers, thread_name_prefix="image-encode")
+"""Threads encoding the images to their output format, PIL lets go of the GIL while it encodes"""
+
+max_dimensions = {"png": 2 ** 31, "jpeg": 65500, "webp": 16383}
+"""Largest width or height each format can store"""
+
+
+def output_policy(platform: Optional[str]) -> ImageOutput:
+    return config.text_to_image.output.get(platform, config.text_to_image.default_output) \
+        if platform else config.text_to_image.default_output
 
 
-async def to_image(text) -> GraiaImage:
-    img = await text_to_image(text=str(text))
+def encode_image(image: Image.Image, output: ImageOutput, quality: int) -> bytes:
+    fmt = output.format if max(image.size) <= max_dimensions[output.format] else "png"
     b = BytesIO()
-    img.save(b, format="png")
-    return GraiaImage(text=text, data_bytes=b.getvalue())
\ No newline at end of file
+    if fmt == "png":
+        if output.colors and image.mode != 'P':
+            image = image.convert('RGB').quantize(output.colors)
+        image.save(b, format="png", optimize=output.optimize, compress_level=output.compress_level)
+    elif fmt == "jpeg":
+        image.convert('RGB').save(b, format="jpeg", quality=quality, optimize=output.optimize)
+    else:
+        image.save(b, format="webp", quality=quality, method=6 if output.optimize else 4)
+    return b.getvalue()
+
+
+def transcode(data: bytes, output: ImageOutput) -> bytes:
+    """Encode a rendered PNG the way the platform wants it"""
+    untouched = output.format == "png" and not output.optimize and output.compress_level == 6 and not output.colors
+    if untouched and (not output.max_bytes or len(data) <= output.max_bytes):
+        return data
+    image = Image.open(BytesIO(data), formats=['PNG'])
+    quality = output.quality
+    encoded = encode_image(image, output, quality)
+    while output.max_bytes and len(encoded) > output.max_bytes and min(image.size) > 100:
+        # Lossy formats give quality up first, then the image gets smaller
+        if output.format != "png" and quality > 40:
+            quality = max(40, quality - 15)
+        else:
+            image = image.resize((image.width * 3 // 4, image.height * 3 // 4), Image.LANCZOS)
+        encoded = encode_image(image, output, quality)
+    return encoded
+
+
+async def cached_image(key: str) -> Optional[bytes]:
+    if (data := image_cache.get(key)) is not None:
+        return data
+    if cached := await asyncio.get_event_loop().run_in_executor(None, image_cache.load, key):
+        created, data = cached
+        image_cache.put(key, data, created)
+        return data
+    image_cache.misses = image_cache.misses + 1
+    return None
+
+
+async def to_image(text, plain: bool = False, platform: Optional[str] = None) -> GraiaImage:
+    """Render text to an image for a platform, plain text skips the Markdown renderer"""
+    text = str(text)
+    output = output_policy(platform)
+    key = image_cache.key(text, "plain" if plain else template_html, config.text_to_image.width,
+                          config.text_to_image.font_path, config.text_to_image.font_size, repr(output),
+                          config.text_to_image.qrcode, config.text_to_image.qrcode_url)
+    if image_cache.max_memory and (data := await cached_image(key)) is not None:
+        if not plain and config.text_to_image.qrcode == "local" and config.text_to_image.qrcode_url:
+            # The QR code of the cached image links to the text, which may have been dropped since
+            share_text(text)
+        return GraiaImage(text=text, data_bytes=data)
+
+    loop = asyncio.get_event_loop()
+    if plain:
+        data, rendered = await loop.run_in_executor(encoder_pool, text_to_png_plain, text), True
+    else:
+        data, rendered = await render_image(text)
+    data = await loop.run_in_executor(encoder_pool, transcode, data, output)
+    # Fallback images and images missing their QR code are not cached, the next request tries again
+    if image_cache.max_memory and rendered:
+        image_cache.put(key, data)
+        await loop.run_in_executor(None, image_cache.store, key, data)
+    return GraiaImage(text=text, data_bytes=data)
@@ -1,7 +1,6 @@
 import os
 from enum import Enum
 
-from tempfile import NamedTemporaryFile
 from typing import Optional
 
 from graia.ariadne.message.element import Plain, Voice
@@ -114,26 +113,16 @@ async def get_tts_voice(elem, conversation_context, voice_type=VoiceType.Wav) ->
     if not isinstance(elem, Plain) or not str(elem):
         return None
 
-    voice_suffix = f".{voice_type.value}"
-
-    output_file = NamedTemporaryFile(mode='w+b', suffix=voice_suffix, delete=False)
-    output_file.close()
-
     logger.debug(f"[TextToSpeech]  - {conversation_context.session_id}")
     if config.text_to_speech.engine == "azure":
-        tts_output_file_name = (f"{output_file.name}.{VoiceType.Wav.value}"
-                                if voice_type == VoiceType.Silk else output_file.name)
-        if await synthesize_speech(
-                str(elem),
-                tts_output_file_name,
-                conversation_context.conversation_voice
-        ):
-            voice = Voice(path=tts_output_file_name)
+        # Silk is encoded from the WAV audio
+        audio_format = "mp3" if voice_type == VoiceType.Mp3 else "wav"
+        if audio := await synthesize_speech(str(elem), conversation_context.conversation_voice, audio_format):
             if voice_type == VoiceType.Silk:
-                voice = Voice(data_bytes=await encode_to_silk(await voice.get_bytes()))
+                audio = await encode_to_silk(audio)
 
-            logger.debug(f"[TextToSpeech]  - {output_file.name} - {conversation_context.session_id}")
-            return voice
+            logger.debug(f"[TextToSpeech]  - {len(audio)} bytes - {conversation_context.session_id}")
+            return Voice(data_bytes=audio)
 
     else:
         raise ValueError("The text-to-audio engine does not exist. Please check whether the configuration file is correct.")
\ No newline at end of file